@@ -11,13 +11,19 @@ from kafka.conn import KafkaConnection
 from kafka.protocol import (
     create_message, create_gzip_message, create_snappy_message
 )
-from kafka.producer import SimpleProducer, KeyedProducer
-from kafka.partitioner import RoundRobinPartitioner, HashedPartitioner
+from kafka.producer import (
+    SimpleProducer, KeyedProducer, MultiProcessProducer
+)
+from kafka.partitioner import (
+    RoundRobinPartitioner, HashedPartitioner, Murmur2Partitioner,
+    JumpHashPartitioner, LoadAwarePartitioner
+)
 from kafka.consumer import SimpleConsumer, MultiProcessConsumer, KafkaConsumer
 
 __all__ = [
     'KafkaClient', 'KafkaConnection', 'SimpleProducer', 'KeyedProducer',
-    'RoundRobinPartitioner', 'HashedPartitioner', 'SimpleConsumer',
-    'MultiProcessConsumer', 'create_message', 'create_gzip_message',
-    'create_snappy_message', 'KafkaConsumer',
+    'MultiProcessProducer', 'RoundRobinPartitioner', 'HashedPartitioner',
+    'Murmur2Partitioner', 'JumpHashPartitioner', 'LoadAwarePartitioner',
+    'SimpleConsumer', 'MultiProcessConsumer', 'create_message',
+    'create_gzip_message', 'create_snappy_message', 'KafkaConsumer',
 ]
@@ -0,0 +1,198 @@
+"""
+Chunked messages: splitting large values into fixed-size chunk messages on
+the producer side, and putting them back together on the consumer side.
+
+Each chunk value starts with a small header (see CHUNK_HEADER_SIZE) that
+identifies the message it belongs to, its index and the number of chunks.
+Values up to chunk_size are sent unchanged, so producers and consumers that
+opt in still exchange regular messages with everyone else. A value that
+happens to start with CHUNK_MAGIC is sent as a single chunk.
+
+Example:
+
+.. code:: python
+
+    producer = SimpleProducer(client, chunk_size=64 * 1024)
+    consumer = SimpleConsumer(client, group, topic, reassemble_chunks=True)
+"""
+from __future__ import absolute_import
+
+import logging
+import struct
+import uuid
+from collections import OrderedDict
+
+from kafka.util import buffer_view
+
+log = logging.getLogger("kafka")
+
+CHUNK_MAGIC = b'\x00KCH'
+
+# Magic (4 bytes) + MessageId (16 bytes) + ChunkIndex (int32) +
+# ChunkCount (int32)
+CHUNK_HEADER_SIZE = 28
+
+DEFAULT_CHUNK_SIZE = 16 * 1024
+DEFAULT_MAX_PENDING_CHUNK_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_PENDING_CHUNK_OFFSETS = 100000
+
+
+def chunk_value(value, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Split a message value into chunk values of at most chunk_size bytes of
+    payload (plus CHUNK_HEADER_SIZE)
+
+    Returns a list of values to send, in order, to the same partition
+    (only [value] if it does not need to be chunked)
+    """
+    value = buffer_view(value)
+    if (len(value) <= chunk_size and
+            bytes(value[:len(CHUNK_MAGIC)]) != CHUNK_MAGIC):
+        return [value]
+
+    message_id = uuid.uuid4().bytes
+    count = max(1, (len(value) + chunk_size - 1) // chunk_size)
+    return [b''.join([CHUNK_MAGIC,
+                      struct.pack('>16sii', message_id, index, count),
+                      value[index * chunk_size:(index + 1) * chunk_size]])
+            for index in range(count)]
+
+
+class _PendingMessage(object):
+    def __init__(self, partition, offset, count):
+        self.partition = partition
+        self.offset = offset  # of the first chunk
+        self.chunks = [None] * count
+        self.missing = count
+        self.size = 0
+
+
+class Reassembler(object):
+    """
+    Puts chunked messages (see chunk_value) back together.
+
+    Chunks are held until all the chunks of their message have been added,
+    up to max_pending_bytes in total; past that the oldest incomplete
+    messages are dropped. Since the messages are incomplete until their last
+    chunk, consumers must not commit past the first chunk of a pending
+    message (see commit_offset), so that it is read again after a restart.
+    A message whose producer died half way (its last chunks never come) is
+    dropped once the partition has moved max_pending_offsets past its first
+    chunk, so that it does not hold the commit offset back for good.
+
+    Dropped messages are counted in dropped, and passed to on_drop if set.
+
+    Arguments:
+        max_pending_bytes: bound of the chunks held for incomplete messages
+        max_pending_offsets: number of offsets past the first chunk of an
+            incomplete message after which it is dropped (None for no limit)
+        on_drop: called as on_drop(partition, offset) with the offset of the
+            first chunk of each dropped incomplete message
+    """
+    def __init__(self, max_pending_bytes=DEFAULT_MAX_PENDING_CHUNK_BYTES,
+                 max_pending_offsets=DEFAULT_MAX_PENDING_CHUNK_OFFSETS,
+                 on_drop=None):
+        self.max_pending_bytes = max_pending_bytes
+        self.max_pending_offsets = max_pending_offsets
+        self.on_drop = on_drop
+        self.pending = OrderedDict()  # (partition, id) -> _PendingMessage
+        self.pending_bytes = 0
+        self.dropped = 0
+
+    def add(self, partition, offset, value):
+        """
+        Add the value of the message at offset in partition (any hashable,
+        e.g. a partition number or a (topic, partition) tuple)
+
+        Returns the value of the message it completes: value itself if it is
+        not a chunk, or the reassembled value for the last chunk of a
+        message. Returns None while the message is incomplete.
+        """
+        if self.pending and self.max_pending_offsets is not None:
+            self._expire(partition, offset)
+        if value is None or value[:len(CHUNK_MAGIC)] != CHUNK_MAGIC:
+            return value
+        if len(value) < CHUNK_HEADER_SIZE:
+            # Too short for a chunk, from a producer not chunking values
+            return value
+        (message_id, index, count) = struct.unpack_from('>16sii', value,
+                                                        len(CHUNK_MAGIC))
+        if not 0 <= index < count:
+            log.warning("Invalid chunk %d/%d at offset %d of %s",
+                        index + 1, count, offset, partition)
+            return None
+        key = (partition, message_id)
+
+        message = self.pending.get(key)
+        if message is None:
+            if index != 0:
+                log.debug("Dropping chunk %d/%d at offset %d of %s, "
+                          "its first chunk was not seen", index + 1, count,
+                          offset, partition)
+                return None
+            message = _PendingMessage(partition, offset, count)
+            self.pending[key] = message
+
+        if index >= len(message.chunks):
+            log.warning("Invalid chunk %d/%d at offset %d of %s",
+                        index + 1, count, offset, partition)
+            return None
+
+        if message.chunks[index] is None:
+            message.chunks[index] = value[CHUNK_HEADER_SIZE:]
+            message.missing -= 1
+            message.size += len(value) - CHUNK_HEADER_SIZE
+            self.pending_bytes += len(value) - CHUNK_HEADER_SIZE
+
+        if not message.missing:
+            del self.pending[key]
+            self.pending_bytes -= message.size
+            return b''.join(message.chunks)
+
+        while self.pending_bytes > self.max_pending_bytes:
+            (oldest, dropped) = next(iter(self.pending.items()))
+            log.warning("Dropping incomplete chunked message at offset %d "
+                        "of %s, over %d pending bytes", dropped.offset,
+                        dropped.partition, self.max_pending_bytes)
+            self._drop(oldest)
+        return None
+
+    def _expire(self, partition, offset):
+        """
+        Drop the incomplete messages of partition that started more than
+        max_pending_offsets before offset
+        """
+        for key, message in list(self.pending.items()):
+            if (message.partition == partition and
+                    offset - message.offset > self.max_pending_offsets):
+                log.warning("Dropping incomplete chunked message at offset "
+                            "%d of %s, still incomplete at offset %d",
+                            message.offset, partition, offset)
+                self._drop(key)
+
+    def _drop(self, key):
+        message = self.pending.pop(key)
+        self.pending_bytes -= message.size
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(message.partition, message.offset)
+
+    def commit_offset(self, partition, offset):
+        """
+        Returns the offset to commit for partition instead of offset: the
+        offset of the first chunk of its oldest incomplete message, if lower
+        """
+        for message in self.pending.values():
+            if message.partition == partition:
+                offset = min(offset, message.offset)
+        return offset
+
+    def reset(self, partition=None):
+        """
+        Drop the incomplete messages of partition (all if None), e.g. after
+        the consumer offsets have been moved
+        """
+        for key, message in list(self.pending.items()):
+            if partition is None or message.partition == partition:
+                del self.pending[key]
+                self.pending_bytes -= message.size
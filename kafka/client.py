@@ -3,6 +3,8 @@ import collections
 import copy
 import functools
 import logging
+import select
+import socket
 import time
 import kafka.common
 
@@ -10,7 +12,10 @@ from kafka.common import (TopicAndPartition, BrokerMetadata,
                           ConnectionError, FailedPayloadsError,
                           KafkaTimeoutError, KafkaUnavailableError,
                           LeaderNotAvailableError, UnknownTopicOrPartitionError,
-                          NotLeaderForPartitionError, ReplicaNotAvailableError)
+                          NotLeaderForPartitionError, ReplicaNotAvailableError,
+                          ConsumerCoordinatorNotAvailableError,
+                          NotCoordinatorForConsumerError,
+                          OffsetsLoadInProgressError)
 
 from kafka.conn import collect_hosts, KafkaConnection, DEFAULT_SOCKET_TIMEOUT_SECONDS
 from kafka.protocol import KafkaProtocol
@@ -18,6 +23,14 @@ from kafka.util import kafka_bytestring
 
 log = logging.getLogger("kafka")
 
+# Weight of the previous value in the broker latency moving average
+LATENCY_DECAY = 0.8
+
+# Retries (and seconds between them) of the requests to a group coordinator
+# still loading the offsets of the group
+OFFSETS_LOAD_RETRIES = 5
+OFFSETS_LOAD_BACKOFF = 0.5
+
 
 class KafkaClient(object):
 
@@ -26,9 +39,11 @@ class KafkaClient(object):
     # NOTE: The timeout given to the client should always be greater than the
     # one passed to SimpleConsumer.get_message(), otherwise you can get a
     # socket timeout.
+    # Set bootstrap_metadata to False to skip loading the metadata of every
+    # topic, e.g. to load only the topics used with load_metadata_for_topics
     def __init__(self, hosts, client_id=CLIENT_ID,
                  timeout=DEFAULT_SOCKET_TIMEOUT_SECONDS,
-                 correlation_id=0):
+                 correlation_id=0, bootstrap_metadata=True):
         # We need one connection to bootstrap
         self.client_id = kafka_bytestring(client_id)
         self.timeout = timeout
@@ -40,8 +55,14 @@ class KafkaClient(object):
         self.brokers = {}            # broker_id -> BrokerMetadata
         self.topics_to_brokers = {}  # TopicAndPartition -> BrokerMetadata
         self.topic_partitions = {}   # topic -> partition -> PartitionMetadata
+        self.coordinators = {}       # group -> BrokerMetadata of its coordinator
+
+        # produce load observed per broker (shared with copies of the client)
+        self.broker_inflight_bytes = collections.defaultdict(int)  # broker_id -> bytes
+        self.broker_latency = {}     # broker_id -> moving average (seconds)
 
-        self.load_metadata_for_topics()  # bootstrap with all metadata
+        if bootstrap_metadata:
+            self.load_metadata_for_topics()  # bootstrap with all metadata
 
 
     ##################
@@ -97,6 +118,21 @@ class KafkaClient(object):
         # Otherwise return the BrokerMetadata
         return self.brokers[meta.leader]
 
+    def _get_coordinator_for_group(self, group):
+        """
+        Returns the coordinator of a consumer group (the broker storing its
+        offsets in Kafka), cached until a request to it fails.
+
+        ConsumerCoordinatorNotAvailableError is raised while the cluster
+        is creating its offsets topic
+        """
+        if group not in self.coordinators:
+            resp = self.send_consumer_metadata_request(group)
+            kafka.common.check_error(resp)
+            self.coordinators[group] = BrokerMetadata(resp.nodeId, resp.host,
+                                                      resp.port)
+        return self.coordinators[group]
+
     def _next_id(self):
         """Generate a new correlation id"""
         # modulo to keep w/i int32
@@ -126,7 +162,55 @@ class KafkaClient(object):
 
         raise KafkaUnavailableError("All servers failed to process request")
 
-    def _send_broker_aware_request(self, payloads, encoder_fn, decoder_fn):
+    def _track_broker_load(self, broker, num_bytes, latency, failed):
+        """
+        Update the in-flight bytes and latency average of a broker after
+        a request to it completed (or failed). The latency is left out if
+        it is None (not measured)
+        """
+        self.broker_inflight_bytes[broker.nodeId] -= num_bytes
+
+        # Count failures as a full socket timeout so that load-aware
+        # partitioners route away from the broker
+        if failed:
+            latency = self.timeout
+        if latency is None:
+            return
+        prev = self.broker_latency.get(broker.nodeId)
+        if prev is not None:
+            latency = (LATENCY_DECAY * prev +
+                       (1 - LATENCY_DECAY) * latency)
+        self.broker_latency[broker.nodeId] = latency
+
+    def _iter_responses(self, sent):
+        """
+        Yields the entries of sent (see _send_broker_aware_request) in the
+        order their responses arrive, waiting on the connections with
+        select, with the time each response became readable (None if it
+        could not be told, e.g. for connections without a socket)
+        """
+        pending = list(sent)
+        while pending:
+            try:
+                (readable, _, _) = select.select(
+                    [entry[1] for entry in pending], [], [], self.timeout)
+            except (TypeError, ValueError, select.error, socket.error,
+                    ConnectionError):
+                for entry in pending:
+                    yield entry, None
+                return
+
+            ready_at = time.time()
+            ready = [entry for entry in pending if entry[1] in readable]
+            if not ready:
+                # Timed out, recv fails the next one
+                ready, ready_at = pending[:1], None
+            for entry in ready:
+                pending.remove(entry)
+                yield entry, ready_at
+
+    def _send_broker_aware_request(self, payloads, encoder_fn, decoder_fn,
+                                   track_load=False):
         """
         Group a list of request payloads by topic+partition and send them to
         the leader broker for that partition using the supplied encode/decode
@@ -145,6 +229,9 @@ class KafkaClient(object):
             The response objects must be object-like and have topic
             and partition attributes
 
+        track_load: if True, update broker_inflight_bytes and broker_latency
+            for each broker the request is sent to
+
         Returns:
 
         List of response objects in the same order as the supplied payloads
@@ -163,17 +250,23 @@ class KafkaClient(object):
             payloads_by_broker[leader].append(payload)
             brokers_for_payloads.append(leader)
 
-        # For each broker, send the list of request payloads
-        # and collect the responses and errors
+        # Send the list of request payloads to every broker first, then
+        # collect the responses and errors, so that the brokers handle
+        # their requests concurrently
         responses_by_broker = collections.defaultdict(list)
         broker_failures = []
+        sent = []
         for broker, payloads in payloads_by_broker.items():
             conn = self._get_conn(broker.host.decode('utf-8'), broker.port)
             requestId = self._next_id()
             request = encoder_fn(client_id=self.client_id,
                                  correlation_id=requestId, payloads=payloads)
 
-            # Send the request, recv the response
+            start = time.time()
+            if track_load:
+                self.broker_inflight_bytes[broker.nodeId] += len(request)
+
+            # Send the request
             try:
                 conn.send(requestId, request)
 
@@ -185,32 +278,55 @@ class KafkaClient(object):
                 for payload in payloads:
                     responses_by_broker[broker].append(FailedPayloadsError(payload))
 
-            # No exception, try to get response
+            # No exception, get the response below
             else:
 
                 # decoder_fn=None signal that the server  is expected to not
                 # send a response.  This probably only applies to
                 # ProduceRequest w/ acks = 0
-                if decoder_fn is None:
-                    for payload in payloads:
-                        responses_by_broker[broker].append(None)
+                if decoder_fn is not None:
+                    sent.append((broker, conn, requestId, request, payloads,
+                                 start))
                     continue
 
-                try:
-                    response = conn.recv(requestId)
-                except ConnectionError as e:
-                    broker_failures.append(broker)
-                    log.warning("Could not receive response to request [%s] "
-                                "from server %s: %s",
-                                binascii.b2a_hex(request), conn, e)
+                for payload in payloads:
+                    responses_by_broker[broker].append(None)
 
-                    for payload in payloads:
-                        responses_by_broker[broker].append(FailedPayloadsError(payload))
+            if track_load:
+                self._track_broker_load(broker, len(request),
+                                        time.time() - start,
+                                        broker in broker_failures)
 
-                else:
+        responses = self._iter_responses(sent)
+        for i, (entry, ready_at) in enumerate(responses):
+            (broker, conn, requestId, request, payloads, start) = entry
+            try:
+                response = conn.recv(requestId)
+            except ConnectionError as e:
+                broker_failures.append(broker)
+                log.warning("Could not receive response to request [%s] "
+                            "from server %s: %s",
+                            binascii.b2a_hex(request), conn, e)
 
-                    for payload_response in decoder_fn(response):
-                        responses_by_broker[broker].append(payload_response)
+                for payload in payloads:
+                    responses_by_broker[broker].append(FailedPayloadsError(payload))
+
+            else:
+
+                for payload_response in decoder_fn(response):
+                    responses_by_broker[broker].append(payload_response)
+            finally:
+                if track_load:
+                    # Each broker is timed from its own response, not from
+                    # when the responses before it were read
+                    if ready_at is not None:
+                        latency = ready_at - start
+                    elif i == 0:
+                        latency = time.time() - start
+                    else:
+                        latency = None
+                    self._track_broker_load(broker, len(request), latency,
+                                            broker in broker_failures)
 
         # Connection errors generally mean stale metadata
         # although sometimes it means incorrect api request
@@ -225,6 +341,67 @@ class KafkaClient(object):
         log.debug('Responses: %s' % responses_by_payload)
         return responses_by_payload
 
+    def _send_consumer_aware_request(self, group, payloads, encoder_fn,
+                                     decoder_fn):
+        """
+        Send a list of request payloads to the coordinator of a consumer
+        group, in one request. If the coordinator moved, it is looked up
+        and the request sent again, once. While the coordinator is loading
+        the offsets of the group, the request is sent again after
+        OFFSETS_LOAD_BACKOFF seconds, up to OFFSETS_LOAD_RETRIES times.
+
+        Returns:
+
+        List of response objects (or FailedPayloadsError) in the same order
+        as the supplied payloads
+        """
+        coordinator_errors = (ConsumerCoordinatorNotAvailableError.errno,
+                              NotCoordinatorForConsumerError.errno)
+        coordinator_retries = 1
+        load_retries = OFFSETS_LOAD_RETRIES
+        while True:
+            broker = self._get_coordinator_for_group(group)
+            conn = self._get_conn(broker.host.decode('utf-8'), broker.port)
+            requestId = self._next_id()
+            request = encoder_fn(client_id=self.client_id,
+                                 correlation_id=requestId, payloads=payloads)
+            try:
+                conn.send(requestId, request)
+                response = conn.recv(requestId)
+            except ConnectionError as e:
+                log.warning("Could not send request [%s] to coordinator %s: %s",
+                            binascii.b2a_hex(request), conn, e)
+                self.coordinators.pop(group, None)
+                responses = [FailedPayloadsError(payload) for payload in payloads]
+                if not coordinator_retries:
+                    break
+                coordinator_retries -= 1
+                continue
+
+            responses_by_partition = dict(
+                ((resp.topic, resp.partition), resp)
+                for resp in decoder_fn(response))
+            responses = [responses_by_partition.get(
+                (payload.topic, payload.partition), FailedPayloadsError(payload))
+                for payload in payloads]
+            errors = set(getattr(resp, 'error', None) for resp in responses)
+
+            if errors.intersection(coordinator_errors):
+                self.coordinators.pop(group, None)
+                if not coordinator_retries:
+                    break
+                coordinator_retries -= 1
+            elif OffsetsLoadInProgressError.errno in errors and load_retries:
+                log.info("Coordinator of group %s is loading its offsets, "
+                         "retrying in %.1fs", group, OFFSETS_LOAD_BACKOFF)
+                load_retries -= 1
+                time.sleep(OFFSETS_LOAD_BACKOFF)
+            else:
+                break
+
+        log.debug('Responses: %s' % responses)
+        return responses
+
     def __repr__(self):
         return '<KafkaClient client_id=%s>' % (self.client_id)
 
@@ -259,6 +436,11 @@ class KafkaClient(object):
         c = copy.deepcopy(self)
         for key in c.conns:
             c.conns[key] = self.conns[key].copy()
+
+        # Share broker load stats, so that load observed by a copy (e.g. in
+        # an async producer thread) is visible to the original
+        c.broker_inflight_bytes = self.broker_inflight_bytes
+        c.broker_latency = self.broker_latency
         return c
 
     def reinit(self):
@@ -276,6 +458,7 @@ class KafkaClient(object):
     def reset_all_metadata(self):
         self.topics_to_brokers.clear()
         self.topic_partitions.clear()
+        self.coordinators.clear()
 
     def has_metadata_for_topic(self, topic):
         topic = kafka_bytestring(topic)
@@ -453,7 +636,8 @@ class KafkaClient(object):
         else:
             decoder = KafkaProtocol.decode_produce_response
 
-        resps = self._send_broker_aware_request(payloads, encoder, decoder)
+        resps = self._send_broker_aware_request(payloads, encoder, decoder,
+                                                track_load=True)
 
         return [resp if not callback else callback(resp) for resp in resps
                 if resp is not None and
@@ -509,3 +693,48 @@ class KafkaClient(object):
 
         return [resp if not callback else callback(resp) for resp in resps
                 if not fail_on_error or not self._raise_on_response_error(resp)]
+
+    def send_consumer_metadata_request(self, group):
+        """
+        Find the coordinator of a consumer group, which stores its offsets
+        in Kafka (Kafka 0.8.2+). Returns a ConsumerMetadataResponse
+        """
+        return self._send_broker_unaware_request(
+            kafka_bytestring(group),
+            KafkaProtocol.encode_consumer_metadata_request,
+            KafkaProtocol.decode_consumer_metadata_response)
+
+    def send_offset_commit_request_kafka(self, group, payloads=[],
+                                         fail_on_error=True, callback=None,
+                                         version=1):
+        """
+        Commit offsets to Kafka rather than zookeeper, through the
+        coordinator of the group (Kafka 0.8.2+, version 2 needs 0.9+)
+        """
+        group = kafka_bytestring(group)
+        encoder = functools.partial(
+            KafkaProtocol.encode_offset_commit_request,
+            group=group, version=version)
+        decoder = KafkaProtocol.decode_offset_commit_response
+        resps = self._send_consumer_aware_request(group, payloads, encoder,
+                                                  decoder)
+
+        return [resp if not callback else callback(resp) for resp in resps
+                if not fail_on_error or not self._raise_on_response_error(resp)]
+
+    def send_offset_fetch_request_kafka(self, group, payloads=[],
+                                        fail_on_error=True, callback=None):
+        """
+        Fetch offsets stored in Kafka rather than zookeeper, through the
+        coordinator of the group (Kafka 0.8.2+)
+        """
+        group = kafka_bytestring(group)
+        encoder = functools.partial(
+            KafkaProtocol.encode_offset_fetch_request,
+            group=group, version=1)
+        decoder = KafkaProtocol.decode_offset_fetch_response
+        resps = self._send_consumer_aware_request(group, payloads, encoder,
+                                                  decoder)
+
+        return [resp if not callback else callback(resp) for resp in resps
+                if not fail_on_error or not self._raise_on_response_error(resp)]
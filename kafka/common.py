@@ -47,6 +47,10 @@ OffsetFetchRequest = namedtuple("OffsetFetchRequest",
 OffsetFetchResponse = namedtuple("OffsetFetchResponse",
     ["topic", "partition", "offset", "metadata", "error"])
 
+# https://cwiki.apache.org/confluence/display/KAFKA/A+Guide+To+The+Kafka+Protocol#AGuideToTheKafkaProtocol-ConsumerMetadataRequest
+ConsumerMetadataResponse = namedtuple("ConsumerMetadataResponse",
+    ["error", "nodeId", "host", "port"])
+
 
 
 # Other useful structs
@@ -65,12 +69,22 @@ OffsetAndMessage = namedtuple("OffsetAndMessage",
 Message = namedtuple("Message",
     ["magic", "attributes", "key", "value"])
 
+# A MessageSet already in wire format (e.g. from kafka.vectorized), usable
+# in place of a list of Messages in a ProduceRequest
+EncodedMessageSet = namedtuple("EncodedMessageSet",
+    ["buffer", "count"])
+
 TopicAndPartition = namedtuple("TopicAndPartition",
     ["topic", "partition"])
 
 KafkaMessage = namedtuple("KafkaMessage",
     ["topic", "partition", "offset", "key", "value"])
 
+# Messages and bytes sent by Producer.flush(), messages that could not be
+# sent, and how long it took (in seconds)
+FlushResult = namedtuple("FlushResult",
+    ["messages", "bytes", "failed", "duration"])
+
 
 #################
 #   Exceptions  #
@@ -155,6 +169,21 @@ class StaleLeaderEpochCodeError(BrokerResponseError):
     message = 'STALE_LEADER_EPOCH_CODE'
 
 
+class OffsetsLoadInProgressError(BrokerResponseError):
+    errno = 14
+    message = 'OFFSETS_LOAD_IN_PROGRESS'
+
+
+class ConsumerCoordinatorNotAvailableError(BrokerResponseError):
+    errno = 15
+    message = 'CONSUMER_COORDINATOR_NOT_AVAILABLE'
+
+
+class NotCoordinatorForConsumerError(BrokerResponseError):
+    errno = 16
+    message = 'NOT_COORDINATOR_FOR_CONSUMER'
+
+
 class KafkaUnavailableError(KafkaError):
     pass
 
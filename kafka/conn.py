@@ -138,6 +138,15 @@ class KafkaConnection(local):
             log.exception('Unable to send payload to Kafka')
             self._raise_connection_error()
 
+    def fileno(self):
+        """
+        The file descriptor of the socket, so that connections can be
+        waited on with select
+        """
+        if not self._sock:
+            self._raise_connection_error()
+        return self._sock.fileno()
+
     def recv(self, request_id):
         """
         Get a response packet from Kafka
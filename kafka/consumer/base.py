@@ -3,7 +3,10 @@ from __future__ import absolute_import
 import atexit
 import logging
 import numbers
-from threading import Lock
+import time
+from threading import Condition, Lock, Thread
+
+import six
 
 import kafka.common
 from kafka.common import (
@@ -28,6 +31,201 @@ ITER_TIMEOUT_SECONDS = 60
 NO_MESSAGES_WAIT_TIME_SECONDS = 0.1
 FULL_QUEUE_WAIT_TIME_SECONDS = 0.1
 
+# First backoff of a partition fetched up to its highwater mark
+MIN_IDLE_BACKOFF_SECONDS = 0.1
+
+# Where consumer offsets are committed: zookeeper (through any broker) or
+# Kafka (through the coordinator of the group, Kafka 0.8.2+)
+OFFSET_STORAGE_ZOOKEEPER = 'zookeeper'
+OFFSET_STORAGE_KAFKA = 'kafka'
+OFFSET_STORAGES = (OFFSET_STORAGE_ZOOKEEPER, OFFSET_STORAGE_KAFKA)
+
+
+def send_offset_commit(client, group, payloads,
+                       offset_storage=OFFSET_STORAGE_ZOOKEEPER, **kwargs):
+    """Send OffsetCommitRequests to offset_storage with client"""
+    if offset_storage == OFFSET_STORAGE_KAFKA:
+        return client.send_offset_commit_request_kafka(group, payloads,
+                                                       **kwargs)
+    return client.send_offset_commit_request(group, payloads, **kwargs)
+
+
+def send_offset_fetch(client, group, payloads,
+                      offset_storage=OFFSET_STORAGE_ZOOKEEPER, **kwargs):
+    """Send OffsetFetchRequests to offset_storage with client"""
+    if offset_storage == OFFSET_STORAGE_KAFKA:
+        return client.send_offset_fetch_request_kafka(group, payloads,
+                                                      **kwargs)
+    return client.send_offset_fetch_request(group, payloads, **kwargs)
+
+
+class IdlePartitions(object):
+    """
+    Fetch schedule of caught up partitions: a partition fetched from its
+    highwater mark is left out of the following fetches, and checked again
+    after a backoff doubling from MIN_IDLE_BACKOFF_SECONDS up to
+    max_backoff seconds while it stays idle. Partitions with lag are
+    fetched every time.
+
+    Arguments:
+        max_backoff: Most seconds between two fetches of an idle partition
+    """
+    def __init__(self, max_backoff):
+        self.max_backoff = max_backoff
+        self.idle = {}  # partition -> (backoff, time of the next fetch)
+
+    def update(self, partition, offset, highwater):
+        """partition was fetched from offset, highwater being its highwater
+        mark"""
+        if offset < highwater:
+            self.idle.pop(partition, None)
+            return
+        backoff = self.idle.get(partition, (0, None))[0]
+        backoff = min(self.max_backoff,
+                      backoff * 2 if backoff else MIN_IDLE_BACKOFF_SECONDS)
+        self.idle[partition] = (backoff, time.time() + backoff)
+
+    def due(self, partitions):
+        """The partitions to fetch now, all of them if none is due (the
+        broker then waits for new messages in any)"""
+        now = time.time()
+        due = [partition for partition in partitions
+               if partition not in self.idle or self.idle[partition][1] <= now]
+        return due or list(partitions)
+
+    def reset(self, partition=None):
+        """Fetch partition (or all of them) again, after its offset moved"""
+        if partition is None:
+            self.idle.clear()
+        else:
+            self.idle.pop(partition, None)
+
+
+class AsyncCommitter(object):
+    """
+    Sends offset commits from a background thread, with its own
+    connections. Commits requested while one is in flight are merged: the
+    latest offset of each topic/partition is sent in the next request, and
+    offsets already requested are skipped.
+
+    Arguments:
+        client: The Kafka client instance to copy
+        group: The consumer group to commit offsets for
+        on_success: Called in the thread with the {(topic, partition):
+            offset} committed
+        on_failure: Called in the thread with the {(topic, partition):
+            (offset, exception)} that failed to commit. They are committed
+            again by the next commit() requesting them
+
+    Keyword Arguments:
+        offset_storage: 'zookeeper' or 'kafka', see OFFSET_STORAGES
+    """
+    def __init__(self, client, group, on_success, on_failure,
+                 offset_storage=OFFSET_STORAGE_ZOOKEEPER):
+        self.client = client.copy()
+        self.group = group
+        self.offset_storage = offset_storage
+        self.on_success = on_success
+        self.on_failure = on_failure
+        self.pending = {}    # (topic, partition) -> offset to commit
+        self.requested = {}  # (topic, partition) -> latest offset requested
+        self.in_flight = False
+        self.stopped = False
+        self.condition = Condition()
+        self.thread = Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def commit(self, offsets, metadata=None):
+        """Commit {(topic, partition): offset} in the background"""
+        with self.condition:
+            for topic_partition, offset in six.iteritems(offsets):
+                if self.requested.get(topic_partition) == offset:
+                    continue
+                self.requested[topic_partition] = offset
+                self.pending[topic_partition] = (offset, metadata)
+            if self.pending:
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait up to timeout seconds (forever if None) for the commits
+        requested so far. Returns True if they are all done
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.pending or self.in_flight:
+                if deadline is None:
+                    self.condition.wait()
+                elif deadline <= time.time():
+                    return False
+                else:
+                    self.condition.wait(deadline - time.time())
+            return True
+
+    def stop(self, timeout=None):
+        """Send the commits requested so far and stop the thread"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        self.client.close()
+
+    def _run(self):
+        self.client.reinit()
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                pending, self.pending = self.pending, {}
+                self.in_flight = True
+
+            topic_partitions = list(pending)
+            reqs = []
+            for (topic, partition) in topic_partitions:
+                (offset, metadata) = pending[(topic, partition)]
+                reqs.append(OffsetCommitRequest(topic, partition, offset,
+                                                metadata))
+            try:
+                resps = send_offset_commit(self.client, self.group, reqs,
+                                           self.offset_storage,
+                                           fail_on_error=False)
+            except Exception as e:
+                resps = [e] * len(reqs)
+
+            committed = {}
+            failures = {}
+            for topic_partition, resp in zip(topic_partitions, resps):
+                offset = pending[topic_partition][0]
+                try:
+                    if isinstance(resp, Exception):
+                        raise resp
+                    check_error(resp)
+                except Exception as e:
+                    failures[topic_partition] = (offset, e)
+                else:
+                    committed[topic_partition] = offset
+
+            with self.condition:
+                for topic_partition, (offset, _) in six.iteritems(failures):
+                    # Not requested again meanwhile: let commit() retry it
+                    if self.requested.get(topic_partition) == offset:
+                        del self.requested[topic_partition]
+
+            try:
+                if committed:
+                    self.on_success(committed)
+                if failures:
+                    self.on_failure(failures)
+            except Exception:
+                log.exception("Offset commit callback failed")
+            finally:
+                with self.condition:
+                    self.in_flight = False
+                    self.condition.notify_all()
+
 
 class Consumer(object):
     """
@@ -42,13 +240,20 @@ class Consumer(object):
     """
     def __init__(self, client, group, topic, partitions=None, auto_commit=True,
                  auto_commit_every_n=AUTO_COMMIT_MSG_COUNT,
-                 auto_commit_every_t=AUTO_COMMIT_INTERVAL):
-
+                 auto_commit_every_t=AUTO_COMMIT_INTERVAL,
+                 async_commit=False, commit_callback=None,
+                 offset_storage=OFFSET_STORAGE_ZOOKEEPER):
+
+        if offset_storage not in OFFSET_STORAGES:
+            raise ValueError("offset_storage must be one of %s, not %r" %
+                             (OFFSET_STORAGES, offset_storage))
+        self.offset_storage = offset_storage
         self.client = client
         self.topic = kafka_bytestring(topic)
         self.group = None if group is None else kafka_bytestring(group)
         self.client.load_metadata_for_topics(topic)
         self.offsets = {}
+        self.reassembler = None  # see kafka.chunking
 
         if not partitions:
             partitions = self.client.get_partition_ids_for_topic(topic)
@@ -62,6 +267,14 @@ class Consumer(object):
         self.auto_commit = auto_commit
         self.auto_commit_every_n = auto_commit_every_n
         self.auto_commit_every_t = auto_commit_every_t
+        self.committed = {}  # partition -> offset last committed
+        self.commit_callback = commit_callback
+        self.committer = None
+        if async_commit and self.group is not None:
+            self.committer = AsyncCommitter(client, self.group,
+                                            self._on_committed,
+                                            self._on_commit_failure,
+                                            offset_storage)
 
         # Set up the auto-commit timer
         if auto_commit is True and auto_commit_every_t is not None:
@@ -89,9 +302,10 @@ class Consumer(object):
         if not partitions:
             partitions = self.client.get_partition_ids_for_topic(self.topic)
 
-        responses = self.client.send_offset_fetch_request(
-            self.group,
+        responses = send_offset_fetch(
+            self.client, self.group,
             [OffsetFetchRequest(self.topic, p) for p in partitions],
+            self.offset_storage,
             fail_on_error=False
         )
 
@@ -111,11 +325,16 @@ class Consumer(object):
             # and need to fetch the next one
             else:
                 self.offsets[resp.partition] = resp.offset
+                self.committed[resp.partition] = resp.offset
 
     def commit(self, partitions=None):
         """
         Commit offsets for this consumer
 
+        Only the partitions whose offset changed since their last commit
+        are sent. With async_commit, the commit is sent by a background
+        thread and this returns right away.
+
         Keyword Arguments:
             partitions (list): list of partitions to commit, default is to commit
                 all of them
@@ -132,24 +351,55 @@ class Consumer(object):
             if self.count_since_commit == 0:
                 return
 
-            reqs = []
             if not partitions:  # commit all partitions
                 partitions = self.offsets.keys()
 
+            offsets = {}
             for partition in partitions:
                 offset = self.offsets[partition]
+                if self.reassembler is not None:
+                    offset = self.reassembler.commit_offset(partition, offset)
+
+                # Skip partitions unchanged since their last commit
+                if self.committed.get(partition) == offset:
+                    continue
                 log.debug("Commit offset %d in SimpleConsumer: "
                           "group=%s, topic=%s, partition=%s" %
                           (offset, self.group, self.topic, partition))
+                offsets[partition] = offset
+
+            if offsets and self.committer is not None:
+                self.committer.commit(dict(
+                    ((self.topic, partition), offset)
+                    for partition, offset in six.iteritems(offsets)))
+
+            elif offsets:
+                reqs = [OffsetCommitRequest(self.topic, partition, offset, None)
+                        for partition, offset in six.iteritems(offsets)]
+                resps = send_offset_commit(self.client, self.group, reqs,
+                                           self.offset_storage)
+                for resp in resps:
+                    kafka.common.check_error(resp)
+                    self.committed[resp.partition] = offsets[resp.partition]
 
-                reqs.append(OffsetCommitRequest(self.topic, partition,
-                                                offset, None))
+            self.count_since_commit = 0
 
-            resps = self.client.send_offset_commit_request(self.group, reqs)
-            for resp in resps:
-                kafka.common.check_error(resp)
+    def _on_committed(self, offsets):
+        # Called by the committer thread, while commit() may be running
+        with self.commit_lock:
+            for (_, partition), offset in six.iteritems(offsets):
+                self.committed[partition] = offset
 
-            self.count_since_commit = 0
+    def _on_commit_failure(self, failures):
+        with self.commit_lock:
+            # Commit them again next time
+            self.count_since_commit += 1
+        if self.commit_callback is not None:
+            self.commit_callback(failures)
+            return
+        for (topic, partition), (offset, error) in six.iteritems(failures):
+            log.error("Unable to commit offset %d of %s:%d: %r",
+                      offset, topic, partition, error)
 
     def _auto_commit(self):
         """
@@ -168,6 +418,10 @@ class Consumer(object):
             self.commit_timer.stop()
             self.commit()
 
+        if self.committer is not None:
+            self.committer.stop()
+            self.committer = None
+
         if hasattr(self, '_cleanup_func'):
             # Remove cleanup handler now that we've stopped
 
@@ -1,21 +1,39 @@
 from __future__ import absolute_import
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from copy import deepcopy
+from itertools import chain
 import logging
 import random
 import sys
 import time
+from threading import Condition, Event, Lock, Thread
+
+try:
+    from queue import Empty, Full, Queue
+except ImportError:
+    from Queue import Empty, Full, Queue
 
 import six
 
+from kafka.chunking import (
+    DEFAULT_MAX_PENDING_CHUNK_BYTES, DEFAULT_MAX_PENDING_CHUNK_OFFSETS,
+    Reassembler
+)
 from kafka.client import KafkaClient
+from kafka.consumer.base import (
+    AsyncCommitter, IdlePartitions, OFFSET_STORAGE_ZOOKEEPER, OFFSET_STORAGES,
+    send_offset_commit, send_offset_fetch
+)
 from kafka.common import (
     OffsetFetchRequest, OffsetCommitRequest, OffsetRequest, FetchRequest,
     check_error, NotLeaderForPartitionError, UnknownTopicOrPartitionError,
     OffsetOutOfRangeError, RequestTimedOutError, KafkaMessage, ConsumerTimeout,
-    FailedPayloadsError, KafkaUnavailableError, KafkaConfigurationError
+    FailedPayloadsError, KafkaUnavailableError, KafkaConfigurationError,
+    KafkaError, LeaderNotAvailableError, TopicAndPartition,
+    ConsumerFetchSizeTooSmall
 )
+from kafka.protocol import message_size
 from kafka.util import kafka_bytestring
 
 logger = logging.getLogger(__name__)
@@ -37,12 +55,21 @@ DEFAULT_CONSUMER_CONFIG = {
     'auto_commit_interval_ms': 60 * 1000,
     'auto_commit_interval_messages': None,
     'consumer_timeout_ms': -1,
+    'reassemble_chunks': False,
+    'max_pending_chunk_bytes': DEFAULT_MAX_PENDING_CHUNK_BYTES,
+    'max_pending_chunk_offsets': DEFAULT_MAX_PENDING_CHUNK_OFFSETS,
+    'dropped_chunks_callback': None,
+    'num_consumer_fetchers': 0,
+    'queued_max_message_chunks': 10,
+    'default_fetcher_backoff_ms': 1000,
+    'fetch_max_total_bytes': None,
+    'fetch_idle_backoff_max_ms': None,
+    'async_commit': False,
+    'commit_callback': None,
+    'offset_storage': OFFSET_STORAGE_ZOOKEEPER,
 
     # Currently unused
     'socket_receive_buffer_bytes': 64 * 1024,
-    'num_consumer_fetchers': 1,
-    'default_fetcher_backoff_ms': 1000,
-    'queued_max_message_chunks': 10,
     'rebalance_max_retries': 4,
     'rebalance_backoff_ms': 2000,
 }
@@ -51,6 +78,373 @@ DEPRECATED_CONFIG_KEYS = {
     'metadata_broker_list': 'bootstrap_servers',
 }
 
+# Smallest share of fetch_max_total_bytes given to a topic/partition
+MIN_PARTITION_FETCH_BYTES = 64 * 1024
+
+
+class _PartitionFetchStats(object):
+    """
+    Recent throughput of a topic/partition, to split fetch_max_total_bytes:
+    the average size of its messages, and the smallest fetch size fitting
+    its largest message
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.min_bytes = min(MIN_PARTITION_FETCH_BYTES, max_bytes)
+        self.avg_message_size = None
+
+    def add(self, count, size, largest):
+        """count messages of size bytes (the largest of largest bytes)
+        were fetched"""
+        if not count:
+            return
+        avg = float(size) / count
+        if self.avg_message_size is not None:
+            avg = (3 * self.avg_message_size + avg) / 4
+        self.avg_message_size = avg
+        self.min_bytes = min(self.max_bytes, max(self.min_bytes, largest))
+
+    def too_small(self, size):
+        """A message did not fit in size bytes"""
+        self.min_bytes = min(self.max_bytes, max(self.min_bytes, size * 2))
+
+    def demand(self, lag):
+        """Bytes to fetch for lag messages waiting (None if unknown)"""
+        if not lag or self.avg_message_size is None:
+            return self.min_bytes
+        return max(self.min_bytes,
+                   min(self.max_bytes, int(lag * self.avg_message_size)))
+
+
+def _fetch_demands(topic_partitions, offsets, highwater, stats):
+    """(topic_partition, demand, minimum) of topic_partitions, from the
+    messages waiting past their fetch offsets"""
+    demands = []
+    for topic_partition in topic_partitions:
+        lag = None
+        if highwater.get(topic_partition) is not None:
+            lag = highwater[topic_partition] - offsets[topic_partition]
+        partition_stats = stats[topic_partition]
+        demands.append((topic_partition, partition_stats.demand(lag),
+                        partition_stats.min_bytes))
+    return demands
+
+
+def _split_fetch_budget(demands, budget, start=0):
+    """
+    Split budget bytes between the (topic_partition, demand, minimum) of
+    demands, in proportion to their demands when they do not all fit but
+    at least their minimum each. Partitions are served in turn from index
+    start, those left out once the budget is spent are served first on the
+    next call.
+
+    Returns:
+        ({topic_partition: fetch size}, start index of the next call)
+    """
+    total = sum(demand for _, demand, _ in demands)
+    scale = min(1.0, float(budget) / total) if total else 1.0
+    sizes = {}
+    for i in range(len(demands)):
+        index = (start + i) % len(demands)
+        (topic_partition, demand, minimum) = demands[index]
+        size = max(minimum, int(demand * scale))
+        if size > budget:
+            return sizes, index
+        sizes[topic_partition] = size
+        budget -= size
+    return sizes, start
+
+
+def _idle_partitions(config):
+    """IdlePartitions of fetch_idle_backoff_max_ms, None if unset"""
+    if config['fetch_idle_backoff_max_ms'] is None:
+        return None
+    return IdlePartitions(config['fetch_idle_backoff_max_ms'] / 1000.0)
+
+
+def _fetched_size(messages):
+    """count, total bytes and largest bytes of OffsetAndMessages"""
+    size = largest = 0
+    for _, message in messages:
+        message_bytes = message_size(message.value or b'', message.key)
+        size += message_bytes
+        largest = max(largest, message_bytes)
+    return len(messages), size, largest
+
+
+def _track_fetch(messages, stats, size):
+    """
+    Yield the messages of a fetch of size bytes, adding them to stats. A
+    first message larger than size (below stats.max_bytes) only makes the
+    next fetches larger
+    """
+    fetched = []
+    try:
+        for message in messages:
+            fetched.append(message)
+            yield message
+    except ConsumerFetchSizeTooSmall:
+        if size >= stats.max_bytes:
+            raise
+        stats.too_small(size)
+    finally:
+        stats.add(*_fetched_size(fetched))
+
+
+def _release_when_consumed(messages, budget, size):
+    """Yield messages, then give their size back to budget"""
+    try:
+        for message in messages:
+            yield message
+    finally:
+        budget.release(size)
+
+
+class _FetchBudget(object):
+    """
+    fetch_max_total_bytes shared by the background fetchers: bytes are
+    reserved for each request, then held by the messages fetched until
+    they are consumed
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.condition = Condition()
+
+    def reserve(self, demands, start, timeout):
+        """
+        Split the bytes left between demands (see _split_fetch_budget),
+        waiting up to timeout seconds for room for the partition at start.
+        Returns the sizes reserved (maybe none) and the next start
+        """
+        with self.condition:
+            minimum = demands[start % len(demands)][2]
+            if self.max_bytes - self.used < minimum:
+                self.condition.wait(timeout)
+            sizes, start = _split_fetch_budget(
+                demands, self.max_bytes - self.used, start)
+            self.used += sum(sizes.values())
+            return sizes, start
+
+    def release(self, size):
+        if not size:
+            return
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+class _Fetcher(object):
+    """
+    Fetches the messages of some topic/partitions in a background thread,
+    with its own connections, and puts them on a queue as chunks of
+    (topic_partition, offset, messages, size, highwater, error)
+
+    positions holds the next offset to fetch of each topic/partition, None
+    while it waits for KafkaConsumer to handle an error (see set_position)
+
+    With a budget (_FetchBudget), fetch sizes are split from the bytes left
+    in it, by the stats of each topic/partition, and the size of a chunk is
+    held until KafkaConsumer releases it
+
+    Unexpected errors of the thread are kept in error, to be raised by the
+    consumer, and fetching is retried after default_fetcher_backoff_ms
+    """
+    def __init__(self, client, config, queue, budget=None, stats=None):
+        self.client = client
+        self.config = config
+        self.queue = queue
+        self.budget = budget
+        self.stats = stats
+        self.rotation = 0
+        self.highwater = {}
+        self.idle_partitions = _idle_partitions(config)
+        self.positions = {}
+        self.error = None
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.thread = Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.client.close()
+
+    def set_position(self, topic_partition, offset):
+        with self.lock:
+            self.positions[topic_partition] = offset
+            if self.idle_partitions is not None:
+                self.idle_partitions.reset(topic_partition)
+
+    def _backoff(self):
+        self.stop_event.wait(self.config['default_fetcher_backoff_ms'] / 1000.0)
+
+    def _put(self, chunk):
+        # Wait for room in the queue (queued_max_message_chunks)
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(chunk, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def take_error(self):
+        """The last unexpected error of the thread (once), or None"""
+        with self.lock:
+            error, self.error = self.error, None
+        return error
+
+    def _run(self):
+        # Open separate socket connections
+        self.client.reinit()
+
+        while not self.stop_event.is_set():
+            try:
+                self._fetch()
+            except Exception as e:
+                logger.warning("Unable to fetch messages in the background, "
+                               "retrying", exc_info=True)
+                with self.lock:
+                    self.error = e
+                self._backoff()
+
+    def _fetch(self):
+        with self.lock:
+            offsets = dict((tp, offset) for tp, offset in
+                           six.iteritems(self.positions)
+                           if offset is not None)
+        if not offsets:
+            self._backoff()
+            return
+        if self.idle_partitions is not None:
+            offsets = dict((topic_partition, offsets[topic_partition])
+                           for topic_partition in
+                           self.idle_partitions.due(offsets))
+
+        if self.budget is None:
+            sizes = dict((topic_partition,
+                          self.config['fetch_message_max_bytes'])
+                         for topic_partition in offsets)
+        else:
+            demands = _fetch_demands(sorted(offsets), offsets,
+                                     self.highwater, self.stats)
+            sizes, self.rotation = self.budget.reserve(demands,
+                                                       self.rotation, 0.1)
+            if not sizes:
+                return
+
+        fetches = [FetchRequest(topic, partition, offsets[(topic, partition)],
+                                size)
+                   for (topic, partition), size in six.iteritems(sizes)]
+        try:
+            responses = self.client.send_fetch_request(
+                fetches,
+                max_wait_time=self.config['fetch_wait_max_ms'],
+                min_bytes=self.config['fetch_min_bytes'],
+                fail_on_error=False)
+        except (FailedPayloadsError, KafkaUnavailableError):
+            logger.warning('Unable to fetch data from kafka, retrying',
+                           exc_info=True)
+            self._release(sum(sizes.values()))
+            self._refresh_metadata()
+            return
+
+        failed = []
+        try:
+            for resp in responses:
+                if isinstance(resp, FailedPayloadsError):
+                    # Fetched again from the same position after a refresh
+                    failed.append(resp.failed_payloads)
+                    continue
+                topic_partition = (kafka_bytestring(resp.topic), resp.partition)
+                reserved = sizes.get(topic_partition, 0)
+                chunk = self._chunk(resp, offsets[topic_partition], reserved)
+                sizes.pop(topic_partition, None)
+                # Only the bytes of the messages put on the queue are held
+                self._release(reserved - (chunk[3] if chunk else 0))
+                if chunk is not None:
+                    self._put(chunk)
+        finally:
+            self._release(sum(sizes.values()))
+
+        if failed:
+            logger.warning('Unable to fetch %s from kafka, retrying',
+                           ', '.join('%s - %d' % (payload.topic, payload.partition)
+                                     for payload in failed))
+            self._refresh_metadata()
+
+    def _chunk(self, resp, offset, size):
+        """The chunk of a response to a fetch of size bytes from offset,
+        None if there is nothing for the consumer"""
+        topic_partition = (kafka_bytestring(resp.topic), resp.partition)
+        messages = []
+        error = None
+        try:
+            check_error(resp)
+            if self.idle_partitions is not None:
+                self.idle_partitions.update(topic_partition, offset,
+                                            resp.highwaterMark)
+            # Decode the messages here rather than in the consumer
+            for message in resp.messages:
+                messages.append(message)
+        except (NotLeaderForPartitionError, LeaderNotAvailableError,
+                UnknownTopicOrPartitionError) as e:
+            logger.warning("%s for %s - %d. Metadata may be out of "
+                           "date", type(e).__name__, *topic_partition)
+            self._refresh_metadata()
+            return None
+        except RequestTimedOutError:
+            logger.warning("RequestTimedOutError for %s - %d",
+                           *topic_partition)
+            return None
+        except ConsumerFetchSizeTooSmall as e:
+            if size >= self.config['fetch_message_max_bytes']:
+                error = e
+            else:
+                # Fetch again with a larger share of the budget
+                self.stats[topic_partition].too_small(size)
+                return None
+        except Exception as e:
+            error = e
+
+        self.highwater[topic_partition] = resp.highwaterMark
+        fetched_size = 0
+        if self.budget is not None:
+            (count, fetched_size, largest) = _fetched_size(messages)
+            self.stats[topic_partition].add(count, fetched_size, largest)
+        if not messages and error is None:
+            return None
+
+        with self.lock:
+            # Skip if moved (see set_position) while fetching
+            if self.positions.get(topic_partition) != offset:
+                return None
+            # Wait for the consumer to handle errors
+            self.positions[topic_partition] = (
+                None if error is not None
+                else messages[-1].offset + 1)
+
+        return (topic_partition, offset, messages, fetched_size,
+                resp.highwaterMark, error)
+
+    def _release(self, size):
+        if self.budget is not None:
+            self.budget.release(size)
+
+    def _refresh_metadata(self):
+        self._backoff()
+        with self.lock:
+            topics = set(topic for (topic, _) in self.positions)
+        try:
+            self.client.load_metadata_for_topics(*topics)
+        except KafkaError:
+            logger.warning("Unable to refresh topic metadata", exc_info=True)
+
+
 class KafkaConsumer(object):
     """A simpler kafka consumer"""
 
@@ -105,6 +499,59 @@ class KafkaConsumer(object):
             consumer_timeout_ms (int, optional): number of millisecond to throw
                 a timeout exception to the consumer if no message is available
                 for consumption.  Defaults to -1 (dont throw exception).
+            reassemble_chunks (bool, optional): Put chunked messages (sent by
+                a producer with chunk_size set, see kafka.chunking) back
+                together. Commits then stop at the first chunk of incomplete
+                messages.  Defaults to False.
+            max_pending_chunk_bytes (int, optional): Bound of the chunks held
+                for incomplete messages when reassemble_chunks is set.
+                Defaults to 64 * 1024 * 1024.
+            max_pending_chunk_offsets (int, optional): Number of offsets past
+                its first chunk after which an incomplete message (e.g. from
+                a producer that died half way) is dropped. None for no limit.
+                Defaults to 100000.
+            dropped_chunks_callback (callable, optional): Called as
+                callback((topic, partition), offset) for each incomplete
+                message dropped, with the offset of its first chunk.
+                Defaults to None.
+            num_consumer_fetchers (int, optional): Number of background
+                threads fetching messages ahead, while the previous ones are
+                processed. Partitions are grouped by leader broker, each
+                thread fetching from one broker (or more if there are more
+                brokers than threads). Defaults to 0 (fetch in the calling
+                thread, when all fetched messages have been consumed).
+            queued_max_message_chunks (int, optional): With background
+                fetchers, most responses (of a partition each) fetched ahead
+                and not consumed yet. Defaults to 10.
+            default_fetcher_backoff_ms (int, optional): Milliseconds background
+                fetchers wait before retrying after errors. Defaults to 1000.
+            fetch_max_total_bytes (int, optional): Most bytes fetched at once
+                across all topic/partitions, and with background fetchers
+                also held by messages fetched ahead and not consumed yet.
+                When fetch_message_max_bytes for every partition does not
+                fit, it is split by the lag and message sizes of each
+                partition, partitions left out being served first the next
+                time. At least fetch_message_max_bytes.  Defaults to None
+                (fetch_message_max_bytes for every partition).
+            fetch_idle_backoff_max_ms (int, optional): If set, topic/partitions
+                fetched up to their highwater mark are left out of the next
+                fetches, checked again after a backoff doubling up to this
+                many milliseconds while they stay idle. Partitions with lag
+                are fetched every time.  Defaults to None (fetch all the
+                partitions every time).
+            async_commit (bool, optional): Send commits from a background
+                thread (with its own connections) instead of blocking the
+                consumer. Commits requested while one is in flight are
+                merged.  Defaults to False.
+            commit_callback (callable, optional): Called from the background
+                thread with a dict {(topic, partition): (offset, exception)}
+                of the offsets that failed to commit with async_commit, which
+                are committed again by the next commit().  Defaults to None
+                (failures are logged).
+            offset_storage (str, optional): Where the offsets of group_id are
+                fetched from and committed to: 'zookeeper' (through any
+                broker) or 'kafka' (through the coordinator of the group,
+                Kafka 0.8.2+).  Defaults to 'zookeeper'.
 
         Configuration parameters are described in more detail at
         http://kafka.apache.org/documentation.html#highlevelconsumerapi
@@ -131,9 +578,40 @@ class KafkaConsumer(object):
             raise KafkaConfigurationError('bootstrap_servers required to '
                                           'configure KafkaConsumer')
 
+        if (self._config['fetch_max_total_bytes'] is not None and
+                self._config['fetch_max_total_bytes'] <
+                self._config['fetch_message_max_bytes']):
+            raise KafkaConfigurationError('fetch_max_total_bytes must be at '
+                                          'least fetch_message_max_bytes')
+
+        if self._config['offset_storage'] not in OFFSET_STORAGES:
+            raise KafkaConfigurationError('Unknown offset_storage %r' %
+                                          self._config['offset_storage'])
+
+        if getattr(self, '_fetchers', None):
+            # Stop the fetchers started with the previous configuration
+            self._stop_fetchers()
+        self._fetchers = []
+        self._committer = None
+        self._reassembler = None
+        if self._config['reassemble_chunks']:
+            self._reassembler = Reassembler(
+                self._config['max_pending_chunk_bytes'],
+                self._config['max_pending_chunk_offsets'],
+                self._config['dropped_chunks_callback'])
+
+        # Metadata is loaded for the topics to consume only, see
+        # set_topic_partitions
         self._client = KafkaClient(self._config['bootstrap_servers'],
                                    client_id=self._config['client_id'],
-                                   timeout=(self._config['socket_timeout_ms'] / 1000.0))
+                                   timeout=(self._config['socket_timeout_ms'] / 1000.0),
+                                   bootstrap_metadata=False)
+
+        if self._config['async_commit'] and self._config['group_id']:
+            self._committer = AsyncCommitter(
+                self._client, kafka_bytestring(self._config['group_id']),
+                self._on_committed, self._on_commit_failure,
+                self._config['offset_storage'])
 
     def set_topic_partitions(self, *topics):
         """
@@ -171,8 +649,13 @@ class KafkaConsumer(object):
             kafka.set_topic_partitions({ ("topic1", 0): 123, ("topic2", 1): 456 })
 
         """
+        self._stop_fetchers()
         self._topics = []
-        self._client.load_metadata_for_topics()
+
+        # Only the metadata of the topics to consume
+        topic_names = self._topic_names(topics)
+        if topic_names:
+            self._client.load_metadata_for_topics(*topic_names)
 
         # Setup offsets
         self._offsets = OffsetsStruct(fetch=dict(),
@@ -234,6 +717,7 @@ class KafkaConsumer(object):
             self._get_commit_offsets()
 
         # Update missing fetch/commit offsets
+        reset = []
         for topic_partition in self._topics:
 
             # Commit offsets default is None
@@ -249,7 +733,10 @@ class KafkaConsumer(object):
 
                 # or (2) auto reset
                 else:
-                    self._offsets.fetch[topic_partition] = self._reset_partition_offset(topic_partition)
+                    reset.append(topic_partition)
+
+        # All in one request per broker
+        self._offsets.fetch.update(self._reset_partition_offsets(reset))
 
         # highwater marks (received from server on fetch response)
         # and task_done (set locally by user)
@@ -259,6 +746,17 @@ class KafkaConsumer(object):
 
         # Reset message iterator in case we were in the middle of one
         self._reset_message_iterator()
+        self._pending = OrderedDict()  # topic_partition -> fetched messages
+        self._paused = set()
+        self._fetch_stats = dict(
+            (topic_partition,
+             _PartitionFetchStats(self._config['fetch_message_max_bytes']))
+            for topic_partition in self._topics)
+        self._fetch_rotation = 0
+        self._idle_partitions = _idle_partitions(self._config)
+        self._start_fetchers()
+        if self._reassembler is not None:
+            self._reassembler.reset()
 
     def next(self):
         """Return the next available message
@@ -308,6 +806,156 @@ class KafkaConsumer(object):
 
         """
 
+        if not self._pending:
+            self._fetch()
+
+        while self._pending:
+            topic_partition = next(iter(self._pending))
+            (topic, partition) = topic_partition
+            messages = self._pending[topic_partition]
+
+            # Yield each message
+            # Kafka-python could raise an exception during iteration
+            # we are not catching -- user will need to address
+            for (offset, message) in messages:
+                # in some cases the server will return earlier messages
+                # than we requested. skip them per kafka spec
+                if offset < self._offsets.fetch[topic_partition]:
+                    logger.debug('message offset less than fetched offset '
+                                 'skipping: %s-%d %d', topic, partition, offset)
+                    continue
+
+                value = message.value
+                if self._reassembler is not None and value is not None:
+                    value = self._reassembler.add(topic_partition,
+                                                  offset, value)
+                    if value is None:
+                        # Chunk of a message that is not complete yet
+                        self._offsets.fetch[topic_partition] = offset + 1
+                        continue
+
+                # deserializer_class could raise an exception here
+                try:
+                    val = self._config['deserializer_class'](value)
+                except Exception:
+                    # Fetch again from this message next time
+                    self._pending.pop(topic_partition, None)
+                    raise
+                msg = KafkaMessage(topic, partition, offset, message.key, val)
+                # Only increment fetch offset if we safely got the message and deserialized
+                self._offsets.fetch[topic_partition] = offset + 1
+
+                # Then yield to user
+                yield msg
+
+                # pause() dropped the rest of the messages
+                if topic_partition in self._paused:
+                    break
+
+            # poll() may have consumed them and fetched new ones meanwhile
+            if self._pending.get(topic_partition) is messages:
+                del self._pending[topic_partition]
+
+    def poll(self, max_records=None, timeout_ms=0):
+        """Fetch messages in batches of each topic/partition
+
+        Cheaper than iterating over messages one at a time: fetch offsets
+        are updated once per batch. Can be mixed with iteration and
+        fetch_messages(), messages are returned once either way.
+
+        Keyword Arguments:
+            max_records (int, optional): Most messages to return. Messages
+                fetched beyond it are returned by the next calls. Defaults to
+                None (all the messages of one fetch).
+            timeout_ms (int, optional): Milliseconds to keep fetching while
+                there are no messages. Defaults to 0 (fetch once, each fetch
+                may wait up to fetch_wait_max_ms for messages).
+
+        Returns:
+            dict {(topic, partition): [KafkaMessage, ...]} of messages in
+            offset order, after deserializing with the configured
+            `deserializer_class`. Empty if there were no messages.
+        """
+        deadline = time.time() + timeout_ms / 1000.0
+        records = {}
+        count = 0
+        while True:
+            if not self._pending:
+                self._fetch(max(0, deadline - time.time()))
+
+            for topic_partition in list(self._pending):
+                if max_records is not None and count >= max_records:
+                    break
+                batch = self._partition_records(
+                    topic_partition,
+                    None if max_records is None else max_records - count)
+                if batch:
+                    records.setdefault(topic_partition, []).extend(batch)
+                    count += len(batch)
+
+            if records or time.time() >= deadline:
+                return records
+
+    def pause(self, *topic_partitions):
+        """Stop fetching messages of topic/partitions
+
+        The messages fetched and not consumed yet are dropped, to be fetched
+        again after resume(). Fetch, highwater and task_done offsets are
+        kept, and the other topic/partitions are still fetched.
+
+        Arguments:
+            *topic_partitions: (topic, partition) tuples set for consumption
+        """
+        for topic_partition in self._topic_partitions(topic_partitions):
+            if topic_partition in self._paused:
+                continue
+            self._paused.add(topic_partition)
+            self._pending.pop(topic_partition, None)
+            if self._fetchers:
+                # Skip the chunks fetched meanwhile
+                self._fetched_to[topic_partition] = None
+                self._fetcher_for[topic_partition].set_position(
+                    topic_partition, None)
+
+    def resume(self, *topic_partitions):
+        """Fetch messages of paused topic/partitions again, from their
+        fetch offsets
+
+        Arguments:
+            *topic_partitions: (topic, partition) tuples set for consumption
+        """
+        for topic_partition in self._topic_partitions(topic_partitions):
+            if topic_partition not in self._paused:
+                continue
+            self._paused.discard(topic_partition)
+            if self._fetchers:
+                offset = self._offsets.fetch[topic_partition]
+                self._fetched_to[topic_partition] = offset
+                self._fetcher_for[topic_partition].set_position(
+                    topic_partition, offset)
+
+    def _topic_partitions(self, topic_partitions):
+        result = []
+        for (topic, partition) in topic_partitions:
+            topic_partition = (kafka_bytestring(topic), partition)
+            if topic_partition not in self._offsets.fetch:
+                raise KafkaConfigurationError(
+                    'Topic %s partition %d is not set for consumption'
+                    % topic_partition)
+            result.append(topic_partition)
+        return result
+
+    def _fetch(self, max_idle=None):
+        """Sends FetchRequests for all topic/partitions set for consumption
+        (or takes the responses of the background fetchers) and keeps the
+        messages of each partition for fetch_messages / poll
+
+        When every topic/partition is paused, waits fetch_wait_max_ms (at
+        most max_idle seconds, e.g. the time left of a poll) instead
+        """
+        if self._fetchers:
+            return self._fetch_from_fetchers()
+
         max_bytes = self._config['fetch_message_max_bytes']
         max_wait_time = self._config['fetch_wait_max_ms']
         min_bytes = self._config['fetch_min_bytes']
@@ -318,10 +966,25 @@ class KafkaConsumer(object):
         if not self._offsets.fetch:
             raise KafkaConfigurationError('No fetch offsets found when calling fetch_messages')
 
+        topic_partitions = [topic_partition for topic_partition in self._topics
+                            if topic_partition not in self._paused]
+        if not topic_partitions:
+            # Everything is paused, wait as the broker would
+            wait = max_wait_time / 1000.0
+            if max_idle is not None:
+                wait = min(wait, max_idle)
+            time.sleep(wait)
+            return
+        if self._idle_partitions is not None:
+            topic_partitions = self._idle_partitions.due(topic_partitions)
+
+        sizes = self._split_fetch_sizes(topic_partitions)
         fetches = [FetchRequest(topic, partition,
                                 self._offsets.fetch[(topic, partition)],
-                                max_bytes)
-                   for (topic, partition) in self._topics]
+                                max_bytes if sizes is None
+                                else sizes[(topic, partition)])
+                   for (topic, partition) in topic_partitions
+                   if sizes is None or (topic, partition) in sizes]
 
         # client.send_fetch_request will collect topic/partition requests by leader
         # and send each group as a single FetchRequest to the correct broker
@@ -344,12 +1007,14 @@ class KafkaConsumer(object):
                 logger.warning('OffsetOutOfRange: topic %s, partition %d, '
                                'offset %d (Highwatermark: %d)',
                                topic, partition,
-                               self.offsets._fetch[(topic, partition)],
+                               self._offsets.fetch[(topic, partition)],
                                resp.highwaterMark)
                 # Reset offset
                 self._offsets.fetch[(topic, partition)] = (
                     self._reset_partition_offset((topic, partition))
                 )
+                if self._reassembler is not None:
+                    self._reassembler.reset((topic, partition))
                 continue
 
             except NotLeaderForPartitionError:
@@ -366,26 +1031,198 @@ class KafkaConsumer(object):
 
             # Track server highwater mark
             self._offsets.highwater[(topic, partition)] = resp.highwaterMark
+            if self._idle_partitions is not None:
+                self._idle_partitions.update((topic, partition),
+                                             self._offsets.fetch[(topic, partition)],
+                                             resp.highwaterMark)
 
-            # Yield each message
-            # Kafka-python could raise an exception during iteration
-            # we are not catching -- user will need to address
-            for (offset, message) in resp.messages:
-                # deserializer_class could raise an exception here
-                val = self._config['deserializer_class'](message.value)
-                msg = KafkaMessage(topic, partition, offset, message.key, val)
+            if sizes is None:
+                self._pending[(topic, partition)] = iter(resp.messages)
+            else:
+                self._pending[(topic, partition)] = _track_fetch(
+                    resp.messages, self._fetch_stats[(topic, partition)],
+                    sizes[(topic, partition)])
+
+    def _split_fetch_sizes(self, topic_partitions):
+        """Fetch sizes of topic_partitions from fetch_max_total_bytes, None
+        if fetch_message_max_bytes for every partition fits"""
+        budget = self._config['fetch_max_total_bytes']
+        if (budget is None or budget >= len(topic_partitions) *
+                self._config['fetch_message_max_bytes']):
+            return None
+        demands = _fetch_demands(topic_partitions, self._offsets.fetch,
+                                 self._offsets.highwater, self._fetch_stats)
+        sizes, self._fetch_rotation = _split_fetch_budget(
+            demands, budget, self._fetch_rotation)
+        return sizes
+
+    def _fetch_from_fetchers(self):
+        """Takes the chunks fetched by the background fetchers, waiting up
+        to fetch_wait_max_ms for the first one
+        """
+        # Raise unexpected errors of the fetcher threads (once)
+        for fetcher in self._fetchers:
+            error = fetcher.take_error()
+            if error is not None:
+                raise error
 
-                # in some cases the server will return earlier messages
-                # than we requested. skip them per kafka spec
-                if offset < self._offsets.fetch[(topic, partition)]:
-                    logger.debug('message offset less than fetched offset '
-                                 'skipping: %s', msg)
+        try:
+            chunks = [self._chunks.get(
+                timeout=self._config['fetch_wait_max_ms'] / 1000.0)]
+        except Empty:
+            return
+        while True:
+            try:
+                chunks.append(self._chunks.get_nowait())
+            except Empty:
+                break
+
+        errors = []
+        for chunk in chunks:
+            (topic_partition, offset, messages, size, highwater, error) = chunk
+
+            # Skip chunks fetched before offsets were reset
+            if self._fetched_to.get(topic_partition) != offset:
+                if self._fetch_budget is not None:
+                    self._fetch_budget.release(size)
+                continue
+
+            self._offsets.highwater[topic_partition] = highwater
+            if messages:
+                next_offset = messages[-1].offset + 1
+                if self._fetch_budget is not None:
+                    messages = _release_when_consumed(
+                        messages, self._fetch_budget, size)
+                pending = self._pending.get(topic_partition)
+                self._pending[topic_partition] = (
+                    iter(messages) if pending is None
+                    else chain(pending, messages))
+                offset = next_offset
+                self._fetched_to[topic_partition] = offset
+
+            fetcher = self._fetcher_for[topic_partition]
+            if error is None:
+                continue
+
+            if isinstance(error, OffsetOutOfRangeError):
+                logger.warning('OffsetOutOfRange: topic %s, partition %d, '
+                               'offset %d (Highwatermark: %d)',
+                               topic_partition[0], topic_partition[1],
+                               offset, highwater)
+                try:
+                    offset = self._reset_partition_offset(topic_partition)
+                except Exception as e:
+                    errors.append(e)
+                    fetcher.set_position(topic_partition, offset)
                     continue
-                # Only increment fetch offset if we safely got the message and deserialized
-                self._offsets.fetch[(topic, partition)] = offset + 1
+                self._offsets.fetch[topic_partition] = offset
+                self._fetched_to[topic_partition] = offset
+                self._pending.pop(topic_partition, None)
+                if self._reassembler is not None:
+                    self._reassembler.reset(topic_partition)
+            else:
+                errors.append(error)
 
-                # Then yield to user
-                yield msg
+            # Fetch again (errors other than OffsetOutOfRange are raised
+            # every time, as when fetching in this thread)
+            fetcher.set_position(topic_partition, offset)
+
+        if errors:
+            raise errors[0]
+
+    def _start_fetchers(self):
+        self._fetched_to = dict(self._offsets.fetch)
+        self._fetcher_for = {}
+        self._fetch_budget = None
+        num_fetchers = self._config['num_consumer_fetchers']
+        if num_fetchers <= 0 or not self._topics:
+            return
+
+        if self._config['fetch_max_total_bytes'] is not None:
+            self._fetch_budget = _FetchBudget(
+                self._config['fetch_max_total_bytes'])
+
+        # Partitions of the same leader broker go to the same fetcher
+        leaders = OrderedDict()
+        for topic_partition in self._topics:
+            leader = self._client.topics_to_brokers.get(
+                TopicAndPartition(*topic_partition))
+            leaders.setdefault(leader, []).append(topic_partition)
+
+        self._chunks = Queue(self._config['queued_max_message_chunks'])
+        self._fetchers = [
+            _Fetcher(self._client.copy(), self._config, self._chunks,
+                     self._fetch_budget, self._fetch_stats)
+            for _ in range(min(num_fetchers, len(leaders)))]
+        for i, topic_partitions in enumerate(leaders.values()):
+            fetcher = self._fetchers[i % len(self._fetchers)]
+            for topic_partition in topic_partitions:
+                fetcher.set_position(topic_partition,
+                                     self._offsets.fetch[topic_partition])
+                self._fetcher_for[topic_partition] = fetcher
+
+        logger.info("Starting %d background fetchers", len(self._fetchers))
+        for fetcher in self._fetchers:
+            fetcher.start()
+
+    def _stop_fetchers(self):
+        for fetcher in self._fetchers:
+            fetcher.stop()
+        self._fetchers = []
+
+    def close(self):
+        """Stop the background fetchers, send the commits requested so far
+        (see async_commit) and close the connections"""
+        self._stop_fetchers()
+        if self._committer is not None:
+            self._committer.stop()
+            self._committer = None
+        self._client.close()
+
+    def _partition_records(self, topic_partition, max_records=None):
+        """Deserialize up to max_records fetched messages of topic_partition
+        and move its fetch offset past them
+        """
+        (topic, partition) = topic_partition
+        messages = self._pending[topic_partition]
+        fetch_offset = self._offsets.fetch[topic_partition]
+        deserializer = self._config['deserializer_class']
+        reassembler = self._reassembler
+
+        records = []
+        try:
+            for (offset, message) in messages:
+                # Skip earlier messages than requested, per kafka spec
+                if offset < fetch_offset:
+                    continue
+
+                value = message.value
+                if reassembler is not None and value is not None:
+                    value = reassembler.add(topic_partition, offset, value)
+                    if value is None:
+                        # Chunk of a message that is not complete yet
+                        fetch_offset = offset + 1
+                        continue
+
+                records.append(KafkaMessage(topic, partition, offset,
+                                            message.key, deserializer(value)))
+                fetch_offset = offset + 1
+                if max_records is not None and len(records) >= max_records:
+                    break
+            else:
+                del self._pending[topic_partition]
+
+        except Exception:
+            # Fetch again from the message that failed, and raise once the
+            # messages before it have been returned
+            self._pending.pop(topic_partition, None)
+            if not records:
+                raise
+
+        finally:
+            self._offsets.fetch[topic_partition] = fetch_offset
+
+        return records
 
     def get_partition_offsets(self, topic, partition, request_time_ms, max_num_offsets):
         """Request available fetch offsets for a single topic/partition
@@ -454,9 +1291,11 @@ class KafkaConsumer(object):
         topic_partition = (message.topic, message.partition)
         offset = message.offset
 
-        # Warn on non-contiguous offsets
+        # Warn on non-contiguous offsets (reassembled chunked messages skip
+        # the offsets of their other chunks)
         prev_done = self._offsets.task_done[topic_partition]
-        if prev_done is not None and offset != (prev_done + 1):
+        if (prev_done is not None and offset != (prev_done + 1) and
+                self._reassembler is None):
             logger.warning('Marking task_done on a non-continuous offset: %d != %d + 1',
                            offset, prev_done)
 
@@ -480,6 +1319,11 @@ class KafkaConsumer(object):
         """Store consumed message offsets (marked via task_done())
         to kafka cluster for this consumer_group.
 
+        Only the topic/partitions whose offset changed since their last
+        commit are sent. With async_commit, they are sent by a background
+        thread and this returns right away (failures are reported to
+        commit_callback).
+
         Returns:
             True on success, or False if no offsets were found for commit
 
@@ -497,6 +1341,7 @@ class KafkaConsumer(object):
 
         offsets = self._offsets.task_done
         commits = []
+        commit_offsets = {}
         for topic_partition, task_done_offset in six.iteritems(offsets):
 
             # Skip if None
@@ -509,23 +1354,36 @@ class KafkaConsumer(object):
             # so add one to mark the next message for fetching
             commit_offset = (task_done_offset + 1)
 
+            # Do not commit past the first chunk of incomplete messages
+            if self._reassembler is not None:
+                commit_offset = self._reassembler.commit_offset(
+                    topic_partition, commit_offset)
+
             # Skip if no change from previous committed
             if commit_offset == self._offsets.commit[topic_partition]:
                 continue
 
             commits.append(OffsetCommitRequest(topic_partition[0], topic_partition[1], commit_offset, metadata))
+            commit_offsets[topic_partition] = commit_offset
+
+        if commits and self._committer is not None:
+            self._committer.commit(commit_offsets, metadata)
+            if self._config['auto_commit_enable']:
+                self._reset_auto_commit()
+            return True
 
-        if commits:
+        elif commits:
             logger.info('committing consumer offsets to group %s', self._config['group_id'])
-            resps = self._client.send_offset_commit_request(kafka_bytestring(self._config['group_id']),
-                                                            commits,
-                                                            fail_on_error=False)
+            resps = send_offset_commit(self._client,
+                                       kafka_bytestring(self._config['group_id']),
+                                       commits,
+                                       self._config['offset_storage'],
+                                       fail_on_error=False)
 
             for r in resps:
                 check_error(r)
                 topic_partition = (r.topic, r.partition)
-                task_done = self._offsets.task_done[topic_partition]
-                self._offsets.commit[topic_partition] = (task_done + 1)
+                self._offsets.commit[topic_partition] = commit_offsets[topic_partition]
 
             if self._config['auto_commit_enable']:
                 self._reset_auto_commit()
@@ -536,10 +1394,45 @@ class KafkaConsumer(object):
             logger.info('No new offsets found to commit in group %s', self._config['group_id'])
             return False
 
+    def _on_committed(self, offsets):
+        for topic_partition, offset in six.iteritems(offsets):
+            # Unless set_topic_partitions was called meanwhile
+            if topic_partition in self._offsets.commit:
+                self._offsets.commit[topic_partition] = offset
+
+    def _on_commit_failure(self, failures):
+        if self._config['commit_callback'] is not None:
+            self._config['commit_callback'](failures)
+            return
+        for (topic, partition), (offset, error) in six.iteritems(failures):
+            logger.error('Unable to commit offset %d of %s:%d: %r',
+                         offset, topic, partition, error)
+
     #
     # Topic/partition management private methods
     #
 
+    def _topic_names(self, topics):
+        """Names of the topics of set_topic_partitions arguments"""
+        names = []
+        for arg in topics:
+            if isinstance(arg, (six.string_types, six.binary_type)):
+                keys = [arg]
+            elif isinstance(arg, tuple):
+                keys = [arg[0]]
+            elif isinstance(arg, dict):
+                keys = [key[0] if isinstance(key, tuple) else key
+                        for key in arg]
+            else:
+                continue
+            for key in keys:
+                if not isinstance(key, (six.string_types, six.binary_type)):
+                    continue
+                name = kafka_bytestring(key)
+                if name not in names:
+                    names.append(name)
+        return names
+
     def _consume_topic_partition(self, topic, partition):
         topic = kafka_bytestring(topic)
         if not isinstance(partition, int):
@@ -565,10 +1458,15 @@ class KafkaConsumer(object):
             logger.info("Sleeping for refresh_leader_backoff_ms: %d", sleep_ms)
             time.sleep(sleep_ms / 1000.0)
             try:
-                self._client.load_metadata_for_topics()
+                self._client.load_metadata_for_topics(
+                    *set(topic for (topic, _) in self._topics))
             except KafkaUnavailableError:
                 logger.warning("Unable to refresh topic metadata... cluster unavailable")
                 self._check_consumer_timeout()
+            except (LeaderNotAvailableError, UnknownTopicOrPartitionError) as e:
+                # Partitions without a leader are retried by the next fetch
+                logger.warning("Topic metadata refreshed: %s", e)
+                return
             else:
                 logger.info("Topic metadata refreshed")
                 return
@@ -579,11 +1477,15 @@ class KafkaConsumer(object):
 
     def _get_commit_offsets(self):
         logger.info("Consumer fetching stored offsets")
-        for topic_partition in self._topics:
-            (resp,) = self._client.send_offset_fetch_request(
-                kafka_bytestring(self._config['group_id']),
-                [OffsetFetchRequest(topic_partition[0], topic_partition[1])],
-                fail_on_error=False)
+        # All in one request per broker
+        resps = send_offset_fetch(
+            self._client,
+            kafka_bytestring(self._config['group_id']),
+            [OffsetFetchRequest(topic, partition)
+             for (topic, partition) in self._topics],
+            self._config['offset_storage'],
+            fail_on_error=False)
+        for topic_partition, resp in zip(self._topics, resps):
             try:
                 check_error(resp)
             # API spec says server wont set an error here
@@ -609,7 +1511,13 @@ class KafkaConsumer(object):
             self._offsets.task_done[topic_partition] = None
 
     def _reset_partition_offset(self, topic_partition):
-        (topic, partition) = topic_partition
+        return self._reset_partition_offsets([topic_partition])[topic_partition]
+
+    def _reset_partition_offsets(self, topic_partitions):
+        """Offsets of topic_partitions per the auto_offset_reset policy, from
+        one OffsetRequest per broker"""
+        if not topic_partitions:
+            return {}
         LATEST = -1
         EARLIEST = -2
 
@@ -632,9 +1540,14 @@ class KafkaConsumer(object):
             # the request that triggered it, and we do not want to drop that
             raise
 
-        (offset, ) = self.get_partition_offsets(topic, partition,
-                                                request_time_ms, max_num_offsets=1)
-        return offset
+        reqs = [OffsetRequest(topic, partition, request_time_ms, 1)
+                for (topic, partition) in topic_partitions]
+        resps = self._client.send_offset_request(reqs)
+        offsets = {}
+        for topic_partition, resp in zip(topic_partitions, resps):
+            check_error(resp)
+            offsets[topic_partition] = resp.offsets[0]
+        return offsets
 
     #
     # Consumer Timeout private methods
@@ -14,7 +14,8 @@ except ImportError:  # python 2
 from .base import (
     AUTO_COMMIT_MSG_COUNT, AUTO_COMMIT_INTERVAL,
     NO_MESSAGES_WAIT_TIME_SECONDS,
-    FULL_QUEUE_WAIT_TIME_SECONDS
+    FULL_QUEUE_WAIT_TIME_SECONDS,
+    OFFSET_STORAGE_ZOOKEEPER
 )
 from .simple import Consumer, SimpleConsumer
 
@@ -107,6 +108,9 @@ class MultiProcessConsumer(Consumer):
             The available partitions will be divided among these processes
         partitions_per_proc: Number of partitions to be allocated per process
             (overrides num_procs)
+        offset_storage: default 'zookeeper'. Where offsets of the group are
+            fetched from and committed to, 'zookeeper' or 'kafka' (Kafka
+            0.8.2+), see SimpleConsumer
 
     Auto commit details:
     If both auto_commit_every_n and auto_commit_every_t are set, they will
@@ -118,6 +122,7 @@ class MultiProcessConsumer(Consumer):
                  auto_commit_every_n=AUTO_COMMIT_MSG_COUNT,
                  auto_commit_every_t=AUTO_COMMIT_INTERVAL,
                  num_procs=1, partitions_per_proc=0,
+                 offset_storage=OFFSET_STORAGE_ZOOKEEPER,
                  **simple_consumer_options):
 
         # Initiate the base consumer class
@@ -126,7 +131,8 @@ class MultiProcessConsumer(Consumer):
             partitions=None,
             auto_commit=auto_commit,
             auto_commit_every_n=auto_commit_every_n,
-            auto_commit_every_t=auto_commit_every_t)
+            auto_commit_every_t=auto_commit_every_t,
+            offset_storage=offset_storage)
 
         # Variables for managing and controlling the data flow from
         # consumer child process to master
@@ -158,7 +164,8 @@ class MultiProcessConsumer(Consumer):
 
         self.procs = []
         for chunk in chunks:
-            options = {'partitions': list(chunk)}
+            options = {'partitions': list(chunk),
+                       'offset_storage': offset_storage}
             if simple_consumer_options:
                 simple_consumer_options.pop('partitions', None)
                 options.update(simple_consumer_options)
@@ -6,23 +6,26 @@ except ImportError:  # python 2
     from itertools import izip_longest as izip_longest, repeat
 import logging
 import time
+from collections import deque
+from threading import Condition, Event, RLock, Thread
 
 import six
 import sys
 
-try:
-    from Queue import Empty, Queue
-except ImportError:  # python 2
-    from queue import Empty, Queue
-
+from kafka.chunking import (
+    DEFAULT_MAX_PENDING_CHUNK_BYTES, DEFAULT_MAX_PENDING_CHUNK_OFFSETS,
+    Reassembler
+)
+from kafka.protocol import message_size
 from kafka.common import (
-    FetchRequest, OffsetRequest,
+    FetchRequest, OffsetRequest, OffsetAndMessage,
     ConsumerFetchSizeTooSmall, ConsumerNoMoreData,
     UnknownTopicOrPartitionError, NotLeaderForPartitionError,
     OffsetOutOfRangeError, check_error
 )
 from .base import (
     Consumer,
+    IdlePartitions,
     FETCH_DEFAULT_BLOCK_TIMEOUT,
     AUTO_COMMIT_MSG_COUNT,
     AUTO_COMMIT_INTERVAL,
@@ -31,11 +34,61 @@ from .base import (
     MAX_FETCH_BUFFER_SIZE_BYTES,
     FETCH_MAX_WAIT_TIME,
     ITER_TIMEOUT_SECONDS,
-    NO_MESSAGES_WAIT_TIME_SECONDS
+    OFFSET_STORAGE_ZOOKEEPER
 )
 
 log = logging.getLogger("kafka")
 
+# Seconds the prefetch thread waits before fetching again after an error
+PREFETCH_RETRY_BACKOFF = 1
+
+
+def _message_size(message):
+    """Bytes of the key and value of an OffsetAndMessage"""
+    return (len(message.message.key or b'') +
+            len(message.message.value or b''))
+
+
+class _FetchSize(object):
+    """
+    Fetch size of a partition, adapted after each fetch: grows to fit the
+    messages waiting (from the highwater mark and the average message size)
+    and never goes below the largest message seen, shrinks slowly while the
+    partition is idle
+    """
+    def __init__(self, size):
+        self.size = size
+        self.min_size = size
+        self.avg_message_size = None
+
+    def update(self, count, size, largest, lag, max_size):
+        """
+        count messages of size bytes (the largest of largest bytes) were
+        fetched and lag messages remain, fetch sizes are up to max_size
+        """
+        if count:
+            avg = float(size) / count
+            if self.avg_message_size is not None:
+                avg = (3 * self.avg_message_size + avg) / 4
+            self.avg_message_size = avg
+            self.min_size = max(self.min_size, largest)
+
+        new_size = self.size
+        if lag > 0 and self.avg_message_size:
+            new_size = max(new_size, int(lag * self.avg_message_size))
+        elif not count:
+            new_size -= new_size // 8
+
+        new_size = max(new_size, self.min_size)
+        if max_size is not None:
+            new_size = min(new_size, max_size)
+        self.size = new_size
+
+    def too_small(self, size):
+        """A message did not fit in size bytes"""
+        self.size = self.min_size = size
+
+
 class FetchContext(object):
     """
     Class for managing the state of a consumer during fetch
@@ -90,10 +143,16 @@ class SimpleConsumer(Consumer):
         fetch_size_bytes: number of bytes to request in a FetchRequest
 
         buffer_size: default 4K. Initial number of bytes to tell kafka we
-             have available. This will double as needed.
+             have available for each partition. This adapts to the messages
+             waiting in the partition and their size, doubling as needed for
+             large messages.
 
-        max_buffer_size: default 16K. Max number of bytes to tell kafka we have
-             available. None means no limit.
+        max_buffer_size: default 32K. Max number of bytes to tell kafka we have
+             available for a partition. None means no limit.
+
+        max_fetch_memory: default None. If set, bound of the bytes requested
+             from all the partitions at once. Fetch sizes are scaled down to
+             fit, but not below the largest message seen in each partition.
 
         iter_timeout: default None. How much time (in seconds) to wait for a
              message in the iterator before exiting. None means no
@@ -103,11 +162,62 @@ class SimpleConsumer(Consumer):
              OffsetOutOfRangeError. Valid values are largest and smallest.
              Otherwise, do not reset the offsets and raise OffsetOutOfRangeError.
 
+        reassemble_chunks: default False. Put chunked messages (sent by a
+             producer with chunk_size set, see kafka.chunking) back together.
+             Commits then stop at the first chunk of incomplete messages.
+
+        max_pending_chunk_bytes: default 64M. Bound of the chunks held for
+             incomplete messages when reassemble_chunks is set
+
+        max_pending_chunk_offsets: default 100000. Number of offsets past
+             its first chunk after which an incomplete message (e.g. from a
+             producer that died half way) is dropped. None for no limit.
+
+        dropped_chunks_callback: default None. Called as
+             callback(partition, offset) for each incomplete message dropped,
+             with the offset of its first chunk. The number of dropped
+             messages is also kept in reassembler.dropped.
+
+        prefetch_high_watermark: default None. If set, messages are fetched
+             by a background thread (with its own connections) while the
+             previous ones are processed, until this many bytes of messages
+             are buffered (exceeded by at most one fetch). It then waits
+             until the buffer drains to prefetch_low_watermark.
+
+        prefetch_low_watermark: default half of prefetch_high_watermark.
+
+        max_idle_backoff_ms: default None. If set, partitions fetched up to
+             their highwater mark are left out of the next fetches, checked
+             again after a backoff doubling up to this many milliseconds
+             while they stay idle. Partitions with lag are fetched every time.
+
+        async_commit: default False. Send commits from a background thread
+             (with its own connections) instead of blocking the consumer.
+             Commits requested while one is in flight are merged.
+
+        commit_callback: default None. Called from the background thread
+             with a dict {(topic, partition): (offset, exception)} of the
+             offsets that failed to commit with async_commit, which are
+             committed again by the next commit. Failures are logged if None.
+
+        offset_storage: default 'zookeeper'. Where offsets of the group are
+             fetched from and committed to: 'zookeeper' (through any broker)
+             or 'kafka' (through the coordinator of the group, Kafka 0.8.2+).
+
     Auto commit details:
     If both auto_commit_every_n and auto_commit_every_t are set, they will
     reset one another when one is triggered. These triggers simply call the
     commit method on this class. A manual call to commit will also reset
     these triggers
+
+    Fetched messages are queued as runs in one deque shared by all the
+    partitions, in the order of the fetch responses, and handed out in that
+    order. The prefetch watermarks bound the bytes queued for all the
+    partitions together: a partition whose messages are not consumed cannot
+    be skipped or throttled on its own. Without prefetch, messages are
+    fetched (for all the partitions) only once the queue is empty, so a
+    blocking get_messages or iterator waits for that fetch, up to the
+    timeout given to the broker, before it can return newer messages.
     """
     def __init__(self, client, group, topic, auto_commit=True, partitions=None,
                  auto_commit_every_n=AUTO_COMMIT_MSG_COUNT,
@@ -116,13 +226,27 @@ class SimpleConsumer(Consumer):
                  buffer_size=FETCH_BUFFER_SIZE_BYTES,
                  max_buffer_size=MAX_FETCH_BUFFER_SIZE_BYTES,
                  iter_timeout=None,
-                 auto_offset_reset='largest'):
+                 auto_offset_reset='largest',
+                 reassemble_chunks=False,
+                 max_pending_chunk_bytes=DEFAULT_MAX_PENDING_CHUNK_BYTES,
+                 max_pending_chunk_offsets=DEFAULT_MAX_PENDING_CHUNK_OFFSETS,
+                 dropped_chunks_callback=None,
+                 prefetch_high_watermark=None,
+                 prefetch_low_watermark=None,
+                 max_fetch_memory=None,
+                 max_idle_backoff_ms=None,
+                 async_commit=False,
+                 commit_callback=None,
+                 offset_storage=OFFSET_STORAGE_ZOOKEEPER):
         super(SimpleConsumer, self).__init__(
             client, group, topic,
             partitions=partitions,
             auto_commit=auto_commit,
             auto_commit_every_n=auto_commit_every_n,
-            auto_commit_every_t=auto_commit_every_t)
+            auto_commit_every_t=auto_commit_every_t,
+            async_commit=async_commit,
+            commit_callback=commit_callback,
+            offset_storage=offset_storage)
 
         if max_buffer_size is not None and buffer_size > max_buffer_size:
             raise ValueError("buffer_size (%d) is greater than "
@@ -130,19 +254,57 @@ class SimpleConsumer(Consumer):
                              (buffer_size, max_buffer_size))
         self.buffer_size = buffer_size
         self.max_buffer_size = max_buffer_size
+        self.max_fetch_memory = max_fetch_memory
+        self.fetch_sizes = {}  # partition -> _FetchSize
+        self.idle_partitions = None
+        if max_idle_backoff_ms is not None:
+            self.idle_partitions = IdlePartitions(max_idle_backoff_ms / 1000.0)
         self.partition_info = False     # Do not return partition info in msgs
         self.fetch_max_wait_time = FETCH_MAX_WAIT_TIME
         self.fetch_min_bytes = fetch_size_bytes
         self.fetch_offsets = self.offsets.copy()
         self.iter_timeout = iter_timeout
         self.auto_offset_reset = auto_offset_reset
-        self.queue = Queue()
+        # Fetched messages, as [partition, messages, position] runs of the
+        # messages of a partition in a fetch response
+        self.queue = deque()
+        self.queue_event = Event()  # Set when the prefetch thread queues
+        if reassemble_chunks:
+            self.reassembler = Reassembler(max_pending_chunk_bytes,
+                                           max_pending_chunk_offsets,
+                                           dropped_chunks_callback)
+
+        # Held while fetching, and to move the fetch offsets
+        self.fetch_lock = RLock()
+        self.prefetch_thread = None
+        if prefetch_high_watermark is not None:
+            if prefetch_low_watermark is None:
+                prefetch_low_watermark = prefetch_high_watermark // 2
+            if prefetch_low_watermark > prefetch_high_watermark:
+                raise ValueError("prefetch_low_watermark (%d) is greater than "
+                                 "prefetch_high_watermark (%d)" %
+                                 (prefetch_low_watermark,
+                                  prefetch_high_watermark))
+            self.prefetch_high_watermark = prefetch_high_watermark
+            self.prefetch_low_watermark = prefetch_low_watermark
+            self.queued_bytes = 0
+            self.prefetch_condition = Condition()
+            self.prefetch_error = None
+            self.prefetch_stop_event = Event()
+            self.prefetch_thread = Thread(target=self._prefetch,
+                                          args=(self.client.copy(),))
+            self.prefetch_thread.daemon = True
+            self.prefetch_thread.start()
 
     def __repr__(self):
         return '<SimpleConsumer group=%s, topic=%s, partitions=%s>' % \
             (self.group, self.topic, str(self.offsets.keys()))
 
     def reset_partition_offset(self, partition):
+        with self.fetch_lock:
+            self._reset_partition_offset(partition, self.client)
+
+    def _reset_partition_offset(self, partition, client):
         LATEST = -1
         EARLIEST = -2
         if self.auto_offset_reset == 'largest':
@@ -162,10 +324,14 @@ class SimpleConsumer(Consumer):
             raise
 
         # send_offset_request
-        (resp, ) = self.client.send_offset_request(reqs)
+        (resp, ) = client.send_offset_request(reqs)
         check_error(resp)
         self.offsets[partition] = resp.offsets[0]
         self.fetch_offsets[partition] = resp.offsets[0]
+        if self.reassembler is not None:
+            self.reassembler.reset(partition)
+        if self.idle_partitions is not None:
+            self.idle_partitions.reset(partition)
 
     def provide_partition_info(self):
         """
@@ -185,6 +351,10 @@ class SimpleConsumer(Consumer):
                 * 1 is relative to the current offset
                 * 2 is relative to the latest known offset (tail)
         """
+        with self.fetch_lock:
+            self._seek(offset, whence)
+
+    def _seek(self, offset, whence):
 
         if whence == 1:  # relative to current position
             for partition, _offset in self.offsets.items():
@@ -216,11 +386,34 @@ class SimpleConsumer(Consumer):
 
         # Reset queue and fetch offsets since they are invalid
         self.fetch_offsets = self.offsets.copy()
+        if self.reassembler is not None:
+            self.reassembler.reset()
+        if self.idle_partitions is not None:
+            self.idle_partitions.reset()
         self.count_since_commit += 1
         if self.auto_commit:
             self.commit()
 
-        self.queue = Queue()
+        self.queue = deque()
+        if self.prefetch_thread is not None:
+            with self.prefetch_condition:
+                self.queued_bytes = 0
+                self.prefetch_condition.notify()
+
+    def commit(self, partitions=None):
+        if self.prefetch_thread is not None and self.reassembler is not None:
+            # The prefetch thread adds chunks to the reassembler meanwhile
+            with self.fetch_lock:
+                return super(SimpleConsumer, self).commit(partitions)
+        return super(SimpleConsumer, self).commit(partitions)
+
+    def stop(self):
+        if self.prefetch_thread is not None:
+            self.prefetch_stop_event.set()
+            with self.prefetch_condition:
+                self.prefetch_condition.notify()
+            self.prefetch_thread.join()
+        super(SimpleConsumer, self).stop()
 
     def get_messages(self, count=1, block=True, timeout=0.1):
         """
@@ -239,21 +432,19 @@ class SimpleConsumer(Consumer):
 
         new_offsets = {}
         while count > 0 and (timeout is None or timeout > 0):
-            result = self._get_message(block, timeout, get_partition_info=True,
-                                       update_offset=False)
-            if result:
-                partition, message = result
+            runs = self._get_runs(count, block, timeout)
+            for partition, run in runs:
                 if self.partition_info:
-                    messages.append(result)
+                    messages.extend((partition, message) for message in run)
                 else:
-                    messages.append(message)
-                new_offsets[partition] = message.offset + 1
-                count -= 1
-            else:
-                # Ran out of messages for the last request.
-                if not block:
-                    # If we're not blocking, break.
-                    break
+                    messages.extend(run)
+                new_offsets[partition] = run[-1].offset + 1
+                count -= len(run)
+
+            # Ran out of messages for the last request.
+            if not runs and not block:
+                # If we're not blocking, break.
+                break
 
             # If we have a timeout, reduce it to the
             # appropriate value
@@ -277,29 +468,25 @@ class SimpleConsumer(Consumer):
         If get_partition_info is True, returns (partition, message)
         If get_partition_info is False, returns message
         """
-        if self.queue.empty():
-            # We're out of messages, go grab some more.
-            with FetchContext(self, block, timeout):
-                self._fetch()
-        try:
-            partition, message = self.queue.get_nowait()
+        runs = self._get_runs(1, block, timeout)
+        if not runs:
+            return None
+        ((partition, (message,)),) = runs
 
-            if update_offset:
-                # Update partition offset
-                self.offsets[partition] = message.offset + 1
+        if update_offset:
+            # Update partition offset
+            self.offsets[partition] = message.offset + 1
 
-                # Count, check and commit messages if necessary
-                self.count_since_commit += 1
-                self._auto_commit()
+            # Count, check and commit messages if necessary
+            self.count_since_commit += 1
+            self._auto_commit()
 
-            if get_partition_info is None:
-                get_partition_info = self.partition_info
-            if get_partition_info:
-                return partition, message
-            else:
-                return message
-        except Empty:
-            return None
+        if get_partition_info is None:
+            get_partition_info = self.partition_info
+        if get_partition_info:
+            return partition, message
+        else:
+            return message
 
     def __iter__(self):
         if self.iter_timeout is None:
@@ -308,21 +495,158 @@ class SimpleConsumer(Consumer):
             timeout = self.iter_timeout
 
         while True:
-            message = self.get_message(True, timeout)
-            if message:
-                yield message
-            elif self.iter_timeout is None:
-                # We did not receive any message yet but we don't have a
-                # timeout, so give up the CPU for a while before trying again
-                time.sleep(NO_MESSAGES_WAIT_TIME_SECONDS)
-            else:
+            runs = self._drain(1) or self._get_runs(1, True, timeout)
+            if runs:
+                ((partition, (message,)),) = runs
+                self.offsets[partition] = message.offset + 1
+                self.count_since_commit += 1
+                self._auto_commit()
+                if self.partition_info:
+                    yield partition, message
+                else:
+                    yield message
+            elif self.iter_timeout is not None:
                 # Timed out waiting for a message
                 break
 
-    def _fetch(self):
+    def _get_runs(self, count, block, timeout):
+        """
+        Take up to count queued messages, fetching them (or waiting for the
+        prefetch thread) if there are none
+        """
+        if self.prefetch_thread is not None:
+            # Raise errors of the prefetch thread (once)
+            error, self.prefetch_error = self.prefetch_error, None
+            if error is not None:
+                raise error
+            if not self.queue and block:
+                self.queue_event.clear()
+                if not self.queue:
+                    self.queue_event.wait(timeout)
+        elif not self.queue:
+            # We're out of messages, go grab some more.
+            with FetchContext(self, block, timeout):
+                self._fetch()
+        return self._drain(count)
+
+    def _drain(self, count):
+        """
+        Take up to count queued messages, as (partition, [messages]) runs,
+        in the order they were queued (whatever their partition)
+        """
+        queue = self.queue
+        runs = []
+        while count > 0 and queue:
+            run = queue[0]
+            (partition, messages, position) = run
+            end = position + count
+            if end >= len(messages):
+                queue.popleft()
+                if position:
+                    messages = messages[position:]
+            else:
+                run[2] = end
+                messages = messages[position:end]
+            runs.append((partition, messages))
+            count -= len(messages)
+
+        if self.prefetch_thread is not None and runs:
+            size = sum(_message_size(message)
+                       for _, messages in runs for message in messages)
+            with self.prefetch_condition:
+                self.queued_bytes -= size
+                if self.queued_bytes <= self.prefetch_low_watermark:
+                    self.prefetch_condition.notify()
+        return runs
+
+    def _enqueue(self, partition, messages):
+        if not messages:
+            return
+        if self.prefetch_thread is not None:
+            size = sum(_message_size(message) for message in messages)
+            with self.prefetch_condition:
+                self.queued_bytes += size
+            self.queue.append([partition, messages, 0])
+            self.queue_event.set()
+        else:
+            self.queue.append([partition, messages, 0])
+
+    def _prefetch(self, client):
+        """
+        Keep fetching messages while less than prefetch_high_watermark bytes
+        are queued, with the client copy of the prefetch thread
+        """
+        # Open separate socket connections
+        client.reinit()
+
+        while not self.prefetch_stop_event.is_set():
+            with self.prefetch_condition:
+                if self.queued_bytes >= self.prefetch_high_watermark:
+                    while (self.queued_bytes > self.prefetch_low_watermark and
+                           not self.prefetch_stop_event.is_set()):
+                        self.prefetch_condition.wait()
+            if self.prefetch_stop_event.is_set():
+                break
+
+            try:
+                with self.fetch_lock:
+                    self._fetch(client)
+            except Exception as e:
+                log.warning("Unable to prefetch messages, retrying in %ss",
+                            PREFETCH_RETRY_BACKOFF, exc_info=True)
+                self.prefetch_error = e
+                self.prefetch_stop_event.wait(PREFETCH_RETRY_BACKOFF)
+
+        client.close()
+
+    def _reassemble(self, partition, message):
+        """
+        Returns message, the message completed by a chunk (at the offset of
+        its last chunk), or None for the chunk of an incomplete message
+        """
+        value = message.message.value
+        if value is None:
+            return message
+
+        value = self.reassembler.add(partition, message.offset, value)
+        if value is None:
+            return None
+        if value is not message.message.value:
+            message = OffsetAndMessage(message.offset,
+                                       message.message._replace(value=value))
+        return message
+
+    def _partition_fetch_sizes(self):
+        """
+        The fetch size of each partition to fetch (see max_idle_backoff_ms),
+        scaled down to max_fetch_memory
+        """
+        partitions = self.fetch_offsets.keys()
+        if self.idle_partitions is not None:
+            partitions = self.idle_partitions.due(partitions)
+
+        sizes = {}
+        for partition in partitions:
+            fetch_size = self.fetch_sizes.get(partition)
+            if fetch_size is None:
+                fetch_size = self.fetch_sizes[partition] = _FetchSize(
+                    self.buffer_size)
+            sizes[partition] = fetch_size.size
+
+        total = sum(sizes.values())
+        if self.max_fetch_memory is not None and total > self.max_fetch_memory:
+            scale = float(self.max_fetch_memory) / total
+            for partition, size in sizes.items():
+                sizes[partition] = max(self.fetch_sizes[partition].min_size,
+                                       int(size * scale))
+        return sizes
+
+    def _fetch(self, client=None):
+        if client is None:
+            client = self.client
+
         # Create fetch request payloads for all the partitions
-        partitions = dict((p, self.buffer_size)
-                      for p in self.fetch_offsets.keys())
+        partitions = self._partition_fetch_sizes()
         while partitions:
             requests = []
             for partition, buffer_size in six.iteritems(partitions):
@@ -330,7 +654,7 @@ class SimpleConsumer(Consumer):
                                              self.fetch_offsets[partition],
                                              buffer_size))
             # Send request
-            responses = self.client.send_fetch_request(
+            responses = client.send_fetch_request(
                 requests,
                 max_wait_time=int(self.fetch_max_wait_time),
                 min_bytes=self.fetch_min_bytes,
@@ -343,28 +667,42 @@ class SimpleConsumer(Consumer):
                 try:
                     check_error(resp)
                 except (UnknownTopicOrPartitionError, NotLeaderForPartitionError):
-                    self.client.reset_topic_metadata(resp.topic)
+                    client.reset_topic_metadata(resp.topic)
                     raise
                 except OffsetOutOfRangeError:
                     log.warning("OffsetOutOfRangeError for %s - %d. "
                                 "Resetting partition offset...",
                                 resp.topic, resp.partition)
-                    self.reset_partition_offset(resp.partition)
+                    self._reset_partition_offset(resp.partition, client)
                     # Retry this partition
                     retry_partitions[resp.partition] = partitions[resp.partition]
                     continue
 
                 partition = resp.partition
                 buffer_size = partitions[partition]
+                if self.idle_partitions is not None:
+                    self.idle_partitions.update(partition,
+                                                self.fetch_offsets[partition],
+                                                resp.highwaterMark)
+                count = size = largest = 0
+                fetched = []
                 try:
                     for message in resp.messages:
                         if message.offset < self.fetch_offsets[partition]:
                             log.debug('Skipping message %s because its offset is less than the consumer offset',
                                       message)
                             continue
-                        # Put the message in our queue
-                        self.queue.put((partition, message))
                         self.fetch_offsets[partition] = message.offset + 1
+                        msg_size = message_size(message.message.value or b'',
+                                                message.message.key)
+                        count += 1
+                        size += msg_size
+                        largest = max(largest, msg_size)
+                        if self.reassembler is not None:
+                            message = self._reassemble(partition, message)
+                            if message is None:
+                                continue
+                        fetched.append(message)
                 except ConsumerFetchSizeTooSmall:
                     if (self.max_buffer_size is not None and
                             buffer_size == self.max_buffer_size):
@@ -378,10 +716,20 @@ class SimpleConsumer(Consumer):
                                           self.max_buffer_size)
                     log.warn("Fetch size too small, increase to %d (2x) "
                              "and retry", buffer_size)
+                    self.fetch_sizes[partition].too_small(buffer_size)
                     retry_partitions[partition] = buffer_size
+                    continue
                 except ConsumerNoMoreData as e:
                     log.debug("Iteration was ended by %r", e)
                 except StopIteration:
                     # Stop iterating through this partition
                     log.debug("Done iterating over partition %s" % partition)
+                finally:
+                    # Put the messages in our queue
+                    self._enqueue(partition, fetched)
+
+                self.fetch_sizes[partition].update(
+                    count, size, largest,
+                    resp.highwaterMark - self.fetch_offsets[partition],
+                    self.max_buffer_size)
             partitions = retry_partitions
@@ -4,6 +4,7 @@ Context manager to commit/rollback consumer offsets.
 from logging import getLogger
 
 from kafka.common import check_error, OffsetCommitRequest, OffsetOutOfRangeError
+from kafka.consumer.base import OFFSET_STORAGE_ZOOKEEPER, send_offset_commit
 
 
 class OffsetCommitContext(object):
@@ -43,11 +44,17 @@ class OffsetCommitContext(object):
     unsuccessful message (until some external error is resolved).
     """
 
-    def __init__(self, consumer):
+    def __init__(self, consumer, offset_storage=None):
         """
         :param consumer: an instance of `SimpleConsumer`
+        :param offset_storage: 'zookeeper' or 'kafka', where offsets are
+            committed to. Defaults to the offset storage of the consumer
         """
         self.consumer = consumer
+        if offset_storage is None:
+            offset_storage = getattr(consumer, 'offset_storage',
+                                     OFFSET_STORAGE_ZOOKEEPER)
+        self.offset_storage = offset_storage
         self.initial_offsets = None
         self.high_water_mark = None
         self.logger = getLogger("kafka.context")
@@ -138,13 +145,22 @@ class OffsetCommitContext(object):
         """
         self.logger.debug("Committing partition offsets: %s", partition_offsets)
 
+        # Do not commit past the first chunk of incomplete chunked messages
+        reassembler = getattr(self.consumer, 'reassembler', None)
+        if reassembler is not None:
+            partition_offsets = dict(
+                (partition, reassembler.commit_offset(partition, offset))
+                for partition, offset in partition_offsets.items())
+
         commit_requests = [
             OffsetCommitRequest(self.consumer.topic, partition, offset, None)
             for partition, offset in partition_offsets.items()
         ]
-        commit_responses = self.consumer.client.send_offset_commit_request(
+        commit_responses = send_offset_commit(
+            self.consumer.client,
             self.consumer.group,
             commit_requests,
+            self.offset_storage,
         )
         for commit_response in commit_responses:
             check_error(commit_response)
@@ -1,6 +1,10 @@
 from .roundrobin import RoundRobinPartitioner
-from .hashed import HashedPartitioner
+from .hashed import (
+    HashedPartitioner, Murmur2Partitioner, JumpHashPartitioner
+)
+from .loadaware import LoadAwarePartitioner
 
 __all__ = [
-    'RoundRobinPartitioner', 'HashedPartitioner'
+    'RoundRobinPartitioner', 'HashedPartitioner', 'Murmur2Partitioner',
+    'JumpHashPartitioner', 'LoadAwarePartitioner'
 ]
@@ -12,6 +12,19 @@ class Partitioner(object):
         """
         self.partitions = partitions
 
+    @classmethod
+    def for_topic(cls, client, topic):
+        """
+        Create a partitioner for the partitions of a topic. Producers create
+        their partitioners through this, so subclasses that need more than
+        the partition list (e.g. broker metadata) can override it.
+
+        Arguments:
+            client: the KafkaClient of the producer, with metadata for topic
+            topic: the topic the partitioner will be used for
+        """
+        return cls(client.get_partition_ids_for_topic(topic))
+
     def partition(self, key, partitions=None):
         """
         Takes a string key and num_partitions as argument and returns
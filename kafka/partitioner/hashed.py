@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from .base import Partitioner
 
 class HashedPartitioner(Partitioner):
@@ -12,3 +14,143 @@ class HashedPartitioner(Partitioner):
         idx = hash(key) % size
 
         return partitions[idx]
+
+
+class Murmur2Partitioner(Partitioner):
+    """
+    Implements a partitioner which selects the target partition based on
+    the murmur2 hash of the key, like the default partitioner of the Java
+    client. Unlike HashedPartitioner (python's salted hash()), a key maps to
+    the same partition in every process and client.
+
+    Hashes of the MEMO_SIZE most recently used keys are memoized (LRU).
+    Memoization is disabled by default; use memoized() to get a partitioner
+    class with a memo, e.g.
+    KeyedProducer(client, partitioner=Murmur2Partitioner.memoized(100000))
+    """
+    MEMO_SIZE = 0
+
+    def __init__(self, partitions):
+        super(Murmur2Partitioner, self).__init__(partitions)
+        self._memo = OrderedDict()
+
+    @classmethod
+    def memoized(cls, size):
+        """
+        Returns a subclass memoizing the hashes of up to size keys
+        """
+        return type(cls.__name__, (cls,), {'MEMO_SIZE': size})
+
+    def _hash(self, key):
+        if not self.MEMO_SIZE:
+            return murmur2(key)
+
+        h = self._memo.pop(key, None)
+        if h is None:
+            h = murmur2(key)
+            if len(self._memo) >= self.MEMO_SIZE:
+                self._memo.popitem(last=False)
+        self._memo[key] = h
+        return h
+
+    def _index(self, h, size):
+        # Java client uses toPositive(murmur2(key)) % numPartitions
+        return (h & 0x7fffffff) % size
+
+    def _index_array(self, hashes, size):
+        return (hashes & 0x7fffffff) % size
+
+    def partition(self, key, partitions=None):
+        if not partitions:
+            partitions = self.partitions
+
+        return partitions[self._index(self._hash(key), len(partitions))]
+
+    def partition_many(self, keys, partitions=None):
+        """
+        Partition many keys at once. keys is either a sequence of keys, or
+        a numpy array of fixed-width keys (see kafka.vectorized), which is
+        hashed without a per-key python loop.
+
+        Returns a list of partitions, in the order of keys
+        """
+        if not partitions:
+            partitions = self.partitions
+
+        if hasattr(keys, 'dtype'):
+            from kafka.vectorized import murmur2_array
+            idx = self._index_array(murmur2_array(keys), len(partitions))
+            return [partitions[i] for i in idx]
+
+        return [self.partition(key, partitions) for key in keys]
+
+
+class JumpHashPartitioner(Murmur2Partitioner):
+    """
+    Implements a consistent hashing partitioner: jump consistent hash
+    (Lamping & Veach, 2014) of the murmur2 hash of the key. When a topic
+    grows from N to N+1 partitions only about 1/(N+1) of the keys move (all
+    of them to the new partition), where hash % N would move almost all.
+
+    Partitions are expected to be numbered 0..N-1, as Kafka's are.
+    """
+    def _index(self, h, size):
+        return jump_hash(h, size)
+
+    def _index_array(self, hashes, size):
+        from kafka.vectorized import jump_hash_array
+        return jump_hash_array(hashes, size)
+
+
+def jump_hash(key, num_buckets):
+    """
+    Jump consistent hash of a 64-bit int key to one of num_buckets buckets
+    """
+    b, j = -1, 0
+    while j < num_buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def murmur2(key):
+    """
+    Pure-python murmur2 hash of key (bytes), as implemented by the Java
+    client (org.apache.kafka.common.utils.Utils.murmur2)
+
+    Returns an unsigned 32-bit int
+    """
+    data = bytearray(key)
+    length = len(data)
+    seed = 0x9747b28c
+    m = 0x5bd1e995
+    r = 24
+
+    h = (seed ^ length) & 0xffffffff
+
+    for i in range(0, length - length % 4, 4):
+        k = (data[i] | (data[i + 1] << 8) |
+             (data[i + 2] << 16) | (data[i + 3] << 24))
+        k = (k * m) & 0xffffffff
+        k ^= k >> r
+        k = (k * m) & 0xffffffff
+
+        h = (h * m) & 0xffffffff
+        h ^= k
+
+    tail = length & ~3
+    extra = length % 4
+    if extra >= 3:
+        h ^= data[tail + 2] << 16
+    if extra >= 2:
+        h ^= data[tail + 1] << 8
+    if extra >= 1:
+        h ^= data[tail]
+        h = (h * m) & 0xffffffff
+
+    h ^= h >> 13
+    h = (h * m) & 0xffffffff
+    h ^= h >> 15
+
+    return h
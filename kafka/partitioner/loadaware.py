@@ -0,0 +1,82 @@
+from kafka.common import TopicAndPartition
+
+from .base import Partitioner
+
+
+class LoadAwarePartitioner(Partitioner):
+    """
+    Implements a partitioner for keyless messages which sends data to all
+    partitions, weighted by the health of each partition's leader broker.
+    Partitions whose leader shows a higher produce latency or has more bytes
+    in flight (as observed by the client, see KafkaClient.broker_latency and
+    KafkaClient.broker_inflight_bytes) get proportionally fewer messages,
+    but every partition keeps at least a MIN_WEIGHT share.
+
+    The key is ignored. Since it needs the client and topic, producers
+    create it with for_topic().
+    """
+    # Smallest weight of a partition, relative to a healthy one
+    MIN_WEIGHT = 0.1
+
+    # In-flight bytes that cost as much as one healthy round trip
+    INFLIGHT_BYTES_UNIT = 1024 * 1024
+
+    def __init__(self, partitions, client=None, topic=None):
+        super(LoadAwarePartitioner, self).__init__(partitions)
+        self.client = client
+        self.topic = topic
+        self._current = {}  # partition -> smooth weighted round robin state
+
+    @classmethod
+    def for_topic(cls, client, topic):
+        return cls(client.get_partition_ids_for_topic(topic), client, topic)
+
+    def weights(self, partitions):
+        """
+        Returns the weight of each partition (in order), between
+        MIN_WEIGHT and 1.0
+        """
+        if self.client is None:
+            return [1.0] * len(partitions)
+
+        leaders = [self.client.topics_to_brokers.get(
+                       TopicAndPartition(self.topic, partition))
+                   for partition in partitions]
+        latencies = self.client.broker_latency
+        inflight = self.client.broker_inflight_bytes
+
+        # Latencies are relative to the fastest leader
+        known = [latencies[leader.nodeId] for leader in leaders
+                 if leader is not None and leader.nodeId in latencies]
+        fastest = min(known) if known else 0
+
+        weights = []
+        for leader in leaders:
+            if leader is None:
+                weights.append(self.MIN_WEIGHT)
+                continue
+
+            cost = 1.0
+            latency = latencies.get(leader.nodeId)
+            if latency is not None and fastest > 0:
+                cost = latency / fastest
+            cost += inflight.get(leader.nodeId, 0) / float(self.INFLIGHT_BYTES_UNIT)
+            weights.append(max(1.0 / cost, self.MIN_WEIGHT))
+
+        return weights
+
+    def partition(self, key, partitions=None):
+        if not partitions:
+            partitions = self.partitions
+
+        # Smooth weighted round robin: each partition is picked in
+        # proportion to its weight, and the picks are spread out evenly
+        weights = self.weights(partitions)
+        selected = None
+        for partition, weight in zip(partitions, weights):
+            self._current[partition] = self._current.get(partition, 0.0) + weight
+            if selected is None or self._current[partition] > self._current[selected]:
+                selected = partition
+
+        self._current[selected] -= sum(weights)
+        return selected
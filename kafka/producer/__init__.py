@@ -1,6 +1,8 @@
 from .simple import SimpleProducer
 from .keyed import KeyedProducer
+from .multiprocess import MultiProcessProducer
+from .spool import DiskSpool
 
 __all__ = [
-    'SimpleProducer', 'KeyedProducer'
+    'SimpleProducer', 'KeyedProducer', 'MultiProcessProducer', 'DiskSpool'
 ]
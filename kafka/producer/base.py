@@ -10,15 +10,18 @@ except ImportError:
     from Queue import Empty, Queue
 from collections import defaultdict
 
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 
 import six
 
+from kafka.chunking import chunk_value
 from kafka.common import (
-    ProduceRequest, TopicAndPartition, UnsupportedCodecError
+    ProduceRequest, TopicAndPartition, FailedPayloadsError, FlushResult,
+    KafkaConfigurationError, KafkaError, KafkaTimeoutError,
+    UnsupportedCodecError
 )
-from kafka.protocol import CODEC_NONE, ALL_CODECS, create_message_set
-from kafka.util import kafka_bytestring
+from kafka.protocol import CODEC_NONE, ALL_CODECS, create_message_sets
+from kafka.util import TokenBucket, buffer_view, kafka_bytestring
 
 log = logging.getLogger("kafka")
 
@@ -26,57 +29,344 @@ BATCH_SEND_DEFAULT_INTERVAL = 20
 BATCH_SEND_MSG_COUNT = 20
 
 STOP_ASYNC_PRODUCER = -1
+FLUSH_ASYNC_PRODUCER = -2
 
+# Priority of the messages of topics and sends without one
+DEFAULT_PRIORITY = 0
 
-def _send_upstream(queue, client, codec, batch_time, batch_size,
-                   req_acks, ack_timeout, stop_event):
-    """
-    Listen on the queue for a specified number of messages or till
-    a specified timeout and send them upstream to the brokers in one
-    request
-    """
-    stop = False
+# Seconds to wait before retrying to send spooled messages after a failure
+SPOOL_RETRY_BACKOFF = 1
 
-    while not stop_event.is_set():
-        timeout = batch_time
-        count = batch_size
-        send_at = time.time() + timeout
-        msgset = defaultdict(list)
+# Seconds between checks that the sender thread is alive while flushing
+FLUSH_CHECK_INTERVAL = 0.1
 
-        # Keep fetching till we gather enough messages or a
-        # timeout is reached
-        while count > 0 and timeout >= 0:
-            try:
-                topic_partition, msg, key = queue.get(timeout=timeout)
-
-            except Empty:
-                break
-
-            # Check if the controller has requested us to stop
-            if topic_partition == STOP_ASYNC_PRODUCER:
-                stop_event.set()
-                break
-
-            # Adjust the timeout to match the remaining period
-            count -= 1
-            timeout = send_at - time.time()
-            msgset[topic_partition].append((msg, key))
-
-        # Send collected requests upstream
-        reqs = []
-        for topic_partition, msg in msgset.items():
-            messages = create_message_set(msg, codec, key)
-            req = ProduceRequest(topic_partition.topic,
-                                 topic_partition.partition,
-                                 messages)
-            reqs.append(req)
 
+def _send_spooled(client, spool, batch_size, req_acks, ack_timeout):
+    """
+    Send the messages waiting in the spool, oldest first, until it is empty
+    or a send fails. Returns False on failure.
+    """
+    while not spool.empty():
+        reqs = spool.peek(batch_size)
         try:
-            client.send_produce_request(reqs,
-                                        acks=req_acks,
-                                        timeout=ack_timeout)
+            resps = client.send_produce_request(reqs,
+                                                acks=req_acks,
+                                                timeout=ack_timeout,
+                                                fail_on_error=False)
         except Exception:
-            log.exception("Unable to send message")
+            log.warning("Unable to send spooled messages, retrying in %ss",
+                        SPOOL_RETRY_BACKOFF, exc_info=True)
+            return False
+
+        failed = [isinstance(resp, Exception) or bool(resp.error)
+                  for resp in resps]
+        if not any(failed):
+            spool.ack(len(reqs))
+            continue
+
+        # Responses are in the order of the requests, except that none come
+        # back without acks. Keep everything after the first failure.
+        if req_acks != 0:
+            spool.ack(failed.index(True))
+        log.warning("Unable to send spooled messages, retrying in %ss",
+                    SPOOL_RETRY_BACKOFF)
+        return False
+
+    return True
+
+
+def _create_partitioner(partitioner_class, client, topic):
+    """
+    A partitioner of partitioner_class for topic, created with its
+    for_topic (see Partitioner.for_topic), or with the partitions of topic
+    for classes that do not have it
+    """
+    for_topic = getattr(partitioner_class, 'for_topic', None)
+    if for_topic is None:
+        return partitioner_class(client.get_partition_ids_for_topic(topic))
+    return for_topic(client, topic)
+
+
+def _serialize(serializer, values):
+    """
+    Serialize a list of values, with serializer.serialize_batch(values) if
+    the serializer has it, one value at a time otherwise
+    """
+    if hasattr(serializer, 'serialize_batch'):
+        return list(serializer.serialize_batch(values))
+    return [serializer(value) for value in values]
+
+
+def _serialize_msgset(serializer, msgset):
+    """
+    Serialize the values of a {topic_partition: [(value, key), ...]} batch
+    with a single _serialize call
+    """
+    items = list(msgset.items())
+    values = _serialize(serializer,
+                        [value for _, msgs in items for value, _ in msgs])
+    values = iter([buffer_view(value) for value in values])
+    return dict((topic_partition, [(next(values), key) for _, key in msgs])
+                for topic_partition, msgs in items)
+
+
+class _Flush(object):
+    """
+    A flush of the async producer: waits until the messages queued in each
+    lane before it have been sent, and counts them
+    """
+    def __init__(self, priorities):
+        self.lanes = set(priorities)  # lanes not flushed yet
+        self.messages = 0
+        self.bytes = 0
+        self.failed = 0
+        self.done = Event()
+
+    def add(self, messages, size, failed):
+        self.messages += messages - failed
+        self.bytes += size
+        self.failed += failed
+
+    def lane_done(self, priority):
+        """Returns True once all the lanes have been flushed"""
+        self.lanes.discard(priority)
+        return not self.lanes
+
+
+class _Lane(object):
+    """
+    Queue and batching parameters of one priority of the async producer,
+    and the batch being collected for it
+    """
+    def __init__(self, priority, batch_size, batch_time):
+        self.priority = priority
+        self.queue = Queue()
+        self.batch_size = batch_size
+        self.batch_time = batch_time
+        # Flushes waiting for this lane, in the order of their markers in
+        # the queue, and how many of these markers the sender has read
+        self.flushes = []
+        self.flush_markers = 0
+        # Batches started so far, changes when the sender takes the batch
+        self.batches = 0
+        self.reset()
+
+    def reset(self):
+        self.batches += 1
+        self.msgset = defaultdict(list)
+        self.count = 0
+        self.key = None
+        self.send_at = None
+
+    def add(self, topic_partition, msg, key):
+        if not self.count:
+            self.send_at = time.time() + self.batch_time
+        self.msgset[topic_partition].append((msg, key))
+        self.count += 1
+        self.key = key
+
+
+def _send_upstream(lanes, wakeup, client, codec, req_acks, ack_timeout,
+                   stop_event, spool=None, max_bytes=None,
+                   value_serializer=None):
+    """
+    Listen on the queues of the lanes (highest priority first) and send
+    the batch of a lane upstream to the brokers in one request once it
+    has batch_size messages or batch_time has passed since its first
+    message. wakeup is set whenever a message is queued.
+
+    Batches of higher priority lanes are sent first: the queues are
+    checked again after each request, so a message of a higher priority
+    waits for at most one request of a lower priority.
+
+    With a spool, the batches are appended to it and sent from there,
+    so they are kept (and retried) while the brokers cannot be reached
+
+    With max_bytes, the message set of each partition is split into message
+    sets of at most max_bytes, which are sent in as many requests as needed
+
+    With a value_serializer, the values of each batch are serialized
+    (together, see _serialize) before it is sent
+
+    A FLUSH_ASYNC_PRODUCER marker in the queue of a lane (see
+    Producer.flush) makes the batch of that lane due right away. The flush
+    is done once the batches before its markers in every lane have been
+    sent (and, with a spool, the spool is empty), or once the sender stops.
+    """
+    stopping = False
+    retry_at = 0
+    spool_batch_size = max(lane.batch_size for lane in lanes)
+    spool_flushes = []  # flushes waiting for the spool to be empty
+
+    def finish_flushes(lane, messages=0, size=0, failed=0):
+        for flush in lane.flushes:
+            flush.add(messages, size, failed)
+        while lane.flush_markers:
+            lane.flush_markers -= 1
+            flush = lane.flushes.pop(0)
+            if flush.lane_done(lane.priority):
+                spool_flushes.append(flush)
+        if spool is None or spool.empty():
+            while spool_flushes:
+                spool_flushes.pop(0).done.set()
+
+    def release_flushes():
+        # Stopped (or failed) before sending everything: the flushes still
+        # waiting are done, with the messages left counted as failed
+        for lane in lanes:
+            unsent = lane.count
+            for flush in lane.flushes[:lane.flush_markers]:
+                flush.add(unsent, 0, unsent)
+            while True:
+                try:
+                    topic_partition, msg, _ = lane.queue.get_nowait()
+                except Empty:
+                    break
+                if topic_partition == FLUSH_ASYNC_PRODUCER:
+                    msg.add(unsent, 0, unsent)
+                elif topic_partition != STOP_ASYNC_PRODUCER:
+                    unsent += 1
+            spool_flushes.extend(lane.flushes)
+            del lane.flushes[:]
+        for flush in spool_flushes:
+            flush.done.set()
+
+    def send_spooled():
+        if _send_spooled(client, spool, spool_batch_size, req_acks,
+                         ack_timeout):
+            while spool_flushes:
+                spool_flushes.pop(0).done.set()
+            return True
+        return False
+
+    try:
+        while not stop_event.is_set():
+            # Move queued messages to the batches of their lanes
+            for lane in lanes:
+                # Stop at a flush marker until the batch before it is sent
+                while lane.count < lane.batch_size and not lane.flush_markers:
+                    try:
+                        topic_partition, msg, key = lane.queue.get_nowait()
+                    except Empty:
+                        break
+
+                    # Check if the controller has requested us to stop, once
+                    # everything queued before has been sent
+                    if topic_partition == STOP_ASYNC_PRODUCER:
+                        stopping = True
+                        continue
+
+                    if topic_partition == FLUSH_ASYNC_PRODUCER:
+                        lane.flush_markers += 1
+                        if not lane.count:
+                            finish_flushes(lane)
+                        continue
+
+                    lane.add(topic_partition, msg, key)
+
+            now = time.time()
+            ready = [lane for lane in lanes if lane.count and
+                     (stopping or lane.flush_markers or
+                      lane.count >= lane.batch_size or now >= lane.send_at)]
+
+            if not ready:
+                if stopping and all(lane.queue.empty() for lane in lanes):
+                    if spool is not None and not spool.empty():
+                        send_spooled()
+                    break
+
+                if (spool is not None and not spool.empty() and
+                        now >= retry_at):
+                    if not send_spooled():
+                        retry_at = time.time() + SPOOL_RETRY_BACKOFF
+                    continue
+
+                # Wait for more messages or for the next batch to be due
+                due = [lane.send_at for lane in lanes if lane.count]
+                if spool is not None and not spool.empty():
+                    due.append(retry_at)
+                timeout = max(0, min(due) - now) if due else None
+                wakeup.wait(timeout)
+                wakeup.clear()
+                continue
+
+            # Send the batch of the highest priority lane upstream, one message
+            # set per partition and request
+            lane = ready[0]
+            msgset = lane.msgset
+            if value_serializer is not None:
+                try:
+                    msgset = _serialize_msgset(value_serializer, msgset)
+                except Exception:
+                    log.exception("Unable to serialize messages, dropping %d",
+                                  lane.count)
+                    count = lane.count
+                    lane.reset()
+                    finish_flushes(lane, count, 0, count)
+                    continue
+
+            rounds = []
+            for topic_partition, msg in msgset.items():
+                message_sets = create_message_sets(msg, codec, lane.key, max_bytes)
+                for i, messages in enumerate(message_sets):
+                    if i == len(rounds):
+                        rounds.append([])
+                    req = ProduceRequest(topic_partition.topic,
+                                         topic_partition.partition,
+                                         messages)
+                    rounds[i].append(req)
+            count = lane.count
+            sizes = dict((topic_partition, sum(len(m) for m, _ in msg
+                                               if m is not None))
+                         for topic_partition, msg in msgset.items())
+            lane.reset()
+
+            if spool is not None:
+                for reqs in rounds:
+                    spool.append(reqs)
+                if time.time() >= retry_at or stopping or lane.flushes:
+                    if not send_spooled():
+                        retry_at = time.time() + SPOOL_RETRY_BACKOFF
+                finish_flushes(lane, count, sum(sizes.values()))
+                continue
+
+            failed = set()
+            for reqs in rounds:
+                # Later message sets of a failed partition would be out of
+                # order
+                reqs = [req for req in reqs if TopicAndPartition(
+                    req.topic, req.partition) not in failed]
+                if not reqs:
+                    continue
+                try:
+                    resps = client.send_produce_request(reqs,
+                                                        acks=req_acks,
+                                                        timeout=ack_timeout,
+                                                        fail_on_error=False)
+                except Exception:
+                    log.exception("Unable to send message")
+                    failed.update(TopicAndPartition(req.topic, req.partition)
+                                  for req in reqs)
+                    continue
+
+                # Only the partitions that failed (acks=0 leaves out the
+                # responses of the others)
+                for resp in resps:
+                    if isinstance(resp, FailedPayloadsError):
+                        resp = resp.failed_payloads
+                    elif not resp.error:
+                        continue
+                    log.error("Unable to send messages to %s:%d",
+                              resp.topic, resp.partition)
+                    failed.add(TopicAndPartition(resp.topic, resp.partition))
+            finish_flushes(lane, count,
+                           sum(size for tp, size in sizes.items()
+                               if tp not in failed),
+                           sum(len(msgset[tp]) for tp in failed))
+    finally:
+        release_flushes()
+        if spool is not None:
+            spool.close()
 
 
 class Producer(object):
@@ -97,6 +387,54 @@ class Producer(object):
         batch_send: If True, messages are send in batches
         batch_send_every_n: If set, messages are send in batches of this size
         batch_send_every_t: If set, messages are send after this timeout
+        partition_refresh_interval: If set, reload the metadata of a topic
+            every this many seconds when sending to it, to pick up partitions
+            added to the topic. Partitioners are rebuilt whenever the client
+            sees a different number of partitions for a topic, also without
+            this setting (e.g. after metadata is reloaded on errors)
+        spool: An optional DiskSpool (see kafka.producer.spool), async only.
+            Batches go through it and stay there until they have been
+            acknowledged, spilling to disk past its memory threshold, and
+            are retried in order while the brokers cannot be reached
+        max_message_set_bytes: If set, split the messages sent to a partition
+            into message sets of at most this many bytes (e.g. the broker's
+            message.max.bytes), sent in order in separate requests. With a
+            codec, each compressed message stays under this size. Once a
+            message set of a partition fails, the following ones are not
+            sent. Sync producers then raise, although the message sets
+            before it were sent: sending the messages again duplicates them
+        chunk_size: If set, split message values larger than this many
+            bytes into chunk messages (see kafka.chunking), for consumers
+            created with reassemble_chunks=True to put back together
+        max_bytes_per_sec: If set, send_messages waits as needed to keep the
+            payload bytes sent (or queued, when async) under this rate
+        max_messages_per_sec: If set, send_messages waits as needed to keep
+            the messages sent (or queued, when async) under this rate
+        rate_limit_per_topic: If True, apply the above limits to each topic
+            separately instead of to all the messages of the producer
+        rate_limit_burst: How many seconds worth of the rates can be sent at
+            once after a pause (at least a whole batch of messages when
+            batch_send is set)
+        priorities: For async producers, a dict of additional priority lanes
+            {priority: (batch_send_every_n, batch_send_every_t)}, where
+            priority is an int above or below DEFAULT_PRIORITY (whose lane
+            uses the batch_send settings). Each lane has its own queue and
+            batches, and the batches of higher priorities are sent first.
+            E.g. {10: (1, 0)} sends messages of priority 10 right away
+        topic_priorities: A dict {topic: priority} of the priority of the
+            messages of each topic, which send_messages can override with its
+            priority keyword argument
+        key_serializer: A callable turning the message keys passed to
+            send_messages into bytes
+        value_serializer: A callable turning the message values passed to
+            send_messages into bytes. If it has a serialize_batch method,
+            that is called instead with a list of values and must return a
+            list of bytes, so that encoders can work on whole batches
+        serialize_in_sender: If True (async producers only), values are
+            serialized on the sender thread, one batch at a time, instead of
+            in send_messages. Values that cannot be serialized are then
+            logged and dropped. Not supported with chunk_size or
+            max_bytes_per_sec, which need the serialized values
     """
 
     ACK_NOT_REQUIRED = 0            # No ack is required
@@ -111,7 +449,20 @@ class Producer(object):
                  codec=None,
                  batch_send=False,
                  batch_send_every_n=BATCH_SEND_MSG_COUNT,
-                 batch_send_every_t=BATCH_SEND_DEFAULT_INTERVAL):
+                 batch_send_every_t=BATCH_SEND_DEFAULT_INTERVAL,
+                 partition_refresh_interval=None,
+                 spool=None,
+                 max_message_set_bytes=None,
+                 chunk_size=None,
+                 max_bytes_per_sec=None,
+                 max_messages_per_sec=None,
+                 rate_limit_per_topic=False,
+                 rate_limit_burst=1,
+                 priorities=None,
+                 topic_priorities=None,
+                 key_serializer=None,
+                 value_serializer=None,
+                 serialize_in_sender=False):
 
         if batch_send:
             async = True
@@ -123,8 +474,12 @@ class Producer(object):
 
         self.client = client
         self.async = async
+        self.batch_send_every_n = batch_send_every_n
+        self.batch_send_every_t = batch_send_every_t
         self.req_acks = req_acks
         self.ack_timeout = ack_timeout
+        self.partition_refresh_interval = partition_refresh_interval
+        self.partition_refresh_times = {}  # topic -> next metadata reload
         self.stopped = False
 
         if codec is None:
@@ -134,21 +489,64 @@ class Producer(object):
 
         self.codec = codec
 
+        if spool is not None and not self.async:
+            raise KafkaConfigurationError("A spool requires an async producer")
+        self.spool = spool
+        self.max_message_set_bytes = max_message_set_bytes
+        self.chunk_size = chunk_size
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.max_messages_per_sec = max_messages_per_sec
+        self.rate_limit_per_topic = rate_limit_per_topic
+        self.rate_limit_burst = rate_limit_burst
+        self.rate_limiters = {}  # topic (or None) -> (bytes, messages) buckets
+
+        if priorities and not self.async:
+            raise KafkaConfigurationError("Priorities require an async producer")
+        if serialize_in_sender:
+            if not self.async:
+                raise KafkaConfigurationError(
+                    "serialize_in_sender requires an async producer")
+            if chunk_size is not None or max_bytes_per_sec is not None:
+                raise KafkaConfigurationError(
+                    "serialize_in_sender does not support chunk_size or "
+                    "max_bytes_per_sec")
+        self.key_serializer = key_serializer
+        self.value_serializer = value_serializer
+        self.serialize_in_sender = serialize_in_sender and value_serializer is not None
+
+        self.topic_priorities = dict((kafka_bytestring(topic), priority)
+                                     for topic, priority in
+                                     (topic_priorities or {}).items())
+
         if self.async:
             log.warning("async producer does not guarantee message delivery!")
             log.warning("Current implementation does not retry Failed messages")
             log.warning("Use at your own risk! (or help improve with a PR!)")
-            self.queue = Queue()  # Messages are sent through this queue
+            # Messages are sent through the queue of their priority lane
+            self.lanes = {DEFAULT_PRIORITY: _Lane(DEFAULT_PRIORITY,
+                                                  batch_send_every_n,
+                                                  batch_send_every_t)}
+            for priority, (every_n, every_t) in (priorities or {}).items():
+                if priority != DEFAULT_PRIORITY:
+                    self.lanes[priority] = _Lane(priority, every_n, every_t)
+            self.queue = self.lanes[DEFAULT_PRIORITY].queue
+            self.queue_event = Event()  # Set when a message is queued
+            self.flush_lock = Lock()
             self.thread_stop_event = Event()
+            lanes = sorted(self.lanes.values(),
+                           key=lambda lane: lane.priority, reverse=True)
             self.thread = Thread(target=_send_upstream,
-                                 args=(self.queue,
+                                 args=(lanes,
+                                       self.queue_event,
                                        self.client.copy(),
                                        self.codec,
-                                       batch_send_every_t,
-                                       batch_send_every_n,
                                        self.req_acks,
                                        self.ack_timeout,
-                                       self.thread_stop_event))
+                                       self.thread_stop_event,
+                                       self.spool,
+                                       self.max_message_set_bytes,
+                                       self.value_serializer
+                                       if self.serialize_in_sender else None))
 
             # Thread will die if main thread exits
             self.thread.daemon = True
@@ -160,7 +558,71 @@ class Producer(object):
             self._cleanup_func = cleanup
             atexit.register(cleanup, self)
 
-    def send_messages(self, topic, partition, *msg):
+    def _partitions_changed(self, topic, partitions):
+        """
+        Returns True if the client knows a different number of partitions
+        for topic than len(partitions) (never if partitions is None).
+        Reloads the topic metadata first if partition_refresh_interval has
+        passed since the last reload.
+        """
+        if self.partition_refresh_interval is not None:
+            now = time.time()
+            refresh_at = self.partition_refresh_times.setdefault(
+                topic, now + self.partition_refresh_interval)
+            if now >= refresh_at:
+                self.partition_refresh_times[topic] = (
+                    now + self.partition_refresh_interval)
+                try:
+                    self.client.load_metadata_for_topics(topic)
+                except KafkaError:
+                    log.warning("Unable to refresh metadata for topic %s",
+                                topic, exc_info=True)
+
+        # Called on every send: count without building the sorted list
+        # of get_partition_ids_for_topic
+        known = len(self.client.topic_partitions.get(topic, ()))
+        return (bool(known) and partitions is not None and
+                known != len(partitions))
+
+    def _throttle(self, topic, msg):
+        """
+        Wait until msg can be sent within max_bytes_per_sec and
+        max_messages_per_sec
+        """
+        if self.max_bytes_per_sec is None and self.max_messages_per_sec is None:
+            return
+
+        key = topic if self.rate_limit_per_topic else None
+        buckets = self.rate_limiters.get(key)
+        if buckets is None:
+            bytes_bucket = messages_bucket = None
+            if self.max_bytes_per_sec is not None:
+                bytes_bucket = TokenBucket(
+                    self.max_bytes_per_sec,
+                    self.max_bytes_per_sec * self.rate_limit_burst)
+            if self.max_messages_per_sec is not None:
+                messages_bucket = TokenBucket(
+                    self.max_messages_per_sec,
+                    max(self.max_messages_per_sec * self.rate_limit_burst,
+                        self.batch_send_every_n))
+            buckets = self.rate_limiters.setdefault(
+                key, (bytes_bucket, messages_bucket))
+
+        (bytes_bucket, messages_bucket) = buckets
+        delay = 0
+        if bytes_bucket is not None:
+            delay = bytes_bucket.reserve(sum(len(m) for m in msg))
+        if messages_bucket is not None:
+            delay = max(delay, messages_bucket.reserve(len(msg)))
+        if delay > 0:
+            time.sleep(delay)
+
+    def _serialize_key(self, key):
+        if key is not None and self.key_serializer is not None:
+            key = self.key_serializer(key)
+        return key
+
+    def send_messages(self, topic, partition, *msg, **kwargs):
         """
         Helper method to send produce requests
         @param: topic, name of topic for produce request -- type str
@@ -169,26 +631,49 @@ class Producer(object):
         @returns: ResponseRequest returned by server
         raises on error
 
-        Note that msg type *must* be encoded to bytes by user.
+        Note that msg type *must* be encoded to bytes by user (unless the
+        producer has a value_serializer).
         Passing unicode message will not work, for example
         you should encode before calling send_messages via
         something like `unicode_message.encode('utf-8')`
 
+        Any other contiguous buffer (bytearray, memoryview, mmap...) is
+        accepted as well and, on python 3, is sent without being copied to
+        bytes first.
+        In async mode the buffer must not be modified until it has been sent.
+
         All messages produced via this method will set the message 'key' to Null
+
+        In async mode, the priority keyword argument selects the priority
+        lane of the messages (see the priorities argument of Producer)
         """
         topic = kafka_bytestring(topic)
-        return self._send_messages(topic, partition, *msg)
+        return self._send_messages(topic, partition, *msg, **kwargs)
 
     def _send_messages(self, topic, partition, *msg, **kwargs):
         key = kwargs.pop('key', None)
+        priority = kwargs.pop('priority', None)
 
         # Guarantee that msg is actually a list or tuple (should always be true)
         if not isinstance(msg, (list, tuple)):
             raise TypeError("msg is not a list or tuple!")
 
-        # Raise TypeError if any message is not encoded as bytes
-        if any(not isinstance(m, six.binary_type) for m in msg):
-            raise TypeError("all produce message payloads must be type bytes")
+        if self.serialize_in_sender:
+            # Serialized (and checked) by the sender thread
+            msg = list(msg)
+        else:
+            if self.value_serializer is not None:
+                msg = _serialize(self.value_serializer, list(msg))
+
+            # Raise TypeError if any message is not encoded as bytes
+            # (or another buffer, e.g. bytearray / memoryview / mmap)
+            try:
+                msg = [buffer_view(m) for m in msg]
+            except TypeError:
+                raise TypeError("all produce message payloads must be type bytes")
+
+        if self.chunk_size is not None:
+            msg = [chunk for m in msg for chunk in chunk_value(m, self.chunk_size)]
 
         # Raise TypeError if topic is not encoded as bytes
         if not isinstance(topic, six.binary_type):
@@ -198,21 +683,81 @@ class Producer(object):
         if key is not None and not isinstance(key, six.binary_type):
             raise TypeError("the key must be type bytes")
 
+        self._throttle(topic, msg)
+
         if self.async:
+            if priority is None:
+                priority = self.topic_priorities.get(topic, DEFAULT_PRIORITY)
+            try:
+                queue = self.lanes[priority].queue
+            except KeyError:
+                raise ValueError("Unknown priority %r" % (priority,))
             for m in msg:
-                self.queue.put((TopicAndPartition(topic, partition), m, key))
+                queue.put((TopicAndPartition(topic, partition), m, key))
+            self.queue_event.set()
             resp = []
         else:
-            messages = create_message_set([(m, key) for m in msg], self.codec, key)
-            req = ProduceRequest(topic, partition, messages)
-            try:
-                resp = self.client.send_produce_request([req], acks=self.req_acks,
-                                                        timeout=self.ack_timeout)
-            except Exception:
-                log.exception("Unable to send messages")
-                raise
+            message_sets = create_message_sets([(m, key) for m in msg],
+                                               self.codec, key,
+                                               self.max_message_set_bytes)
+            resp = []
+            for messages in message_sets:
+                req = ProduceRequest(topic, partition, messages)
+                try:
+                    resp.extend(self.client.send_produce_request(
+                        [req], acks=self.req_acks, timeout=self.ack_timeout))
+                except Exception:
+                    log.exception("Unable to send messages")
+                    raise
         return resp
 
+    def flush(self, timeout=None):
+        """
+        Send the messages queued so far (in every priority lane) without
+        waiting for their batches to fill up, and wait until they have been
+        sent and acknowledged (as per req_acks). With a spool, also wait
+        until it is empty. The producer keeps running: messages sent while
+        flushing go in the next batches.
+
+        Sync producers send messages right away, there is nothing to flush.
+
+        Arguments:
+            timeout: How long to wait at most, in seconds (None to wait until
+                the messages are sent)
+
+        Returns:
+            FlushResult: messages and bytes sent, messages that could not
+            be sent (and were dropped) and how long it took
+
+        Raises:
+            KafkaTimeoutError: if the messages were not sent within timeout
+        """
+        start = time.time()
+        if not self.async or self.stopped or not self.thread.is_alive():
+            return FlushResult(0, 0, 0, 0.0)
+
+        flush = _Flush(self.lanes)
+        with self.flush_lock:  # keep markers in the order of lane.flushes
+            for lane in self.lanes.values():
+                lane.flushes.append(flush)
+                lane.queue.put((FLUSH_ASYNC_PRODUCER, flush, None))
+        self.queue_event.set()
+
+        # The sender thread releases the flushes waiting when it stops,
+        # but may have stopped before this one was queued
+        deadline = None if timeout is None else start + timeout
+        while not flush.done.is_set() and self.thread.is_alive():
+            wait = FLUSH_CHECK_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    break
+            flush.done.wait(wait)
+        if not flush.done.is_set() and self.thread.is_alive():
+            raise KafkaTimeoutError("Unable to flush within %ss" % timeout)
+        return FlushResult(flush.messages, flush.bytes, flush.failed,
+                           time.time() - start)
+
     def stop(self, timeout=1):
         """
         Stop the producer. Optionally wait for the specified timeout before
@@ -220,10 +765,12 @@ class Producer(object):
         """
         if self.async:
             self.queue.put((STOP_ASYNC_PRODUCER, None, None))
+            self.queue_event.set()
             self.thread.join(timeout)
 
             if self.thread.is_alive():
                 self.thread_stop_event.set()
+                self.queue_event.set()
 
         if hasattr(self, '_cleanup_func'):
             # Remove cleanup handler now that we've stopped
@@ -247,5 +794,6 @@ class Producer(object):
         self.stopped = True
 
     def __del__(self):
-        if not self.stopped:
+        # Not set if __init__ raised early
+        if not getattr(self, 'stopped', True):
             self.stop()
@@ -7,7 +7,7 @@ from kafka.util import kafka_bytestring
 
 from .base import (
     Producer, BATCH_SEND_DEFAULT_INTERVAL,
-    BATCH_SEND_MSG_COUNT
+    BATCH_SEND_MSG_COUNT, _create_partitioner
 )
 
 log = logging.getLogger("kafka")
@@ -30,6 +30,28 @@ class KeyedProducer(Producer):
         batch_send: If True, messages are send in batches
         batch_send_every_n: If set, messages are send in batches of this size
         batch_send_every_t: If set, messages are send after this timeout
+        partition_refresh_interval: If set, reload the metadata of a topic
+            every this many seconds, to pick up added partitions
+        spool: An optional DiskSpool holding unsent batches, see Producer
+        max_message_set_bytes: If set, split the messages sent to a partition
+            into message sets of at most this many bytes, see Producer
+        chunk_size: If set, split message values larger than this many
+            bytes into chunk messages, see Producer
+        max_bytes_per_sec: If set, limit the rate of payload bytes sent
+        max_messages_per_sec: If set, limit the rate of messages sent
+        rate_limit_per_topic: If True, limit the rates of each topic
+            separately
+        rate_limit_burst: Seconds worth of the rates that can be sent at
+            once, see Producer
+        priorities: For async producers, a dict of additional priority lanes
+            {priority: (batch_send_every_n, batch_send_every_t)}, see Producer
+        topic_priorities: A dict {topic: priority}. send_messages also
+            takes a priority keyword argument
+        key_serializer: A callable turning message keys into bytes
+        value_serializer: A callable turning message values into bytes,
+            optionally with a serialize_batch method, see Producer
+        serialize_in_sender: If True, serialize values on the sender thread
+            of an async producer, see Producer
     """
     def __init__(self, client, partitioner=None, async=False,
                  req_acks=Producer.ACK_AFTER_LOCAL_WRITE,
@@ -37,7 +59,20 @@ class KeyedProducer(Producer):
                  codec=None,
                  batch_send=False,
                  batch_send_every_n=BATCH_SEND_MSG_COUNT,
-                 batch_send_every_t=BATCH_SEND_DEFAULT_INTERVAL):
+                 batch_send_every_t=BATCH_SEND_DEFAULT_INTERVAL,
+                 partition_refresh_interval=None,
+                 spool=None,
+                 max_message_set_bytes=None,
+                 chunk_size=None,
+                 max_bytes_per_sec=None,
+                 max_messages_per_sec=None,
+                 rate_limit_per_topic=False,
+                 rate_limit_burst=1,
+                 priorities=None,
+                 topic_priorities=None,
+                 key_serializer=None,
+                 value_serializer=None,
+                 serialize_in_sender=False):
         if not partitioner:
             partitioner = HashedPartitioner
         self.partitioner_class = partitioner
@@ -46,27 +81,46 @@ class KeyedProducer(Producer):
         super(KeyedProducer, self).__init__(client, async, req_acks,
                                             ack_timeout, codec, batch_send,
                                             batch_send_every_n,
-                                            batch_send_every_t)
+                                            batch_send_every_t,
+                                            partition_refresh_interval,
+                                            spool,
+                                            max_message_set_bytes,
+                                            chunk_size,
+                                            max_bytes_per_sec,
+                                            max_messages_per_sec,
+                                            rate_limit_per_topic,
+                                            rate_limit_burst,
+                                            priorities,
+                                            topic_priorities,
+                                            key_serializer,
+                                            value_serializer,
+                                            serialize_in_sender)
 
     def _next_partition(self, topic, key):
-        if topic not in self.partitioners:
+        if (topic not in self.partitioners or
+                self._partitions_changed(topic, getattr(self.partitioners[topic],
+                                                        'partitions', None))):
             if not self.client.has_metadata_for_topic(topic):
                 self.client.load_metadata_for_topics(topic)
 
-            self.partitioners[topic] = self.partitioner_class(self.client.get_partition_ids_for_topic(topic))
+            self.partitioners[topic] = _create_partitioner(
+                self.partitioner_class, self.client, topic)
 
         partitioner = self.partitioners[topic]
         return partitioner.partition(key)
 
-    def send_messages(self,topic,key,*msg):
+    def send_messages(self,topic,key,*msg,**kwargs):
         topic = kafka_bytestring(topic)
+        key = self._serialize_key(key)
         partition = self._next_partition(topic, key)
-        return self._send_messages(topic, partition, *msg,key=key)
+        return self._send_messages(topic, partition, *msg, key=key, **kwargs)
 
-    def send(self, topic, key, msg):
+    def send(self, topic, key, msg, priority=None):
         topic = kafka_bytestring(topic)
+        key = self._serialize_key(key)
         partition = self._next_partition(topic, key)
-        return self._send_messages(topic, partition, msg, key=key)
+        return self._send_messages(topic, partition, msg, key=key,
+                                   priority=priority)
 
     def __repr__(self):
         return '<KeyedProducer batch=%s>' % self.async
@@ -0,0 +1,297 @@
+from __future__ import absolute_import
+
+import logging
+import time
+from collections import defaultdict
+from multiprocessing import Process, Queue as MPQueue
+from threading import Lock, Thread
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+import six
+
+from kafka.common import ProduceRequest, TopicAndPartition, UnsupportedCodecError
+from kafka.partitioner import HashedPartitioner
+from kafka.protocol import CODEC_NONE, ALL_CODECS, create_message_sets
+from kafka.util import buffer_view, crc32, kafka_bytestring
+
+from .base import (
+    Producer, BATCH_SEND_DEFAULT_INTERVAL, BATCH_SEND_MSG_COUNT,
+    _create_partitioner, _serialize
+)
+
+log = logging.getLogger("kafka")
+
+STOP_PRODUCER_PROCESS = None
+
+
+def _mp_produce(client, queue, results, codec, req_acks, ack_timeout,
+                batch_size, batch_time, max_bytes=None, value_serializer=None):
+    """
+    A child process worker which serializes, encodes and sends the messages
+    of its partitions, in batches of batch_size messages or batch_time
+    seconds. Reports (messages, bytes, failures) for each batch on results.
+
+    NOTE: Ideally, this should have been a method inside the Producer
+    class. However, multiprocessing module has issues in windows. The
+    functionality breaks unless this function is kept outside of a class
+    """
+
+    # Make the child processes open separate socket connections
+    client.reinit()
+
+    stop = False
+    while not stop:
+        msgset = defaultdict(list)
+        count = 0
+        send_at = None
+
+        # Wait for a first message, then gather the rest of the batch
+        while count < batch_size:
+            timeout = None if send_at is None else send_at - time.time()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                item = queue.get(timeout=timeout)
+            except Empty:
+                break
+
+            if item is STOP_PRODUCER_PROCESS:
+                stop = True
+                break
+
+            topic, partition, values, key = item
+            msgset[TopicAndPartition(topic, partition)].extend(
+                (value, key) for value in values)
+            count += len(values)
+            if send_at is None:
+                send_at = time.time() + batch_time
+
+        if not msgset:
+            continue
+
+        sizes = {}  # TopicAndPartition -> bytes
+        failures = {}  # TopicAndPartition -> error
+        rounds = []
+        for topic_partition, msgs in msgset.items():
+            try:
+                if value_serializer is not None:
+                    values = _serialize(value_serializer,
+                                        [value for value, _ in msgs])
+                    msgs = [(buffer_view(value), key)
+                            for value, (_, key) in zip(values, msgs)]
+                message_sets = create_message_sets(msgs, codec, msgs[-1][1],
+                                                   max_bytes)
+                sizes[topic_partition] = sum(len(value) for value, _ in msgs
+                                             if value is not None)
+            except Exception as e:
+                log.exception("Unable to encode messages")
+                failures[topic_partition] = e
+                continue
+
+            for i, messages in enumerate(message_sets):
+                if i == len(rounds):
+                    rounds.append([])
+                rounds[i].append(ProduceRequest(topic_partition.topic,
+                                                topic_partition.partition,
+                                                messages))
+
+        for reqs in rounds:
+            # Later message sets of a failed partition would be out of order
+            reqs = [req for req in reqs if
+                    TopicAndPartition(req.topic, req.partition) not in failures]
+            if not reqs:
+                continue
+            try:
+                resps = client.send_produce_request(reqs,
+                                                    acks=req_acks,
+                                                    timeout=ack_timeout,
+                                                    fail_on_error=False)
+            except Exception as e:
+                log.exception("Unable to send messages")
+                resps = [e] * len(reqs)
+
+            for req, resp in zip(reqs, resps):
+                if isinstance(resp, Exception) or resp.error:
+                    failures[TopicAndPartition(req.topic, req.partition)] = resp
+
+        # The bytes of failed partitions are not sent, like their messages
+        size = sum(partition_size for tp, partition_size in sizes.items()
+                   if tp not in failures)
+        failures = [(tp.topic, tp.partition, len(msgset[tp]), repr(error))
+                    for tp, error in failures.items()]
+        results.put((count, size, failures))
+
+    results.put(STOP_PRODUCER_PROCESS)
+
+
+class MultiProcessProducer(object):
+    """
+    A producer that encodes, compresses and sends messages from multiple
+    processes, for when serialization and compression make producing CPU
+    bound. The partitions are sharded across the processes, each with its
+    own connections, so that the messages of a partition keep their order.
+
+    Messages are sent asynchronously, in batches: send_messages and send
+    only hand them over to the process of their partition. The processes
+    report back how many messages and bytes they sent, and the failures,
+    which are collected in messages_sent, bytes_sent and failures.
+
+    Arguments:
+        client: The Kafka client instance to use
+
+    Keyword Arguments:
+        num_procs: Number of processes to start
+        partitioner: A partitioner class used by send() to pick the partition
+            of a key. Defaults to HashedPartitioner
+        req_acks: A value indicating the acknowledgements that the server must
+            receive before responding to the request
+        ack_timeout: Value (in milliseconds) indicating a timeout for waiting
+            for an acknowledgement
+        codec: The compression codec, applied in the processes
+        batch_send_every_n: Messages are sent in batches of this size
+        batch_send_every_t: Messages are sent after this timeout
+        max_message_set_bytes: If set, split the messages sent to a partition
+            into message sets of at most this many bytes, see Producer
+        key_serializer: A callable turning message keys into bytes, called in
+            this process
+        value_serializer: A callable turning message values into bytes (or
+            with a serialize_batch method, see Producer), called in the
+            processes. Must be picklable
+    """
+    def __init__(self, client, num_procs=2, partitioner=None,
+                 req_acks=Producer.ACK_AFTER_LOCAL_WRITE,
+                 ack_timeout=Producer.DEFAULT_ACK_TIMEOUT,
+                 codec=None,
+                 batch_send_every_n=BATCH_SEND_MSG_COUNT,
+                 batch_send_every_t=BATCH_SEND_DEFAULT_INTERVAL,
+                 max_message_set_bytes=None,
+                 key_serializer=None,
+                 value_serializer=None):
+
+        if codec is None:
+            codec = CODEC_NONE
+        elif codec not in ALL_CODECS:
+            raise UnsupportedCodecError("Codec 0x%02x unsupported" % codec)
+
+        self.client = client
+        self.partitioner_class = partitioner or HashedPartitioner
+        self.partitioners = {}
+        self.key_serializer = key_serializer
+        self.value_serializer = value_serializer
+
+        # Results reported by the processes
+        self.lock = Lock()
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.failures = []  # (topic, partition, message count, error)
+        self.outstanding = 0  # messages handed over and not reported yet
+        self.results = MPQueue()
+
+        self.queues = []
+        self.procs = []
+        for _ in range(num_procs):
+            queue = MPQueue()
+            args = (client.copy(), queue, self.results, codec, req_acks,
+                    ack_timeout, batch_send_every_n, batch_send_every_t,
+                    max_message_set_bytes, value_serializer)
+            proc = Process(target=_mp_produce, args=args)
+            proc.daemon = True
+            proc.start()
+            self.queues.append(queue)
+            self.procs.append(proc)
+
+        self.collector = Thread(target=self._collect_results)
+        self.collector.daemon = True
+        self.collector.start()
+        self.stopped = False
+
+    def _collect_results(self):
+        running = len(self.procs)
+        while running:
+            result = self.results.get()
+            if result is STOP_PRODUCER_PROCESS:
+                running -= 1
+                continue
+
+            (count, size, failures) = result
+            with self.lock:
+                self.outstanding -= count
+                self.bytes_sent += size
+                self.failures.extend(failures)
+                self.messages_sent += count - sum(
+                    failure[2] for failure in failures)
+            for failure in failures:
+                log.error("Unable to send messages to %s:%s: %s",
+                          failure[0], failure[1], failure[3])
+
+    def _queue_for(self, topic, partition):
+        # All the messages of a partition go through the same process
+        return self.queues[(crc32(topic) + partition) % len(self.queues)]
+
+    def send_messages(self, topic, partition, *msg, **kwargs):
+        """
+        Hand messages over to the process of partition, to be sent in its
+        next batch. The key keyword argument sets the key of the messages.
+        """
+        topic = kafka_bytestring(topic)
+        key = kwargs.pop('key', None)
+
+        if self.value_serializer is None:
+            # Raise TypeError if any message is not encoded as bytes
+            try:
+                msg = [bytes(buffer_view(m)) for m in msg]
+            except TypeError:
+                raise TypeError("all produce message payloads must be type bytes")
+        else:
+            msg = list(msg)
+
+        if key is not None and not isinstance(key, six.binary_type):
+            raise TypeError("the key must be type bytes")
+
+        with self.lock:
+            self.outstanding += len(msg)
+        self._queue_for(topic, partition).put((topic, partition, msg, key))
+
+    def send(self, topic, key, msg):
+        """
+        Hand a message over to the process of the partition of key
+        """
+        topic = kafka_bytestring(topic)
+        if key is not None and self.key_serializer is not None:
+            key = self.key_serializer(key)
+
+        if topic not in self.partitioners:
+            if not self.client.has_metadata_for_topic(topic):
+                self.client.load_metadata_for_topics(topic)
+            self.partitioners[topic] = _create_partitioner(
+                self.partitioner_class, self.client, topic)
+
+        partition = self.partitioners[topic].partition(key)
+        return self.send_messages(topic, partition, msg, key=key)
+
+    def stop(self, timeout=None):
+        """
+        Send the messages handed over so far, then stop the processes.
+        Waits up to timeout seconds (forever if None) before terminating them
+        """
+        if self.stopped:
+            return
+        for queue in self.queues:
+            queue.put(STOP_PRODUCER_PROCESS)
+
+        deadline = None if timeout is None else time.time() + timeout
+        for proc in self.procs:
+            proc.join(None if deadline is None
+                      else max(0, deadline - time.time()))
+            if proc.is_alive():
+                proc.terminate()
+        self.collector.join(None if deadline is None
+                            else max(0, deadline - time.time()))
+        self.stopped = True
+
+    def __repr__(self):
+        return '<MultiProcessProducer procs=%d>' % len(self.procs)
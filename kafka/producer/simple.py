@@ -2,15 +2,18 @@ from __future__ import absolute_import
 
 import logging
 import random
+
 import six
 
 from itertools import cycle
 
 from six.moves import xrange
 
+from kafka.common import KafkaConfigurationError
+
 from .base import (
     Producer, BATCH_SEND_DEFAULT_INTERVAL,
-    BATCH_SEND_MSG_COUNT
+    BATCH_SEND_MSG_COUNT, DEFAULT_PRIORITY, _create_partitioner
 )
 
 log = logging.getLogger("kafka")
@@ -37,6 +40,36 @@ class SimpleProducer(Producer):
             the first message block will be published to, otherwise
             if false, the first message block will always publish
             to partition 0 before cycling through each partition
+        partitioner: An optional partitioner class (derived from Partitioner)
+            used to pick the partition for each send, e.g.
+            LoadAwarePartitioner. Defaults to cycling through the partitions
+        sticky: If True (requires batch_send), keep sending to the same
+            partition of a topic until the batch of its priority lane is
+            sent (full, due, or flushed), then move on to the next
+            partition. Batches then hold fewer, larger per-partition
+            message sets, which compress better
+        partition_refresh_interval: If set, reload the metadata of a topic
+            every this many seconds, to pick up added partitions
+        spool: An optional DiskSpool holding unsent batches, see Producer
+        max_message_set_bytes: If set, split the messages sent to a partition
+            into message sets of at most this many bytes, see Producer
+        chunk_size: If set, split message values larger than this many
+            bytes into chunk messages, see Producer
+        max_bytes_per_sec: If set, limit the rate of payload bytes sent
+        max_messages_per_sec: If set, limit the rate of messages sent
+        rate_limit_per_topic: If True, limit the rates of each topic
+            separately
+        rate_limit_burst: Seconds worth of the rates that can be sent at
+            once, see Producer
+        priorities: For async producers, a dict of additional priority lanes
+            {priority: (batch_send_every_n, batch_send_every_t)}, see Producer
+        topic_priorities: A dict {topic: priority}. send_messages also
+            takes a priority keyword argument
+        key_serializer: A callable turning message keys into bytes
+        value_serializer: A callable turning message values into bytes,
+            optionally with a serialize_batch method, see Producer
+        serialize_in_sender: If True, serialize values on the sender thread
+            of an async producer, see Producer
     """
     def __init__(self, client, async=False,
                  req_acks=Producer.ACK_AFTER_LOCAL_WRITE,
@@ -45,36 +78,105 @@ class SimpleProducer(Producer):
                  batch_send=False,
                  batch_send_every_n=BATCH_SEND_MSG_COUNT,
                  batch_send_every_t=BATCH_SEND_DEFAULT_INTERVAL,
-                 random_start=True):
+                 random_start=True,
+                 sticky=False,
+                 partitioner=None,
+                 partition_refresh_interval=None,
+                 spool=None,
+                 max_message_set_bytes=None,
+                 chunk_size=None,
+                 max_bytes_per_sec=None,
+                 max_messages_per_sec=None,
+                 rate_limit_per_topic=False,
+                 rate_limit_burst=1,
+                 priorities=None,
+                 topic_priorities=None,
+                 key_serializer=None,
+                 value_serializer=None,
+                 serialize_in_sender=False):
+        if sticky and not batch_send:
+            raise KafkaConfigurationError('sticky partitioning requires '
+                                          'batch_send')
         self.partition_cycles = {}
+        self.cycle_partitions = {}  # topic -> partitions in partition_cycles
+        self.partitioner_class = partitioner
+        self.partitioners = {}
         self.random_start = random_start
+        self.sticky = sticky
+        self.sticky_partitions = {}  # topic -> [partition, lane, lane batch]
         super(SimpleProducer, self).__init__(client, async, req_acks,
                                              ack_timeout, codec, batch_send,
                                              batch_send_every_n,
-                                             batch_send_every_t)
+                                             batch_send_every_t,
+                                             partition_refresh_interval,
+                                             spool,
+                                             max_message_set_bytes,
+                                             chunk_size,
+                                             max_bytes_per_sec,
+                                             max_messages_per_sec,
+                                             rate_limit_per_topic,
+                                             rate_limit_burst,
+                                             priorities,
+                                             topic_priorities,
+                                             key_serializer,
+                                             value_serializer,
+                                             serialize_in_sender)
 
     def _next_partition(self, topic):
-        if topic not in self.partition_cycles:
+        if self.partitioner_class is not None:
+            if (topic not in self.partitioners or
+                    self._partitions_changed(topic, getattr(self.partitioners[topic],
+                                                            'partitions', None))):
+                if not self.client.has_metadata_for_topic(topic):
+                    self.client.load_metadata_for_topics(topic)
+
+                self.partitioners[topic] = _create_partitioner(
+                    self.partitioner_class, self.client, topic)
+
+            return self.partitioners[topic].partition(None)
+
+        if (topic not in self.partition_cycles or
+                self._partitions_changed(topic, self.cycle_partitions[topic])):
             if not self.client.has_metadata_for_topic(topic):
                 self.client.load_metadata_for_topics(topic)
 
-            self.partition_cycles[topic] = cycle(self.client.get_partition_ids_for_topic(topic))
+            partitions = self.client.get_partition_ids_for_topic(topic)
+            self.partition_cycles[topic] = cycle(partitions)
+            self.cycle_partitions[topic] = partitions
 
             # Randomize the initial partition that is returned
             if self.random_start:
-                num_partitions = len(self.client.get_partition_ids_for_topic(topic))
+                num_partitions = len(partitions)
                 for _ in xrange(random.randint(0, num_partitions-1)):
                     next(self.partition_cycles[topic])
 
         return next(self.partition_cycles[topic])
 
-    def send_messages(self, topic, *msg):
+    def _sticky_partition(self, topic, priority):
+        if priority is None:
+            priority = self.topic_priorities.get(topic, DEFAULT_PRIORITY)
+        lane = self.lanes.get(priority)
+        if lane is None:
+            # Unknown priority, raised by send_messages
+            return self._next_partition(topic)
+
+        # Next partition once the sender took the batch of the lane
+        state = self.sticky_partitions.get(topic)
+        if state is None or state[1] is not lane or state[2] != lane.batches:
+            state = [self._next_partition(topic), lane, lane.batches]
+            self.sticky_partitions[topic] = state
+        return state[0]
+
+    def send_messages(self, topic, *msg, **kwargs):
         if not isinstance(topic, six.binary_type):
             topic = topic.encode('utf-8')
 
-        partition = self._next_partition(topic)
+        if self.sticky:
+            partition = self._sticky_partition(topic, kwargs.get('priority'))
+        else:
+            partition = self._next_partition(topic)
         return super(SimpleProducer, self).send_messages(
-            topic, partition, *msg
+            topic, partition, *msg, **kwargs
         )
 
     def __repr__(self):
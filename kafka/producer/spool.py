@@ -0,0 +1,357 @@
+"""
+Spill-to-disk buffer for the async producer.
+
+While the brokers can be reached, batches go straight through the in-memory
+part of the spool. Once more than memory_bytes of encoded message sets are
+waiting to be sent (e.g. during a broker outage), the rest is appended to a
+journal of memory-mapped segment files and sent, in order, once the brokers
+are back. Only a checkpoint of the first unacknowledged record is rewritten,
+so after a crash everything journaled but not yet acknowledged is resent.
+On close, the batches still held in memory are saved too, and sent first
+by the next producer using the same directory.
+
+Example:
+
+.. code:: python
+
+    spool = DiskSpool('/var/spool/kafka-producer')
+    producer = SimpleProducer(client, async=True, spool=spool)
+"""
+from __future__ import absolute_import
+
+import logging
+import mmap
+import os
+import struct
+from collections import deque
+
+from kafka.common import EncodedMessageSet, ProduceRequest
+from kafka.protocol import KafkaProtocol
+from kafka.util import crc32, read_short_string, write_short_string
+
+log = logging.getLogger("kafka")
+
+DEFAULT_SPOOL_MEMORY_BYTES = 16 * 1024 * 1024
+DEFAULT_SPOOL_SEGMENT_BYTES = 64 * 1024 * 1024
+
+SEGMENT_SUFFIX = '.log'
+CHECKPOINT_FILE = 'checkpoint'
+MEMORY_FILE = 'memory'
+
+# Record header: Size (int32) + Crc (uint32) of the record body
+_HEADER_SIZE = 8
+
+
+def _encode_record(req):
+    body = b''.join([
+        write_short_string(req.topic),
+        struct.pack('>iI', req.partition, req.messages.count),
+        req.messages.buffer
+    ])
+    return struct.pack('>iI', len(body), crc32(body)) + body
+
+
+def _decode_record(data, pos, end):
+    """
+    Returns (record body, next position) of the record at pos in data, or
+    None if there is no complete record there before end
+    """
+    if pos + _HEADER_SIZE > end:
+        return None
+    (size, crc) = struct.unpack_from('>iI', data, pos)
+    next_pos = pos + _HEADER_SIZE + size
+    if size <= 0 or next_pos > end:
+        return None
+    body = data[pos + _HEADER_SIZE:next_pos]
+    if crc32(body) != crc:
+        return None
+    return body, next_pos
+
+
+def _request(body):
+    """The ProduceRequest of a record body"""
+    (topic, cur) = read_short_string(body, 0)
+    (partition, count) = struct.unpack_from('>iI', body, cur)
+    return ProduceRequest(topic, partition,
+                          EncodedMessageSet(body[cur + 8:], count))
+
+
+class _Segment(object):
+    """
+    A memory-mapped, preallocated journal file. Unwritten space is zeroed,
+    so a zero record size marks the end of the records.
+    """
+    def __init__(self, path, number, size=None):
+        self.number = number
+        self.path = os.path.join(path, '%020d%s' % (number, SEGMENT_SUFFIX))
+        if size is None:
+            self.file = open(self.path, 'r+b')
+            size = os.path.getsize(self.path)
+        else:
+            self.file = open(self.path, 'w+b')
+            self.file.truncate(size)
+        self.size = size
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+    def read(self, pos):
+        """
+        Returns (body, next position) of the record at pos, or None if there
+        is no complete record there
+        """
+        return _decode_record(self.map, pos, self.size)
+
+    def write(self, pos, record):
+        """
+        Writes an encoded record at pos and returns the next position
+        """
+        end = pos + len(record)
+        self.map[pos:end] = record
+        return end
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class DiskSpool(object):
+    """
+    Buffer of produce requests waiting to be sent, spilling to an
+    append-only journal on disk past a memory threshold. Used by the sender
+    thread of an async Producer (see the spool argument of Producer); it is
+    not thread-safe.
+
+    Arguments:
+        path: directory of the journal, created if missing. Records left
+            there by a previous producer (and the requests it held in
+            memory when closed) are sent first.
+        memory_bytes: size of the encoded message sets kept in memory before
+            appending to the journal
+        segment_bytes: size of each journal file
+    """
+    def __init__(self, path, memory_bytes=DEFAULT_SPOOL_MEMORY_BYTES,
+                 segment_bytes=DEFAULT_SPOOL_SEGMENT_BYTES):
+        self.path = path
+        self.memory_bytes = memory_bytes
+        self.segment_bytes = segment_bytes
+
+        self.memory = deque()  # (ProduceRequest, encoded size)
+        self.memory_used = 0
+        self.memory_saved = False  # memory starts with the MEMORY_FILE ones
+
+        self.segments = deque()  # open segments, oldest first
+        self.read_pos = 0  # position of the first unacknowledged record
+        self.write_pos = 0  # end of the records in the last segment
+        self._peeked = []  # journal positions after each peeked record
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._recover()
+
+    def _recover(self):
+        self._read_memory()
+
+        numbers = sorted(int(name[:-len(SEGMENT_SUFFIX)])
+                         for name in os.listdir(self.path)
+                         if name.endswith(SEGMENT_SUFFIX))
+
+        checkpoint = self._read_checkpoint()
+        if checkpoint is not None and checkpoint[0] in numbers:
+            (number, self.read_pos) = checkpoint
+        elif numbers:
+            (number, self.read_pos) = (numbers[0], 0)
+
+        for n in numbers:
+            if n < number:
+                # Fully acknowledged before the checkpoint was written
+                os.remove(os.path.join(self.path, '%020d%s' % (n, SEGMENT_SUFFIX)))
+            else:
+                self.segments.append(_Segment(self.path, n))
+
+        if not self.segments:
+            return
+
+        last = self.segments[-1]
+        self.write_pos = self.read_pos if len(self.segments) == 1 else 0
+        while True:
+            record = last.read(self.write_pos)
+            if record is None:
+                break
+            self.write_pos = record[1]
+
+        if not self.disk_empty():
+            log.info("Resending unacknowledged messages spooled in %s", self.path)
+
+    def _read_memory(self):
+        try:
+            with open(os.path.join(self.path, MEMORY_FILE), 'rb') as f:
+                data = f.read()
+        except IOError:
+            return
+
+        pos = 0
+        while True:
+            record = _decode_record(data, pos, len(data))
+            if record is None:
+                break
+            (body, pos) = record
+            req = _request(body)
+            self.memory.append((req, len(req.messages.buffer)))
+            self.memory_used += len(req.messages.buffer)
+
+        # Kept until they are acknowledged
+        self.memory_saved = True
+        if self.memory:
+            log.info("Resending %d produce requests saved from memory in %s",
+                     len(self.memory), self.path)
+
+    def _write_memory(self):
+        memory_file = os.path.join(self.path, MEMORY_FILE)
+        with open(memory_file + '.tmp', 'wb') as f:
+            for (req, _) in self.memory:
+                f.write(_encode_record(req))
+        os.rename(memory_file + '.tmp', memory_file)
+        self.memory_saved = True
+
+    def _remove_memory(self):
+        try:
+            os.remove(os.path.join(self.path, MEMORY_FILE))
+        except OSError:
+            pass
+        self.memory_saved = False
+
+    def _read_checkpoint(self):
+        try:
+            with open(os.path.join(self.path, CHECKPOINT_FILE), 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        if len(data) != 16:
+            return None
+        return struct.unpack('>qq', data)
+
+    def _write_checkpoint(self):
+        checkpoint = os.path.join(self.path, CHECKPOINT_FILE)
+        with open(checkpoint + '.tmp', 'wb') as f:
+            f.write(struct.pack('>qq', self.segments[0].number, self.read_pos))
+        os.rename(checkpoint + '.tmp', checkpoint)
+
+    def disk_empty(self):
+        return (not self.segments or
+                (len(self.segments) == 1 and self.read_pos == self.write_pos))
+
+    def empty(self):
+        return not self.memory and self.disk_empty()
+
+    def append(self, reqs):
+        """
+        Spool a list of ProduceRequests, after the ones already waiting
+        """
+        for req in reqs:
+            message_set = KafkaProtocol._encode_message_set(req.messages)
+            if isinstance(req.messages, EncodedMessageSet):
+                count = req.messages.count
+            else:
+                count = len(req.messages)
+            req = ProduceRequest(req.topic, req.partition,
+                                 EncodedMessageSet(message_set, count))
+
+            # Once anything is on disk, everything goes there to keep order
+            if (self.disk_empty() and
+                    self.memory_used + len(message_set) <= self.memory_bytes):
+                self.memory.append((req, len(message_set)))
+                self.memory_used += len(message_set)
+            else:
+                self._append_to_disk(req)
+
+    def _append_to_disk(self, req):
+        record = _encode_record(req)
+
+        needed = len(record)
+        if not self.segments or self.write_pos + needed > self.segments[-1].size:
+            number = self.segments[-1].number + 1 if self.segments else 0
+            if self.segments:
+                self.segments[-1].map.flush()
+            else:
+                self.read_pos = 0
+            self.segments.append(_Segment(self.path, number,
+                                          max(self.segment_bytes, needed)))
+            self.write_pos = 0
+            if len(self.segments) == 1:
+                self._write_checkpoint()
+
+        self.write_pos = self.segments[-1].write(self.write_pos, record)
+
+    def peek(self, max_count):
+        """
+        Returns up to max_count of the oldest spooled ProduceRequests, that
+        can be sent together (at most one per topic and partition), without
+        removing them from the spool. See ack().
+        """
+        reqs = []
+        seen = set()
+        self._peeked = []
+        for (req, _) in self.memory:
+            if len(reqs) >= max_count or (req.topic, req.partition) in seen:
+                return reqs
+            seen.add((req.topic, req.partition))
+            reqs.append(req)
+
+        index, pos = 0, self.read_pos
+        while len(reqs) < max_count and index < len(self.segments):
+            segment = self.segments[index]
+            if index == len(self.segments) - 1 and pos >= self.write_pos:
+                break
+            record = segment.read(pos)
+            if record is None:
+                # End of a segment that is followed by a newer one
+                index, pos = index + 1, 0
+                continue
+
+            (body, pos) = record
+            req = _request(body)
+            if (req.topic, req.partition) in seen:
+                break
+            seen.add((req.topic, req.partition))
+            reqs.append(req)
+            self._peeked.append((index, pos))
+        return reqs
+
+    def ack(self, count):
+        """
+        Removes the first count ProduceRequests returned by the last peek()
+        from the spool, once they have been acknowledged by the brokers
+        """
+        while count and self.memory:
+            (_, size) = self.memory.popleft()
+            self.memory_used -= size
+            count -= 1
+        if self.memory_saved and not self.memory:
+            self._remove_memory()
+
+        if not count:
+            return
+
+        (index, self.read_pos) = self._peeked[count - 1]
+        self._peeked = []
+        for _ in range(index):
+            self.segments.popleft().remove()
+        while len(self.segments) > 1 and self.segments[0].read(self.read_pos) is None:
+            self.segments.popleft().remove()
+            self.read_pos = 0
+        self._write_checkpoint()
+
+    def close(self):
+        if self.memory:
+            # Ahead of the journal, so saved apart from it
+            log.info("Saving %d spooled produce requests held in memory",
+                     len(self.memory))
+            self._write_memory()
+            self.memory.clear()
+            self.memory_used = 0
+        while self.segments:
+            self.segments.popleft().close()
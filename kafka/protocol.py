@@ -9,15 +9,16 @@ from kafka.codec import (
     gzip_encode, gzip_decode, snappy_encode, snappy_decode
 )
 from kafka.common import (
-    Message, OffsetAndMessage, TopicAndPartition,
+    Message, EncodedMessageSet, OffsetAndMessage, TopicAndPartition,
     BrokerMetadata, TopicMetadata, PartitionMetadata,
     MetadataResponse, ProduceResponse, FetchResponse,
     OffsetResponse, OffsetCommitResponse, OffsetFetchResponse,
+    ConsumerMetadataResponse,
     ProtocolError, BufferUnderflowError, ChecksumError,
     ConsumerFetchSizeTooSmall, UnsupportedCodecError
 )
 from kafka.util import (
-    crc32, read_short_string, read_int_string, relative_unpack,
+    buffer_view, crc32, read_short_string, read_int_string, relative_unpack,
     write_short_string, write_int_string, group_by_topic_and_partition
 )
 
@@ -29,6 +30,11 @@ CODEC_GZIP = 0x01
 CODEC_SNAPPY = 0x02
 ALL_CODECS = (CODEC_NONE, CODEC_GZIP, CODEC_SNAPPY)
 
+# Encoded size of a message with no key and an empty value:
+# Offset (int64) + MessageSize (int32) + Crc (int32) + MagicByte (int8) +
+# Attributes (int8) + KeyLength (int32) + ValueLength (int32)
+MESSAGE_OVERHEAD = 26
+
 
 class KafkaProtocol(object):
     """
@@ -42,19 +48,21 @@ class KafkaProtocol(object):
     METADATA_KEY = 3
     OFFSET_COMMIT_KEY = 8
     OFFSET_FETCH_KEY = 9
+    CONSUMER_METADATA_KEY = 10
 
     ###################
     #   Private API   #
     ###################
 
     @classmethod
-    def _encode_message_header(cls, client_id, correlation_id, request_key):
+    def _encode_message_header(cls, client_id, correlation_id, request_key,
+                               version=0):
         """
         Encode the common request envelope
         """
         return struct.pack('>hhih%ds' % len(client_id),
                            request_key,          # ApiKey
-                           0,                    # ApiVersion
+                           version,              # ApiVersion
                            correlation_id,       # CorrelationId
                            len(client_id),       # ClientId size
                            client_id)            # ClientId
@@ -71,13 +79,26 @@ class KafkaProtocol(object):
           Offset => int64
           MessageSize => int32
         """
+        return b''.join(cls._encode_message_set_parts(messages))
+
+    @classmethod
+    def _encode_message_set_parts(cls, messages):
+        """
+        Encode a MessageSet as a list of chunks. Message keys and values are
+        passed through as the buffers they were given as, so that a caller
+        building a request copies each payload exactly once, when joining
+        the final request.
+        """
+        if isinstance(messages, EncodedMessageSet):
+            return [buffer_view(messages.buffer)]
+
         message_set = []
         for message in messages:
-            encoded_message = KafkaProtocol._encode_message(message)
-            message_set.append(struct.pack('>qi%ds' % len(encoded_message), 0,
-                                           len(encoded_message),
-                                           encoded_message))
-        return b''.join(message_set)
+            encoded_message = cls._encode_message_parts(message)
+            message_set.append(struct.pack('>qi', 0,
+                                           sum(map(len, encoded_message))))
+            message_set.extend(encoded_message)
+        return message_set
 
     @classmethod
     def _encode_message(cls, message):
@@ -96,17 +117,31 @@ class KafkaProtocol(object):
           Key => bytes
           Value => bytes
         """
+        return b''.join(cls._encode_message_parts(message))
+
+    @classmethod
+    def _encode_message_parts(cls, message):
+        """
+        Encode a single message as a list of chunks (see _encode_message).
+        The crc is computed incrementally over the chunks.
+        """
         if message.magic == 0:
-            msg = b''.join([
-                struct.pack('>BB', message.magic, message.attributes),
-                write_int_string(message.key),
-                write_int_string(message.value)
-            ])
-            crc = crc32(msg)
-            msg = struct.pack('>I%ds' % len(msg), crc, msg)
+            parts = [struct.pack('>BB', message.magic, message.attributes)]
+            for field in (message.key, message.value):
+                if field is None:
+                    parts.append(struct.pack('>i', -1))
+                else:
+                    field = buffer_view(field)
+                    parts.append(struct.pack('>i', len(field)))
+                    parts.append(field)
+
+            crc = 0
+            for part in parts:
+                crc = crc32(part, crc)
+            parts.insert(0, struct.pack('>I', crc))
         else:
             raise ProtocolError("Unexpected magic number: %d" % message.magic)
-        return msg
+        return parts
 
     @classmethod
     def _decode_message_set_iter(cls, data):
@@ -213,12 +248,16 @@ class KafkaProtocol(object):
                                        len(topic_payloads)))
 
             for partition, payload in topic_payloads.items():
-                msg_set = KafkaProtocol._encode_message_set(payload.messages)
-                message.append(struct.pack('>ii%ds' % len(msg_set), partition,
-                                           len(msg_set), msg_set))
+                msg_set = KafkaProtocol._encode_message_set_parts(
+                    payload.messages)
+                message.append(struct.pack('>ii', partition,
+                                           sum(map(len, msg_set))))
+                message.extend(msg_set)
 
-        msg = b''.join(message)
-        return struct.pack('>i%ds' % len(msg), len(msg), msg)
+        # Size-prefix and join in one pass so that message payloads
+        # are only copied once
+        message.insert(0, struct.pack('>i', sum(map(len, message))))
+        return b''.join(message)
 
     @classmethod
     def decode_produce_response(cls, data):
@@ -428,9 +467,43 @@ class KafkaProtocol(object):
 
         return MetadataResponse(brokers, topic_metadata)
 
+    @classmethod
+    def encode_consumer_metadata_request(cls, client_id, correlation_id,
+                                         payloads):
+        """
+        Encode a ConsumerMetadataRequest, to find the coordinator of a
+        consumer group
+
+        Arguments:
+            client_id: string
+            correlation_id: int
+            payloads: string, the consumer group
+        """
+        message = []
+        message.append(cls._encode_message_header(client_id, correlation_id,
+                                                  KafkaProtocol.CONSUMER_METADATA_KEY))
+        message.append(write_short_string(payloads))
+
+        msg = b''.join(message)
+        return struct.pack('>i%ds' % len(msg), len(msg), msg)
+
+    @classmethod
+    def decode_consumer_metadata_response(cls, data):
+        """
+        Decode bytes to a ConsumerMetadataResponse
+
+        Arguments:
+            data: bytes to decode
+        """
+        ((correlation_id, error, node_id), cur) = relative_unpack('>ihi', data, 0)
+        (host, cur) = read_short_string(data, cur)
+        ((port,), cur) = relative_unpack('>i', data, cur)
+
+        return ConsumerMetadataResponse(error, node_id, host, port)
+
     @classmethod
     def encode_offset_commit_request(cls, client_id, correlation_id,
-                                     group, payloads):
+                                     group, payloads, version=0):
         """
         Encode some OffsetCommitRequest structs
 
@@ -439,13 +512,24 @@ class KafkaProtocol(object):
             correlation_id: int
             group: string, the consumer group you are committing offsets for
             payloads: list of OffsetCommitRequest
+            version: 0 stores the offsets in zookeeper (through any broker),
+                1 (Kafka 0.8.2) and 2 (0.9) in Kafka (through the coordinator
+                of the group, see KafkaClient.send_offset_commit_request_kafka)
         """
         grouped_payloads = group_by_topic_and_partition(payloads)
 
         message = []
         message.append(cls._encode_message_header(client_id, correlation_id,
-                                                  KafkaProtocol.OFFSET_COMMIT_KEY))
+                                                  KafkaProtocol.OFFSET_COMMIT_KEY,
+                                                  version))
         message.append(write_short_string(group))
+        if version >= 1:
+            # No group generation or consumer id: not a group member
+            message.append(struct.pack('>i', -1))
+            message.append(write_short_string(b''))
+        if version >= 2:
+            # Broker default retention time
+            message.append(struct.pack('>q', -1))
         message.append(struct.pack('>i', len(grouped_payloads)))
 
         for topic, topic_payloads in grouped_payloads.items():
@@ -454,6 +538,9 @@ class KafkaProtocol(object):
 
             for partition, payload in topic_payloads.items():
                 message.append(struct.pack('>iq', partition, payload.offset))
+                if version == 1:
+                    # Commit timestamp set by the broker
+                    message.append(struct.pack('>q', -1))
                 message.append(write_short_string(payload.metadata))
 
         msg = b''.join(message)
@@ -480,7 +567,7 @@ class KafkaProtocol(object):
 
     @classmethod
     def encode_offset_fetch_request(cls, client_id, correlation_id,
-                                    group, payloads):
+                                    group, payloads, version=0):
         """
         Encode some OffsetFetchRequest structs
 
@@ -489,12 +576,15 @@ class KafkaProtocol(object):
             correlation_id: int
             group: string, the consumer group you are fetching offsets for
             payloads: list of OffsetFetchRequest
+            version: 0 fetches the offsets stored in zookeeper, 1 those
+                stored in Kafka
         """
         grouped_payloads = group_by_topic_and_partition(payloads)
 
         message = []
         message.append(cls._encode_message_header(client_id, correlation_id,
-                                                  KafkaProtocol.OFFSET_FETCH_KEY))
+                                                  KafkaProtocol.OFFSET_FETCH_KEY,
+                                                  version))
 
         message.append(write_short_string(group))
         message.append(struct.pack('>i', len(grouped_payloads)))
@@ -539,7 +629,8 @@ def create_message(payload, key=None):
     Construct a Message
 
     Arguments:
-        payload: bytes, the payload to send to Kafka
+        payload: bytes (or any contiguous buffer, e.g. bytearray, memoryview
+            or mmap), the payload to send to Kafka
         key: bytes, a key used for partition routing (optional)
 
     """
@@ -602,3 +693,67 @@ def create_message_set(messages, codec=CODEC_NONE, key=None):
         return [create_snappy_message(messages, key)]
     else:
         raise UnsupportedCodecError("Codec 0x%02x unsupported" % codec)
+
+
+def message_size(payload, key=None):
+    """
+    Size of the encoded message for payload and key, in a MessageSet
+    """
+    return (MESSAGE_OVERHEAD + len(payload) +
+            (len(key) if key is not None else 0))
+
+
+def split_messages(messages, max_bytes):
+    """
+    Split a list of (payload, key) into consecutive lists whose encoded
+    MessageSet is at most max_bytes. A message that is larger on its own
+    gets a list to itself.
+    """
+    chunks = []
+    chunk, chunk_size = [], 0
+    for payload, key in messages:
+        size = message_size(payload, key)
+        if chunk and chunk_size + size > max_bytes:
+            chunks.append(chunk)
+            chunk, chunk_size = [], 0
+        chunk.append((payload, key))
+        chunk_size += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def create_message_sets(messages, codec=CODEC_NONE, key=None, max_bytes=None):
+    """Create message sets of at most max_bytes using the given codec.
+
+    Like create_message_set, but the messages are split, in order, into as
+    many message sets as needed. They are split on their uncompressed size,
+    so that compressed messages are normally only compressed once; the
+    rare compressed message that still ends up too large (incompressible
+    payloads) is split in half and compressed again.
+
+    Returns a list of message sets (as returned by create_message_set).
+    A single message larger than max_bytes is returned in its own message
+    set, for the broker to reject.
+    """
+    if max_bytes is None:
+        return [create_message_set(messages, codec, key)]
+
+    if codec == CODEC_NONE:
+        return [create_message_set(chunk, codec, key)
+                for chunk in split_messages(messages, max_bytes)]
+
+    # The compressed messages are wrapped in a message of their own
+    message_sets = []
+    pending = split_messages(messages, max_bytes - MESSAGE_OVERHEAD)
+    pending.reverse()
+    while pending:
+        chunk = pending.pop()
+        message_set = create_message_set(chunk, codec, key)
+        if len(chunk) > 1 and message_size(message_set[0].value,
+                                           message_set[0].key) > max_bytes:
+            half = len(chunk) // 2
+            pending.extend([chunk[half:], chunk[:half]])
+            continue
+        message_sets.append(message_set)
+    return message_sets
@@ -2,25 +2,66 @@ import binascii
 import collections
 import struct
 import sys
-from threading import Thread, Event
+import time
+from threading import Thread, Event, Lock
 
 import six
 
 from kafka.common import BufferUnderflowError
 
 
-def crc32(data):
-    return binascii.crc32(data) & 0xffffffff
+def crc32(data, crc=0):
+    """
+    Returns the unsigned crc32 of data, optionally continuing a running crc
+    so that a message can be checksummed piecewise without joining it first
+    """
+    return binascii.crc32(data, crc) & 0xffffffff
+
+
+def buffer_view(s):
+    """
+    Takes bytes or any object exposing a contiguous buffer
+    (bytearray, memoryview, mmap, array.array, ...)
+    Returns an object that can be checksummed and joined into a request,
+    and whose len() is its size in bytes. On python 3 this is a view of the
+    original buffer (no copy); python 2 byte strings cannot be joined with
+    other buffers, so the contents are copied to a str there.
+    Raises TypeError for anything else, including unicode strings
+    """
+    if isinstance(s, six.binary_type):
+        return s
+
+    if not isinstance(s, six.text_type):
+        try:
+            view = memoryview(s)
+        except TypeError:
+            if six.PY2:
+                # mmap, array etc. only have the old-style buffer interface
+                try:
+                    return buffer(s)[:]  # pylint: disable=undefined-variable
+                except TypeError:
+                    pass
+        else:
+            if six.PY2:
+                return view.tobytes()
+            if view.c_contiguous:
+                if view.ndim != 1 or view.format != 'B':
+                    try:
+                        view = view.cast('B')
+                    except (TypeError, ValueError):
+                        # formats memoryview cannot cast (e.g. structs)
+                        return view.tobytes()
+                return view
+
+    raise TypeError('Expected "%s" to be bytes\n'
+                    'data=%s' % (type(s), repr(s)))
 
 
 def write_int_string(s):
-    if s is not None and not isinstance(s, six.binary_type):
-        raise TypeError('Expected "%s" to be bytes\n'
-                        'data=%s' % (type(s), repr(s)))
     if s is None:
         return struct.pack('>i', -1)
-    else:
-        return struct.pack('>i%ds' % len(s), len(s), s)
+    s = buffer_view(s)
+    return b''.join((struct.pack('>i', len(s)), s))
 
 
 def write_short_string(s):
@@ -154,3 +195,40 @@ class ReentrantTimer(object):
 
     def __del__(self):
         self.stop()
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter: tokens are added at rate per second, up to
+    capacity. Callers reserve() the tokens they need and wait for as long
+    as it tells them to.
+
+    Arguments:
+
+        rate: tokens added per second
+        capacity: most tokens held, i.e. how many can be taken at once
+            without waiting. Defaults to one second worth of tokens
+    """
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('Invalid rate value')
+
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = Lock()
+
+    def reserve(self, tokens):
+        """
+        Take tokens and return the seconds to wait until they are added.
+        Tokens can be taken beyond what the bucket holds (e.g. more than
+        capacity at once); later takes then wait for the debt to be repaid.
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
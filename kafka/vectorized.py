@@ -0,0 +1,188 @@
+"""
+Vectorized (numpy) encoding of MessageSets made of fixed-width records,
+and hashing / partitioning of fixed-width keys.
+
+Building Messages one at a time costs a namedtuple, several struct.pack
+calls and a crc32 per record. For large batches of fixed-width binary
+records the framing (offsets, sizes, attributes, key/value lengths) is the
+same for every record, so it is laid out for the whole batch at once with
+numpy and only the crcs are computed per record.
+
+Example:
+
+.. code:: python
+
+    records = numpy.zeros(10000, dtype=[('ts', '>u8'), ('value', '>f4')])
+    ...
+    messages = create_message_set_from_array(records)
+    client.send_produce_request([ProduceRequest(topic, 0, messages)])
+"""
+from __future__ import absolute_import
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+
+from kafka.codec import gzip_encode, snappy_encode
+from kafka.common import EncodedMessageSet, Message, UnsupportedCodecError
+from kafka.protocol import (
+    ATTRIBUTE_CODEC_MASK, CODEC_NONE, CODEC_GZIP, CODEC_SNAPPY
+)
+from kafka.util import buffer_view, crc32
+
+# Offset (int64) + MessageSize (int32) + Crc (int32)
+_CRC_END = 16
+
+
+def has_numpy():
+    return _HAS_NUMPY
+
+
+def _as_rows(arr, name):
+    """
+    Returns a 2-D uint8 view (one row per record) of either a 1-D
+    structured array or a 2-D uint8 array
+    """
+    arr = np.ascontiguousarray(arr)
+    if arr.dtype.names is not None and arr.ndim == 1:
+        return arr.view(np.uint8).reshape(len(arr), arr.dtype.itemsize)
+    if arr.dtype == np.uint8 and arr.ndim == 2:
+        return arr
+    raise TypeError('%s must be a 1-D structured array or a 2-D uint8 array, '
+                    'got %s array of shape %s' % (name, arr.dtype, arr.shape))
+
+
+def create_message_set_from_array(values, keys=None, codec=CODEC_NONE):
+    """
+    Construct a MessageSet from an array of fixed-width records
+
+    Arguments:
+        values: a 1-D numpy structured array (one message per element) or a
+            2-D uint8 array (one message per row)
+        keys: optional array of fixed-width keys, in the same forms as
+            values and with the same number of records
+        codec: compression codec, CODEC_NONE by default
+
+    Returns:
+        With CODEC_NONE an EncodedMessageSet holding the wire-format
+        MessageSet, otherwise a list containing a single codec-encoded
+        message. Either can be used as the messages of a ProduceRequest.
+    """
+    if not has_numpy():
+        raise NotImplementedError("numpy is not available")
+
+    values = _as_rows(values, 'values')
+    count, value_width = values.shape
+
+    fields = [('offset', '>i8'), ('size', '>i4'), ('crc', '>u4'),
+              ('magic', 'u1'), ('attributes', 'u1'), ('key_length', '>i4')]
+    if keys is not None:
+        keys = _as_rows(keys, 'keys')
+        if len(keys) != count:
+            raise ValueError('Got %d keys for %d values' % (len(keys), count))
+        key_width = keys.shape[1]
+        if key_width:
+            fields.append(('key', 'u1', (key_width,)))
+    fields.append(('value_length', '>i4'))
+    if value_width:
+        fields.append(('value', 'u1', (value_width,)))
+
+    records = np.zeros(count, dtype=np.dtype(fields))
+    records['size'] = records.dtype.itemsize - 12
+    records['key_length'] = -1 if keys is None else key_width
+    if keys is not None and key_width:
+        records['key'] = keys
+    records['value_length'] = value_width
+    if value_width:
+        records['value'] = values
+
+    # The crc covers everything from the magic byte to the end of the value
+    raw = records.view(np.uint8).reshape(count, records.dtype.itemsize)
+    records['crc'] = np.fromiter((crc32(row) for row in raw[:, _CRC_END:]),
+                                 dtype=np.uint32, count=count)
+
+    message_set = EncodedMessageSet(raw.reshape(-1), count)
+    if codec == CODEC_NONE:
+        return message_set
+    elif codec == CODEC_GZIP:
+        compressed = gzip_encode(buffer_view(message_set.buffer))
+    elif codec == CODEC_SNAPPY:
+        compressed = snappy_encode(buffer_view(message_set.buffer))
+    else:
+        raise UnsupportedCodecError("Codec 0x%02x unsupported" % codec)
+
+    return [Message(0, 0x00 | (ATTRIBUTE_CODEC_MASK & codec), None, compressed)]
+
+
+def murmur2_array(keys):
+    """
+    Vectorized murmur2 (see kafka.partitioner.hashed.murmur2) of an array
+    of fixed-width keys, in the same forms as create_message_set_from_array
+
+    Returns a uint32 array with the hash of each key
+    """
+    if not has_numpy():
+        raise NotImplementedError("numpy is not available")
+
+    keys = _as_rows(keys, 'keys')
+    count, length = keys.shape
+    m = np.uint32(0x5bd1e995)
+
+    h = np.empty(count, dtype=np.uint32)
+    h.fill((0x9747b28c ^ length) & 0xffffffff)
+
+    # Hash 4-byte little-endian blocks for all keys at once
+    whole = length - length % 4
+    blocks = np.ascontiguousarray(keys[:, :whole]).view('<u4')
+    for i in range(whole // 4):
+        k = blocks[:, i] * m
+        k ^= k >> 24
+        k *= m
+        h *= m
+        h ^= k
+
+    tail = keys[:, whole:].astype(np.uint32)
+    extra = length % 4
+    if extra >= 3:
+        h ^= tail[:, 2] << 16
+    if extra >= 2:
+        h ^= tail[:, 1] << 8
+    if extra >= 1:
+        h ^= tail[:, 0]
+        h *= m
+
+    h ^= h >> 13
+    h *= m
+    h ^= h >> 15
+    return h
+
+
+def jump_hash_array(keys, num_buckets):
+    """
+    Vectorized jump_hash (see kafka.partitioner.hashed.jump_hash) of an
+    array of int keys
+
+    Returns an int64 array with the bucket of each key
+    """
+    if not has_numpy():
+        raise NotImplementedError("numpy is not available")
+
+    keys = np.asarray(keys).astype(np.uint64)
+    buckets = np.empty(len(keys), dtype=np.int64)
+    buckets.fill(-1)
+    jumps = np.zeros(len(keys), dtype=np.int64)
+
+    # Every key takes O(log(num_buckets)) jumps; iterate on the keys that
+    # have not jumped past the last bucket yet
+    active = np.nonzero(jumps < num_buckets)[0]
+    while len(active):
+        buckets[active] = jumps[active]
+        k = keys[active] * np.uint64(2862933555777941757) + np.uint64(1)
+        keys[active] = k
+        jumps[active] = ((buckets[active] + 1) *
+                         (float(1 << 31) /
+                          ((k >> np.uint64(33)).astype(np.float64) + 1)))
+        active = active[jumps[active] < num_buckets]
+    return buckets
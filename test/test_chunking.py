@@ -0,0 +1,129 @@
+from mock import MagicMock
+from . import unittest
+
+from kafka import SimpleConsumer
+from kafka.chunking import (
+    CHUNK_HEADER_SIZE, CHUNK_MAGIC, Reassembler, chunk_value
+)
+from kafka.common import (
+    FetchResponse, Message, OffsetAndMessage, OffsetCommitRequest
+)
+
+
+class TestChunking(unittest.TestCase):
+    def test_small_values_unchanged(self):
+        self.assertEqual(chunk_value(b"x" * 10, 10), [b"x" * 10])
+
+    def test_chunk_value(self):
+        value = b"".join(bytes(bytearray([i])) * 10 for i in range(25))
+        chunks = chunk_value(value, 100)
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(all(c.startswith(CHUNK_MAGIC) for c in chunks))
+        self.assertEqual([len(c) - CHUNK_HEADER_SIZE for c in chunks],
+                         [100, 100, 50])
+
+        reassembler = Reassembler()
+        self.assertIsNone(reassembler.add(0, 10, chunks[0]))
+        self.assertIsNone(reassembler.add(0, 11, chunks[1]))
+        self.assertEqual(reassembler.add(0, 12, chunks[2]), value)
+        self.assertEqual(reassembler.pending_bytes, 0)
+
+    def test_magic_value(self):
+        value = CHUNK_MAGIC + b"not a chunk"
+        (chunk,) = chunk_value(value, 100)
+        self.assertNotEqual(chunk, value)
+        self.assertEqual(Reassembler().add(0, 0, chunk), value)
+
+    def test_short_magic_value(self):
+        value = CHUNK_MAGIC + b"short"
+        self.assertEqual(Reassembler().add(0, 0, value), value)
+
+    def test_commit_offset(self):
+        a = chunk_value(b"a" * 20, 10)
+        b = chunk_value(b"b" * 20, 10)
+        reassembler = Reassembler()
+
+        reassembler.add(0, 5, a[0])
+        self.assertEqual(reassembler.add(0, 6, b"plain"), b"plain")
+        reassembler.add(0, 7, b[0])
+        reassembler.add(1, 3, a[0])  # other partition
+        self.assertEqual(reassembler.commit_offset(0, 7), 5)
+
+        self.assertEqual(reassembler.add(0, 8, a[1]), b"a" * 20)
+        self.assertEqual(reassembler.commit_offset(0, 9), 7)
+        self.assertEqual(reassembler.add(0, 9, b[1]), b"b" * 20)
+        self.assertEqual(reassembler.commit_offset(0, 10), 10)
+        self.assertEqual(reassembler.commit_offset(1, 10), 3)
+
+        reassembler.reset(1)
+        self.assertEqual(reassembler.commit_offset(1, 10), 10)
+
+    def test_bounded_memory(self):
+        a = chunk_value(b"a" * 20, 10)
+        b = chunk_value(b"b" * 20, 10)
+        on_drop = MagicMock()
+        reassembler = Reassembler(max_pending_bytes=15, on_drop=on_drop)
+
+        reassembler.add(0, 0, a[0])
+        reassembler.add(0, 1, b[0])
+        self.assertEqual(reassembler.pending_bytes, 10)
+        self.assertEqual(reassembler.commit_offset(0, 2), 1)
+        self.assertEqual(reassembler.dropped, 1)
+        on_drop.assert_called_once_with(0, 0)
+
+        # The rest of a dropped message is ignored
+        self.assertIsNone(reassembler.add(0, 2, a[1]))
+        self.assertEqual(reassembler.add(0, 3, b[1]), b"b" * 20)
+
+    def test_expire_incomplete(self):
+        a = chunk_value(b"a" * 20, 10)
+        b = chunk_value(b"b" * 20, 10)
+        on_drop = MagicMock()
+        reassembler = Reassembler(max_pending_offsets=10, on_drop=on_drop)
+
+        reassembler.add(0, 0, a[0])  # last chunk never comes
+        reassembler.add(1, 5, b[0])
+        self.assertEqual(reassembler.add(0, 10, b"plain"), b"plain")
+        self.assertEqual(reassembler.commit_offset(0, 11), 0)
+        self.assertFalse(on_drop.called)
+
+        # Any message far enough past the first chunk expires it
+        self.assertEqual(reassembler.add(0, 11, b"plain"), b"plain")
+        on_drop.assert_called_once_with(0, 0)
+        self.assertEqual(reassembler.dropped, 1)
+        self.assertEqual(reassembler.commit_offset(0, 12), 12)
+
+        # Other partitions keep theirs
+        self.assertEqual(reassembler.commit_offset(1, 12), 5)
+        self.assertEqual(reassembler.add(1, 12, b[1]), b"b" * 20)
+        self.assertEqual(reassembler.pending_bytes, 0)
+
+
+class TestSimpleConsumerChunks(unittest.TestCase):
+    def test_reassemble(self):
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0]
+        chunks = chunk_value(b"x" * 30, 10)
+        messages = [OffsetAndMessage(i, Message(0, 0, None, v))
+                    for i, v in enumerate([b"first"] + chunks + [b"last"])]
+        client.send_fetch_request.return_value = [
+            FetchResponse(b"topic", 0, 0, 10, messages[:3])]
+
+        consumer = SimpleConsumer(client, None, b"topic", auto_commit=False,
+                                  reassemble_chunks=True)
+        consumer.group = b"group"
+        got = consumer.get_messages(10, block=False)
+        self.assertEqual([m.message.value for m in got], [b"first"])
+        consumer.commit()
+        client.send_offset_commit_request.assert_called_with(
+            b"group", [OffsetCommitRequest(b"topic", 0, 1, None)])
+
+        client.send_fetch_request.return_value = [
+            FetchResponse(b"topic", 0, 0, 10, messages[3:])]
+        got = consumer.get_messages(10, block=False)
+        self.assertEqual([(m.offset, m.message.value) for m in got],
+                         [(3, b"x" * 30), (4, b"last")])
+        consumer.commit()
+        client.send_offset_commit_request.assert_called_with(
+            b"group", [OffsetCommitRequest(b"topic", 0, 5, None)])
+        consumer.stop()
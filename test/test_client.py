@@ -1,4 +1,5 @@
 import socket
+import threading
 from time import sleep
 
 from mock import ANY, MagicMock, patch
@@ -7,7 +8,8 @@ from . import unittest
 
 from kafka import KafkaClient
 from kafka.common import (
-    ProduceRequest, MetadataResponse,
+    ProduceRequest, ProduceResponse, MetadataResponse, ConsumerMetadataResponse,
+    OffsetCommitRequest, OffsetCommitResponse,
     BrokerMetadata, TopicMetadata, PartitionMetadata,
     TopicAndPartition, KafkaUnavailableError,
     LeaderNotAvailableError, UnknownTopicOrPartitionError,
@@ -21,6 +23,8 @@ from test.testutil import Timer
 NO_ERROR = 0
 UNKNOWN_TOPIC_OR_PARTITION = 3
 NO_LEADER = 5
+OFFSETS_LOAD_IN_PROGRESS = 14
+NOT_COORDINATOR_FOR_CONSUMER = 16
 
 class TestKafkaClient(unittest.TestCase):
     def test_init_with_list(self):
@@ -391,6 +395,150 @@ class TestKafkaClient(unittest.TestCase):
         with self.assertRaises(UnknownTopicOrPartitionError):
             client.send_produce_request(requests)
 
+    def test_send_produce_request_tracks_broker_load(self):
+        with patch.object(KafkaClient, 'load_metadata_for_topics'):
+            client = KafkaClient(hosts=['broker_1:4567'])
+        broker = BrokerMetadata(0, b'broker_1', 4567)
+        client.topics_to_brokers[TopicAndPartition(b'topic', 0)] = broker
+
+        conn = MagicMock()
+        conn.send.side_effect = ConnectionError('unittest')
+        requests = [ProduceRequest(b'topic', 0, [create_message(b'a')])]
+        with patch.object(KafkaClient, '_get_conn', return_value=conn):
+            client.send_produce_request(requests, fail_on_error=False)
+
+        # failures count as a full socket timeout
+        self.assertEqual(client.broker_latency[0], client.timeout)
+        self.assertEqual(client.broker_inflight_bytes[0], 0)
+
+        # and stats are shared with copies
+        copied = client.copy()
+        self.assertIs(copied.broker_latency, client.broker_latency)
+
+    def test_send_to_brokers_concurrently(self):
+        with patch.object(KafkaClient, 'load_metadata_for_topics'):
+            client = KafkaClient(hosts=['broker_1:4567'])
+        for partition, host in enumerate((b'broker_0', b'broker_1')):
+            client.topics_to_brokers[TopicAndPartition(b'topic', partition)] = \
+                BrokerMetadata(partition, host, 4567)
+
+        calls = []
+        conns = {}
+        def get_conn(host, port):
+            conn = conns.setdefault(host, MagicMock())
+            conn.send.side_effect = lambda *args: calls.append(('send', host))
+            conn.recv.side_effect = lambda *args: calls.append(('recv', host))
+            return conn
+
+        requests = [ProduceRequest(b'topic', p, [create_message(b'a')])
+                    for p in (0, 1)]
+        decoder = lambda response: [response]
+        with patch.object(KafkaClient, '_get_conn', side_effect=get_conn):
+            responses = client._send_broker_aware_request(
+                requests, MagicMock(), decoder)
+
+        # Every request is sent before waiting for the responses
+        self.assertEqual(sorted(calls[:2]), [('send', 'broker_0'), ('send', 'broker_1')])
+        self.assertEqual(sorted(calls[2:]), [('recv', 'broker_0'), ('recv', 'broker_1')])
+        self.assertEqual(len(responses), 2)
+
+    def test_broker_latency_measured_per_broker(self):
+        with patch.object(KafkaClient, 'load_metadata_for_topics'):
+            client = KafkaClient(hosts=['broker_1:4567'])
+        for partition, host in enumerate((b'broker_0', b'broker_1')):
+            client.topics_to_brokers[TopicAndPartition(b'topic', partition)] = \
+                BrokerMetadata(partition, host, 4567)
+
+        class Conn(object):
+            # Responds after delay seconds, through a socket pair
+            def __init__(self, delay):
+                self.delay = delay
+                (self.sock, self.peer) = socket.socketpair()
+
+            def fileno(self):
+                return self.sock.fileno()
+
+            def send(self, request_id, request):
+                threading.Timer(self.delay, self.peer.send, (b'x',)).start()
+
+            def recv(self, request_id):
+                return self.sock.recv(1)
+
+            def close(self):
+                self.sock.close()
+                self.peer.close()
+
+        conns = {'broker_0': Conn(0.3), 'broker_1': Conn(0)}
+        requests = [ProduceRequest(b'topic', p, [create_message(b'a')])
+                    for p in (0, 1)]
+        decoder = lambda response: [ProduceResponse(b'topic', 0, 0, 0)]
+        with patch.object(KafkaClient, '_get_conn',
+                          side_effect=lambda host, port: conns[host]), \
+                patch.object(KafkaProtocol, 'decode_produce_response',
+                             side_effect=decoder):
+            client.send_produce_request(requests)
+        for conn in conns.values():
+            conn.close()
+
+        # The fast broker is not charged for waiting on the slow one
+        self.assertGreaterEqual(client.broker_latency[0], 0.25)
+        self.assertLess(client.broker_latency[1], 0.1)
+
+    def test_send_offset_commit_request_kafka(self):
+        with patch.object(KafkaClient, 'load_metadata_for_topics'):
+            client = KafkaClient(hosts=['broker_1:4567'])
+
+        coordinators = [ConsumerMetadataResponse(0, 1, b'broker_1', 4567),
+                        ConsumerMetadataResponse(0, 2, b'broker_2', 4567)]
+        errors = [NOT_COORDINATOR_FOR_CONSUMER, NO_ERROR, NO_ERROR]
+        decoder = lambda response: [
+            OffsetCommitResponse(b'topic', 0, errors.pop(0))]
+        payloads = [OffsetCommitRequest(b'topic', 0, 10, None)]
+
+        hosts = []
+        with patch.object(KafkaClient, 'send_consumer_metadata_request',
+                          side_effect=coordinators) as lookup, \
+                patch.object(KafkaClient, '_get_conn',
+                             side_effect=lambda host, port: hosts.append(host) or MagicMock()), \
+                patch.object(KafkaProtocol, 'decode_offset_commit_response',
+                             side_effect=decoder):
+            # The coordinator moved: it is looked up and the request resent
+            self.assertEqual(client.send_offset_commit_request_kafka(b'group', payloads),
+                             [OffsetCommitResponse(b'topic', 0, NO_ERROR)])
+            self.assertEqual(hosts, ['broker_1', 'broker_2'])
+
+            # and cached for the next requests
+            client.send_offset_commit_request_kafka(b'group', payloads)
+            self.assertEqual(hosts, ['broker_1', 'broker_2', 'broker_2'])
+            self.assertEqual(lookup.call_count, 2)
+
+    def test_send_offset_commit_request_offsets_loading(self):
+        with patch.object(KafkaClient, 'load_metadata_for_topics'):
+            client = KafkaClient(hosts=['broker_1:4567'])
+        client.coordinators[b'group'] = BrokerMetadata(1, b'broker_1', 4567)
+
+        errors = [OFFSETS_LOAD_IN_PROGRESS] * 2 + [NO_ERROR]
+        decoder = lambda response: [
+            OffsetCommitResponse(b'topic', 0, errors.pop(0))]
+        payloads = [OffsetCommitRequest(b'topic', 0, 10, None)]
+
+        with patch.object(KafkaClient, '_get_conn'), \
+                patch.object(KafkaProtocol, 'decode_offset_commit_response',
+                             side_effect=decoder), \
+                patch('kafka.client.time.sleep') as sleep_:
+            # Sent again, after a backoff, until the offsets are loaded
+            self.assertEqual(client.send_offset_commit_request_kafka(b'group', payloads),
+                             [OffsetCommitResponse(b'topic', 0, NO_ERROR)])
+            self.assertEqual(sleep_.call_count, 2)
+
+            # Up to OFFSETS_LOAD_RETRIES times
+            errors.extend([OFFSETS_LOAD_IN_PROGRESS] * 10)
+            self.assertEqual(client.send_offset_commit_request_kafka(
+                b'group', payloads, fail_on_error=False),
+                [OffsetCommitResponse(b'topic', 0, OFFSETS_LOAD_IN_PROGRESS)])
+            self.assertEqual(sleep_.call_count, 2 + 5)
+            self.assertEqual(len(errors), 4)
+
     def test_timeout(self):
         def _timeout(*args, **kwargs):
             timeout = args[1]
@@ -1,9 +1,17 @@
+import time
+from threading import Event, Thread
 
-from mock import MagicMock
+from mock import MagicMock, patch
 from . import unittest
 
 from kafka import SimpleConsumer, KafkaConsumer
-from kafka.common import KafkaConfigurationError
+from kafka.consumer.base import AsyncCommitter, IdlePartitions
+from kafka.consumer.kafka import _split_fetch_budget
+from kafka.common import (
+    ConsumerFetchSizeTooSmall, FailedPayloadsError, FetchResponse, KafkaConfigurationError, Message,
+    OffsetAndMessage, OffsetCommitResponse, OffsetFetchResponse,
+    OffsetResponse, TopicAndPartition
+)
 
 class TestKafkaConsumer(unittest.TestCase):
     def test_non_integer_partitions(self):
@@ -13,3 +21,662 @@ class TestKafkaConsumer(unittest.TestCase):
     def test_broker_list_required(self):
         with self.assertRaises(KafkaConfigurationError):
             KafkaConsumer()
+
+
+class TestSimpleConsumerBatches(unittest.TestCase):
+    def consumer(self):
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0, 1]
+
+        def fetch(reqs, **kwargs):
+            return [FetchResponse(b"topic", r.partition, 0, 100, [
+                OffsetAndMessage(o, Message(0, 0, None, b"x"))
+                for o in range(r.offset, min(r.offset + 3, 5))])
+                for r in reqs]
+        client.send_fetch_request.side_effect = fetch
+        return SimpleConsumer(client, None, b"topic", auto_commit=False)
+
+    def test_get_messages(self):
+        consumer = self.consumer()
+        consumer.provide_partition_info()
+        messages = consumer.get_messages(4, block=False)
+        self.assertEqual([(p, m.offset) for p, m in messages],
+                         [(0, 0), (0, 1), (0, 2), (1, 0)])
+        self.assertEqual(consumer.offsets, {0: 3, 1: 1})
+        self.assertEqual(consumer.client.send_fetch_request.call_count, 1)
+
+        messages = consumer.get_messages(10, block=False)
+        self.assertEqual([(p, m.offset) for p, m in messages],
+                         [(1, 1), (1, 2), (0, 3), (0, 4), (1, 3), (1, 4)])
+        self.assertEqual(consumer.offsets, {0: 5, 1: 5})
+
+    def test_iterator(self):
+        consumer = self.consumer()
+        consumer.iter_timeout = 0.01
+        for message in consumer:
+            break
+        self.assertEqual(consumer.offsets, {0: 1, 1: 0})
+
+        # The rest of the fetched messages are still queued
+        self.assertEqual([m.offset for m in consumer], [1, 2, 0, 1, 2, 3, 4, 3, 4])
+        self.assertEqual(consumer.offsets, {0: 5, 1: 5})
+
+
+class TestSimpleConsumerPrefetch(unittest.TestCase):
+    def test_prefetch_watermarks(self):
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0]
+
+        def fetch(reqs, **kwargs):
+            # 3 messages of 10 bytes at a time, up to offset 20
+            (req,) = reqs
+            return [FetchResponse(b"topic", 0, 0, 20, [
+                OffsetAndMessage(o, Message(0, 0, None, b"x" * 10))
+                for o in range(req.offset, min(req.offset + 3, 20))])]
+        upstream = client.copy.return_value
+        upstream.send_fetch_request.side_effect = fetch
+
+        consumer = SimpleConsumer(client, None, b"topic", auto_commit=False,
+                                  prefetch_high_watermark=50,
+                                  prefetch_low_watermark=20)
+        for _ in range(100):
+            if consumer.queued_bytes >= 50:
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+        # Paused above the high watermark, without using the consumer client
+        self.assertEqual(consumer.queued_bytes, 60)
+        self.assertEqual(upstream.send_fetch_request.call_count, 2)
+        self.assertFalse(client.send_fetch_request.called)
+
+        messages = consumer.get_messages(20, block=True, timeout=5)
+        self.assertEqual([m.offset for m in messages], list(range(20)))
+        consumer.stop()
+        self.assertFalse(consumer.prefetch_thread.is_alive())
+
+    def test_prefetch_watermarks_check(self):
+        with self.assertRaises(ValueError):
+            SimpleConsumer(MagicMock(), None, b"topic", auto_commit=False,
+                           prefetch_high_watermark=10,
+                           prefetch_low_watermark=20)
+
+
+class TestSimpleConsumerFetchSize(unittest.TestCase):
+    def consumer(self, fetch, **kwargs):
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0, 1]
+        client.send_fetch_request.side_effect = fetch
+        return SimpleConsumer(client, None, b"topic", auto_commit=False,
+                              **kwargs)
+
+    def messages(self, offset, count, size=10):
+        return [OffsetAndMessage(o, Message(0, 0, None, b"x" * size))
+                for o in range(offset, offset + count)]
+
+    def sizes(self, consumer):
+        (reqs,), _ = consumer.client.send_fetch_request.call_args
+        return dict((r.partition, r.max_bytes) for r in reqs)
+
+    def test_grow_with_lag_and_shrink_when_idle(self):
+        highwater = {0: 1000, 1: 10}
+
+        def fetch(reqs, **kwargs):
+            return [FetchResponse(b"topic", r.partition, 0,
+                                  highwater[r.partition],
+                                  self.messages(r.offset, min(10, highwater[r.partition] - r.offset)))
+                    for r in reqs]
+
+        consumer = self.consumer(fetch, max_buffer_size=None)
+        consumer._fetch()
+        self.assertEqual(self.sizes(consumer), {0: 4096, 1: 4096})
+
+        # 990 messages of 36 bytes waiting in partition 0
+        consumer._fetch()
+        self.assertEqual(self.sizes(consumer), {0: 990 * 36, 1: 4096})
+
+        highwater[0] = 20
+        for _ in range(30):
+            consumer._fetch()
+        self.assertEqual(self.sizes(consumer), {0: 4096, 1: 4096})
+
+    def test_max_sizes(self):
+        def fetch(reqs, **kwargs):
+            return [FetchResponse(b"topic", r.partition, 0, 10000,
+                                  self.messages(r.offset, 10))
+                    for r in reqs]
+
+        consumer = self.consumer(fetch, max_buffer_size=32768)
+        consumer._fetch()
+        consumer._fetch()
+        self.assertEqual(self.sizes(consumer), {0: 32768, 1: 32768})
+
+        consumer.max_fetch_memory = 40000
+        consumer._fetch()
+        self.assertEqual(self.sizes(consumer), {0: 20000, 1: 20000})
+
+    def test_remember_large_messages(self):
+        def too_small():
+            raise ConsumerFetchSizeTooSmall()
+            yield
+
+        def fetch(reqs, **kwargs):
+            return [FetchResponse(b"topic", r.partition, 0, r.offset + 1,
+                                  self.messages(r.offset, 1, 5000)
+                                  if r.max_bytes > 4096 else too_small())
+                    for r in reqs]
+
+        consumer = self.consumer(fetch, partitions=[0])
+        consumer._fetch()
+        self.assertEqual(consumer.client.send_fetch_request.call_count, 2)
+        consumer._fetch()
+        self.assertEqual(consumer.client.send_fetch_request.call_count, 3)
+        self.assertEqual(self.sizes(consumer), {0: 8192})
+
+
+    def test_skip_idle_partitions(self):
+        highwater = {0: 100, 1: 0}
+
+        def fetch(reqs, **kwargs):
+            return [FetchResponse(b"topic", r.partition, 0,
+                                  highwater[r.partition],
+                                  self.messages(r.offset, min(2, highwater[r.partition] - r.offset)))
+                    for r in reqs]
+
+        consumer = self.consumer(fetch, max_idle_backoff_ms=60000)
+        consumer._fetch()
+        consumer._fetch()
+        self.assertEqual(list(self.sizes(consumer)), [0])
+
+        # Checked again once its backoff is over
+        consumer.idle_partitions.idle[1] = (0.1, 0)
+        consumer._fetch()
+        self.assertEqual(sorted(self.sizes(consumer)), [0, 1])
+
+
+class TestSimpleConsumerCommit(unittest.TestCase):
+    def consumer(self, **kwargs):
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0, 1]
+        client.send_offset_fetch_request.return_value = []
+        commit = lambda group, reqs, **kw: [
+            OffsetCommitResponse(r.topic, r.partition, 0) for r in reqs]
+        client.send_offset_commit_request.side_effect = commit
+        client.copy.return_value.send_offset_commit_request.side_effect = commit
+        consumer = SimpleConsumer(client, b"group", b"topic",
+                                  auto_commit=False, **kwargs)
+        consumer.offsets = {0: 0, 1: 0}
+        return consumer
+
+    def test_commit_changed_partitions(self):
+        consumer = self.consumer()
+        consumer.count_since_commit = 1
+        consumer.commit()
+        consumer.offsets[1] = 5
+        consumer.count_since_commit = 1
+        consumer.commit()
+
+        calls = consumer.client.send_offset_commit_request.call_args_list
+        self.assertEqual([sorted((r.partition, r.offset) for r in call[0][1])
+                          for call in calls],
+                         [[(0, 0), (1, 0)], [(1, 5)]])
+        self.assertEqual(consumer.committed, {0: 0, 1: 5})
+
+    def test_async_commit(self):
+        consumer = self.consumer(async_commit=True)
+        consumer.offsets[1] = 5
+        consumer.count_since_commit = 1
+        consumer.commit()
+        self.assertTrue(consumer.committer.flush(timeout=5))
+        self.assertFalse(consumer.client.send_offset_commit_request.called)
+        self.assertEqual(consumer.committed, {0: 0, 1: 5})
+        consumer.stop()
+        self.assertFalse(consumer.committer)
+
+    def test_commit_callbacks_locked(self):
+        consumer = self.consumer()
+        with consumer.commit_lock:
+            thread = Thread(target=consumer._on_committed,
+                            args=({(b"topic", 1): 5},))
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(consumer.committed, {})
+        thread.join(5)
+        self.assertEqual(consumer.committed, {1: 5})
+
+        with consumer.commit_lock:
+            thread = Thread(target=consumer._on_commit_failure,
+                            args=({(b"topic", 1): (6, Exception())},))
+            thread.start()
+            thread.join(0.1)
+            self.assertEqual(consumer.count_since_commit, 0)
+        thread.join(5)
+        self.assertEqual(consumer.count_since_commit, 1)
+
+    def test_offset_storage_kafka(self):
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0]
+        client.send_offset_fetch_request_kafka.return_value = [
+            OffsetFetchResponse(b"topic", 0, 7, None, 0)]
+        client.send_offset_commit_request_kafka.side_effect = lambda group, reqs, **kw: [
+            OffsetCommitResponse(r.topic, r.partition, 0) for r in reqs]
+        consumer = SimpleConsumer(client, b"group", b"topic", auto_commit=False,
+                                  offset_storage="kafka")
+        self.assertEqual(consumer.offsets, {0: 7})
+
+        consumer.offsets[0] = 9
+        consumer.count_since_commit = 1
+        consumer.commit()
+        (group, reqs), _ = client.send_offset_commit_request_kafka.call_args
+        self.assertEqual([(r.partition, r.offset) for r in reqs], [(0, 9)])
+        self.assertFalse(client.send_offset_fetch_request.called)
+        self.assertFalse(client.send_offset_commit_request.called)
+
+        with self.assertRaises(ValueError):
+            SimpleConsumer(client, b"group", b"topic", offset_storage="redis")
+
+
+class TestAsyncCommitter(unittest.TestCase):
+    def test_merge_and_failures(self):
+        sent = []
+        release = Event()
+
+        def commit(group, reqs, **kwargs):
+            sent.append(sorted((r.partition, r.offset) for r in reqs))
+            release.wait(5)
+            return [OffsetCommitResponse(r.topic, r.partition,
+                                         3 if r.partition == 2 else 0)
+                    for r in reqs]
+
+        client = MagicMock()
+        client.copy.return_value.send_offset_commit_request.side_effect = commit
+        committed, failed = {}, {}
+        committer = AsyncCommitter(client, b"group", committed.update,
+                                   failed.update)
+
+        committer.commit({(b"t", 0): 1})
+        for _ in range(100):
+            if sent:
+                break
+            time.sleep(0.01)
+
+        # Merged while the first commit is in flight
+        committer.commit({(b"t", 0): 2, (b"t", 1): 1})
+        committer.commit({(b"t", 0): 3, (b"t", 2): 1})
+        release.set()
+        self.assertTrue(committer.flush(timeout=5))
+        self.assertEqual(sent, [[(0, 1)], [(0, 3), (1, 1), (2, 1)]])
+        self.assertEqual(committed, {(b"t", 0): 3, (b"t", 1): 1})
+        self.assertEqual(list(failed), [(b"t", 2)])
+
+        # Done offsets are skipped, failed ones are sent again
+        committer.commit({(b"t", 0): 3, (b"t", 2): 1})
+        committer.stop()
+        self.assertEqual(sent[2:], [[(2, 1)]])
+
+
+class TestIdlePartitions(unittest.TestCase):
+    @patch('kafka.consumer.base.time')
+    def test_backoff(self, time):
+        time.time.return_value = 100.0
+        idle = IdlePartitions(0.5)
+        idle.update(0, 10, 20)
+        idle.update(1, 20, 20)
+        self.assertEqual(idle.due([0, 1]), [0])
+
+        # Doubles up to max_backoff while it stays idle
+        backoffs = []
+        for _ in range(4):
+            idle.update(1, 20, 20)
+            backoffs.append(idle.idle[1][0])
+        self.assertEqual(backoffs, [0.2, 0.4, 0.5, 0.5])
+
+        time.time.return_value = 100.5
+        self.assertEqual(idle.due([0, 1]), [0, 1])
+        idle.update(1, 20, 25)
+        self.assertEqual(idle.idle, {})
+
+    @patch('kafka.consumer.base.time')
+    def test_all_idle(self, time):
+        time.time.return_value = 100.0
+        idle = IdlePartitions(1)
+        idle.update(0, 10, 10)
+        idle.update(1, 10, 10)
+        self.assertEqual(idle.due([0, 1]), [0, 1])
+        idle.reset(0)
+        self.assertEqual(idle.due([0, 1]), [0])
+
+
+class TestKafkaConsumerPoll(unittest.TestCase):
+    def consumer(self, responses, **configs):
+        with patch('kafka.consumer.kafka.KafkaClient') as client_class:
+            client = client_class.return_value
+            client.topic_partitions = {b"topic": {0: None, 1: None}}
+            client.topics_to_brokers = {TopicAndPartition(b"topic", 0): "a",
+                                        TopicAndPartition(b"topic", 1): "b"}
+            client.get_partition_ids_for_topic.return_value = [0, 1]
+            client.send_fetch_request.side_effect = responses
+            client.copy.return_value.send_fetch_request.side_effect = responses
+            return KafkaConsumer(("topic", 0, 0), ("topic", 1, 5),
+                                 bootstrap_servers=["localhost:9092"],
+                                 **configs)
+
+    def response(self, partition, offsets):
+        return FetchResponse(b"topic", partition, 0, 10, [
+            OffsetAndMessage(o, Message(0, 0, None, str(o).encode('ascii')))
+            for o in offsets])
+
+    def test_poll(self):
+        consumer = self.consumer([[self.response(0, range(5)),
+                                   self.response(1, range(4, 8))],
+                                  [self.response(0, [5])]])
+
+        records = consumer.poll(max_records=3)
+        self.assertEqual(list(records), [(b"topic", 0)])
+        self.assertEqual([m.value for m in records[(b"topic", 0)]],
+                         [b"0", b"1", b"2"])
+        self.assertEqual(consumer.offsets('fetch')[(b"topic", 0)], 3)
+
+        # The rest of the fetch, then the iterator carries on from there
+        records = consumer.poll()
+        self.assertEqual(dict((tp, [m.offset for m in msgs])
+                              for tp, msgs in records.items()),
+                         {(b"topic", 0): [3, 4], (b"topic", 1): [5, 6, 7]})
+        self.assertEqual(consumer._client.send_fetch_request.call_count, 1)
+        self.assertEqual(consumer.next().offset, 5)
+        self.assertEqual(consumer.offsets('fetch'),
+                         {(b"topic", 0): 6, (b"topic", 1): 8})
+
+    def test_poll_deserializer_error(self):
+        def deserializer(value):
+            if value == b"2":
+                raise ValueError(value)
+            return value
+
+        consumer = self.consumer([[self.response(0, range(4))]] * 2,
+                                 deserializer_class=deserializer)
+        records = consumer.poll()
+        self.assertEqual([m.offset for m in records[(b"topic", 0)]], [0, 1])
+        with self.assertRaises(ValueError):
+            consumer.poll()
+        self.assertEqual(consumer.offsets('fetch')[(b"topic", 0)], 2)
+
+    def test_poll_timeout(self):
+        consumer = self.consumer(lambda *args, **kwargs: [])
+        self.assertEqual(consumer.poll(timeout_ms=0), {})
+        self.assertEqual(consumer._client.send_fetch_request.call_count, 1)
+
+    def test_background_fetchers(self):
+        def fetch(reqs, **kwargs):
+            # 3 messages at a time, up to offset 10
+            return [self.response(r.partition, range(r.offset, min(r.offset + 3, 10)))
+                    for r in reqs]
+
+        consumer = self.consumer(fetch, num_consumer_fetchers=2,
+                                 queued_max_message_chunks=2)
+        self.assertEqual(len(consumer._fetchers), 2)
+
+        offsets = {(b"topic", 0): [], (b"topic", 1): []}
+        for _ in range(100):
+            for tp, msgs in consumer.poll(timeout_ms=100).items():
+                offsets[tp].extend(m.offset for m in msgs)
+            if sum(map(len, offsets.values())) >= 15:
+                break
+        consumer.close()
+
+        self.assertEqual(offsets, {(b"topic", 0): list(range(10)),
+                                   (b"topic", 1): list(range(5, 10))})
+        self.assertEqual(consumer._client.send_fetch_request.call_count, 0)
+
+    def test_background_fetcher_failures(self):
+        calls = []
+
+        def fetch(reqs, **kwargs):
+            calls.append(len(calls))
+            if len(calls) == 1:
+                # Broker of partition 1 unreachable
+                return [FailedPayloadsError(r) if r.partition == 1 else
+                        self.response(r.partition, [r.offset]) for r in reqs]
+            if len(calls) == 2:
+                raise ValueError("unexpected")
+            return [self.response(r.partition, [r.offset]) for r in reqs]
+
+        consumer = self.consumer(fetch, num_consumer_fetchers=1,
+                                 default_fetcher_backoff_ms=10)
+        offsets = []
+        with self.assertRaises(ValueError):
+            for _ in range(100):
+                for msgs in consumer.poll(timeout_ms=100).values():
+                    offsets.extend(m.offset for m in msgs)
+
+        # The fetcher keeps going, and retries the failed partition
+        for _ in range(100):
+            for msgs in consumer.poll(timeout_ms=100).values():
+                offsets.extend(m.offset for m in msgs)
+            if 5 in offsets:
+                break
+        (fetcher,) = consumer._fetchers
+        self.assertTrue(fetcher.thread.is_alive())
+        consumer.close()
+        self.assertEqual(offsets[:1], [0])
+        self.assertIn(5, offsets)
+
+    def test_fetch_budget(self):
+        requests = []
+
+        def fetch(reqs, **kwargs):
+            requests.append(dict((r.partition, r.max_bytes) for r in reqs))
+            return [self.response(r.partition, range(r.offset, r.offset + 2))
+                    for r in reqs]
+
+        # Only one partition fits at a time, they take turns
+        consumer = self.consumer(fetch, fetch_message_max_bytes=100000,
+                                 fetch_max_total_bytes=100000)
+        for _ in range(3):
+            consumer.poll()
+        self.assertEqual(requests, [{0: 65536}, {1: 65536}, {0: 65536}])
+        self.assertEqual(consumer.offsets('fetch'),
+                         {(b"topic", 0): 4, (b"topic", 1): 7})
+
+        with self.assertRaises(KafkaConfigurationError):
+            self.consumer(fetch, fetch_message_max_bytes=100000,
+                          fetch_max_total_bytes=50000)
+
+    def test_fetch_budget_too_small(self):
+        def too_small():
+            raise ConsumerFetchSizeTooSmall()
+            yield
+
+        def fetch(reqs, **kwargs):
+            return [FetchResponse(b"topic", r.partition, 0, 10,
+                                  too_small() if r.max_bytes < 100000 else
+                                  self.response(r.partition, [r.offset]).messages)
+                    for r in reqs]
+
+        consumer = self.consumer(fetch, fetch_message_max_bytes=100000,
+                                 fetch_max_total_bytes=150000)
+        self.assertEqual(consumer.poll(), {})
+        self.assertEqual(consumer._fetch_stats[(b"topic", 0)].min_bytes, 100000)
+        self.assertEqual(list(consumer.poll()), [(b"topic", 0)])
+
+    def test_background_fetch_budget(self):
+        def fetch(reqs, **kwargs):
+            return [self.response(r.partition, range(r.offset, min(r.offset + 3, 10)))
+                    for r in reqs]
+
+        # About 27 bytes a message, a fetch of 100 bytes at a time
+        consumer = self.consumer(fetch, num_consumer_fetchers=2,
+                                 fetch_message_max_bytes=100,
+                                 fetch_max_total_bytes=150)
+        offsets = {(b"topic", 0): [], (b"topic", 1): []}
+        for _ in range(100):
+            self.assertLessEqual(consumer._fetch_budget.used, 150)
+            for tp, msgs in consumer.poll(timeout_ms=100).items():
+                offsets[tp].extend(m.offset for m in msgs)
+            if sum(map(len, offsets.values())) >= 15:
+                break
+        consumer.close()
+
+        self.assertEqual(offsets, {(b"topic", 0): list(range(10)),
+                                   (b"topic", 1): list(range(5, 10))})
+        self.assertEqual(consumer._fetch_budget.used, 0)
+
+    def test_skip_idle_partitions(self):
+        requests = []
+
+        def fetch(reqs, **kwargs):
+            requests.append(sorted(r.partition for r in reqs))
+            return [self.response(r.partition, range(r.offset, 10))
+                    for r in reqs]
+
+        consumer = self.consumer(fetch, fetch_idle_backoff_max_ms=60000)
+        for _ in range(3):
+            consumer.poll()
+        # Both caught up: all partitions are fetched, the broker waits
+        self.assertEqual(requests, [[0, 1], [0, 1], [0, 1]])
+
+        requests[:] = []
+        consumer._idle_partitions.reset((b"topic", 0))
+        consumer.poll()
+        self.assertEqual(requests, [[0]])
+
+    def test_pause_resume(self):
+        def fetch(reqs, **kwargs):
+            return [self.response(r.partition, range(r.offset, min(r.offset + 2, 10)))
+                    for r in reqs]
+
+        consumer = self.consumer(fetch)
+        records = consumer.poll(max_records=1)
+        self.assertEqual(list(records), [(b"topic", 0)])
+
+        # The rest of the fetch is dropped, offsets are kept
+        consumer.pause(("topic", 0))
+        for _ in range(2):
+            self.assertEqual(list(consumer.poll()), [(b"topic", 1)])
+        self.assertEqual(consumer.offsets('fetch'),
+                         {(b"topic", 0): 1, (b"topic", 1): 9})
+
+        consumer.resume(("topic", 0))
+        records = consumer.poll()
+        self.assertEqual([m.offset for m in records[(b"topic", 0)]], [1, 2])
+
+        with self.assertRaises(KafkaConfigurationError):
+            consumer.pause(("topic", 2))
+
+    @patch('kafka.consumer.kafka.time.sleep')
+    def test_poll_all_paused(self, sleep):
+        consumer = self.consumer([], fetch_wait_max_ms=500)
+        consumer.pause(("topic", 0), ("topic", 1))
+        self.assertEqual(consumer.poll(timeout_ms=0), {})
+        sleep.assert_called_once_with(0)
+        self.assertFalse(consumer._client.send_fetch_request.called)
+
+    def test_pause_background_fetchers(self):
+        def fetch(reqs, **kwargs):
+            return [self.response(r.partition, range(r.offset, min(r.offset + 3, 10)))
+                    for r in reqs]
+
+        consumer = self.consumer(fetch, num_consumer_fetchers=2)
+        consumer.pause(("topic", 0))
+        offsets = {(b"topic", 0): [], (b"topic", 1): []}
+        for _ in range(100):
+            for tp, msgs in consumer.poll(timeout_ms=100).items():
+                offsets[tp].extend(m.offset for m in msgs)
+            if len(offsets[(b"topic", 1)]) >= 5:
+                break
+        self.assertEqual(offsets[(b"topic", 0)], [])
+
+        consumer.resume(("topic", 0))
+        for _ in range(100):
+            for tp, msgs in consumer.poll(timeout_ms=100).items():
+                offsets[tp].extend(m.offset for m in msgs)
+            if len(offsets[(b"topic", 0)]) >= 10:
+                break
+        consumer.close()
+        self.assertEqual(offsets, {(b"topic", 0): list(range(10)),
+                                   (b"topic", 1): list(range(5, 10))})
+
+    def test_bootstrap_offsets(self):
+        with patch('kafka.consumer.kafka.KafkaClient') as client_class:
+            client = client_class.return_value
+            client.topic_partitions = {b"topic": dict.fromkeys(range(4))}
+            client.get_partition_ids_for_topic.return_value = list(range(4))
+            client.send_offset_fetch_request.side_effect = lambda group, reqs, **kw: [
+                OffsetFetchResponse(r.topic, r.partition, 10 if r.partition < 2 else -1, None, 0)
+                for r in reqs]
+            client.send_offset_request.side_effect = lambda reqs, **kw: [
+                OffsetResponse(r.topic, r.partition, 0, (100 + r.partition,))
+                for r in reqs]
+            consumer = KafkaConsumer("topic", group_id="group",
+                                     bootstrap_servers=["localhost:9092"])
+
+        # Only the metadata of the topics to consume is loaded
+        _, kwargs = client_class.call_args
+        self.assertFalse(kwargs['bootstrap_metadata'])
+        client.load_metadata_for_topics.assert_called_once_with(b"topic")
+        with patch('kafka.consumer.kafka.time.sleep'):
+            consumer._refresh_metadata_on_error()
+        client.load_metadata_for_topics.assert_called_with(b"topic")
+        # One request of each for all the partitions
+        self.assertEqual(client.send_offset_fetch_request.call_count, 1)
+        (reqs,), _ = client.send_offset_request.call_args
+        self.assertEqual([r.partition for r in reqs], [2, 3])
+        self.assertEqual(consumer.offsets('fetch'),
+                         {(b"topic", 0): 10, (b"topic", 1): 10,
+                          (b"topic", 2): 102, (b"topic", 3): 103})
+
+    def test_async_commit(self):
+        failures = []
+        consumer = self.consumer([[self.response(0, range(3))]],
+                                 group_id="group", async_commit=True,
+                                 commit_callback=failures.append)
+        committer = consumer._committer.client
+        committer.send_offset_commit_request.side_effect = lambda group, reqs, **kw: [
+            OffsetCommitResponse(r.topic, r.partition, 0) for r in reqs]
+
+        for message in consumer.poll()[(b"topic", 0)]:
+            consumer.task_done(message)
+        self.assertTrue(consumer.commit())
+        consumer.close()
+
+        (group, reqs), _ = committer.send_offset_commit_request.call_args
+        self.assertEqual([(r.partition, r.offset) for r in reqs], [(0, 3)])
+        self.assertEqual(consumer.offsets('commit')[(b"topic", 0)], 3)
+        self.assertFalse(consumer._client.send_offset_commit_request.called)
+        self.assertEqual(failures, [])
+
+    def test_offset_storage_kafka(self):
+        consumer = self.consumer([[self.response(0, range(3))]],
+                                 group_id="group", offset_storage="kafka")
+        client = consumer._client
+        client.send_offset_commit_request_kafka.side_effect = lambda group, reqs, **kw: [
+            OffsetCommitResponse(r.topic, r.partition, 0) for r in reqs]
+
+        for message in consumer.poll()[(b"topic", 0)]:
+            consumer.task_done(message)
+        self.assertTrue(consumer.commit())
+
+        (group, reqs), _ = client.send_offset_commit_request_kafka.call_args
+        self.assertEqual((group, [(r.partition, r.offset) for r in reqs]),
+                         (b"group", [(0, 3)]))
+        self.assertFalse(client.send_offset_commit_request.called)
+
+        with self.assertRaises(KafkaConfigurationError):
+            self.consumer([], offset_storage="redis")
+
+
+class TestSplitFetchBudget(unittest.TestCase):
+    def test_proportional(self):
+        demands = [("a", 300, 10), ("b", 100, 10), ("c", 0, 10)]
+        self.assertEqual(_split_fetch_budget(demands, 1000),
+                         ({"a": 300, "b": 100, "c": 10}, 0))
+        self.assertEqual(_split_fetch_budget(demands, 200),
+                         ({"a": 150, "b": 50}, 2))
+
+    def test_rotation(self):
+        demands = [("a", 10, 10), ("b", 10, 10), ("c", 10, 10)]
+        self.assertEqual(_split_fetch_budget(demands, 20, 0),
+                         ({"a": 10, "b": 10}, 2))
+        self.assertEqual(_split_fetch_budget(demands, 20, 2),
+                         ({"c": 10, "a": 10}, 1))
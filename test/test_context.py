@@ -26,6 +26,19 @@ class TestOffsetCommitContext(unittest.TestCase):
         self.consumer.offsets = {self.partition: 0}
         self.context = OffsetCommitContext(self.consumer)
 
+    def test_offset_storage(self):
+        """
+        Should commit to the offset storage of the consumer by default.
+        """
+        self.consumer.offset_storage = "kafka"
+        context = OffsetCommitContext(self.consumer)
+
+        with context:
+            context.mark(self.partition, 0)
+
+        self.assertEqual(self.client.send_offset_commit_request_kafka.call_count, 1)
+        self.assertEqual(self.client.send_offset_commit_request.call_count, 0)
+
     def test_noop(self):
         """
         Should revert consumer after context exit with no mark() call.
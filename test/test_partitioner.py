@@ -0,0 +1,121 @@
+from collections import defaultdict
+
+from mock import MagicMock
+from . import unittest
+
+from kafka.common import BrokerMetadata, TopicAndPartition
+from kafka.partitioner import (
+    JumpHashPartitioner, LoadAwarePartitioner, Murmur2Partitioner
+)
+from kafka.partitioner.hashed import jump_hash
+from kafka.vectorized import has_numpy
+
+from test.testutil import random_string
+
+
+def count_picks(partitioner, n):
+    picks = defaultdict(int)
+    for _ in range(n):
+        picks[partitioner.partition(None)] += 1
+    return picks
+
+
+class TestLoadAwarePartitioner(unittest.TestCase):
+    def _client(self, latencies, inflight=None):
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0, 1, 2, 3]
+        client.topics_to_brokers = dict(
+            (TopicAndPartition(b'topic', p), BrokerMetadata(p % 2, b'host', 9092))
+            for p in range(4))
+        client.broker_latency = latencies
+        client.broker_inflight_bytes = inflight or {}
+        return client
+
+    def test_even_without_load(self):
+        partitioner = LoadAwarePartitioner.for_topic(self._client({}), b'topic')
+        picks = count_picks(partitioner, 100)
+        self.assertEqual(dict(picks), {0: 25, 1: 25, 2: 25, 3: 25})
+
+    def test_routes_away_from_slow_leader(self):
+        # broker 1 (partitions 1 and 3) is 4x slower than broker 0
+        client = self._client({0: 0.01, 1: 0.04})
+        partitioner = LoadAwarePartitioner.for_topic(client, b'topic')
+        picks = count_picks(partitioner, 100)
+        self.assertEqual(picks[0], picks[2])
+        self.assertEqual(picks[0], 4 * picks[1])
+        self.assertEqual(picks[1], picks[3])
+
+    def test_covers_every_partition(self):
+        client = self._client({0: 0.01, 1: 100.0}, {1: 10 * 1024 * 1024})
+        partitioner = LoadAwarePartitioner.for_topic(client, b'topic')
+        picks = count_picks(partitioner, 1000)
+        self.assertEqual(set(picks), set([0, 1, 2, 3]))
+        self.assertGreater(picks[0], 5 * picks[1])
+
+
+class TestMurmur2Partitioner(unittest.TestCase):
+    # expected partitions from the Java client's default partitioner
+    JAVA_PARTITIONS = [
+        (b'', 681), (b'a', 524), (b'ab', 434), (b'abc', 107),
+        (b'123456789', 566), (b'\x00 ', 742),
+    ]
+
+    def test_java_compatibility(self):
+        partitioner = Murmur2Partitioner(list(range(1000)))
+        for key, partition in self.JAVA_PARTITIONS:
+            self.assertEqual(partitioner.partition(key), partition)
+
+    def test_memoized(self):
+        partitioner = Murmur2Partitioner.memoized(2)(list(range(1000)))
+        for key, partition in self.JAVA_PARTITIONS:
+            self.assertEqual(partitioner.partition(key), partition)
+        self.assertEqual(list(partitioner._memo), [b'123456789', b'\x00 '])
+
+        # hits move keys to the end of the LRU
+        partitioner.partition(b'123456789')
+        self.assertEqual(list(partitioner._memo), [b'\x00 ', b'123456789'])
+
+    def test_partition_many(self):
+        partitioner = Murmur2Partitioner(list(range(1000)))
+        keys = [key for key, _ in self.JAVA_PARTITIONS]
+        self.assertEqual(partitioner.partition_many(keys),
+                         [partition for _, partition in self.JAVA_PARTITIONS])
+
+    @unittest.skipUnless(has_numpy(), "numpy not available")
+    def test_partition_many_array(self):
+        import numpy as np
+        partitioner = Murmur2Partitioner(list(range(1000)))
+        for width in range(9):
+            keys = [random_string(width) for _ in range(20)]
+            array = np.frombuffer(b''.join(keys), dtype=np.uint8)
+            array = array.reshape(len(keys), width)
+            self.assertEqual(partitioner.partition_many(array),
+                             partitioner.partition_many(keys))
+
+
+class TestJumpHashPartitioner(unittest.TestCase):
+    def test_jump_hash(self):
+        # reference values from the paper's C++ implementation
+        self.assertEqual(jump_hash(0, 1), 0)
+        self.assertEqual([jump_hash(key, 10) for key in range(5)],
+                         [0, 6, 6, 8, 1])
+        self.assertEqual(jump_hash(0xdeadbeef, 1000), 285)
+        self.assertEqual(jump_hash(123456789, 100000), 42483)
+
+    def test_minimal_remapping(self):
+        keys = [random_string(10) for _ in range(1000)]
+        before = JumpHashPartitioner(list(range(10))).partition_many(keys)
+        after = JumpHashPartitioner(list(range(11))).partition_many(keys)
+
+        moved = [(b, a) for b, a in zip(before, after) if b != a]
+        self.assertTrue(all(a == 10 for _, a in moved))
+        self.assertLess(len(moved), 150)
+
+    @unittest.skipUnless(has_numpy(), "numpy not available")
+    def test_partition_many_array(self):
+        import numpy as np
+        partitioner = JumpHashPartitioner(list(range(37)))
+        keys = [random_string(6) for _ in range(100)]
+        array = np.frombuffer(b''.join(keys), dtype=np.uint8).reshape(100, 6)
+        self.assertEqual(partitioner.partition_many(array),
+                         partitioner.partition_many(keys))
@@ -1,11 +1,23 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import time
+from threading import Thread
 
-from mock import MagicMock
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from mock import MagicMock, patch
 from . import unittest
 
+from kafka.common import (
+    FailedPayloadsError, FlushResult, KafkaConfigurationError,
+    KafkaTimeoutError, ProduceResponse
+)
 from kafka.producer.base import Producer
+from kafka.producer.multiprocess import _mp_produce, STOP_PRODUCER_PROCESS
 
 
 class TestKafkaProducer(unittest.TestCase):
@@ -21,7 +33,8 @@ class TestKafkaProducer(unittest.TestCase):
                 logging.debug("attempting to send message of type %s", type(m))
                 producer.send_messages(topic, partition, m)
 
-        good_data_types = (b'a string!',)
+        good_data_types = (b'a string!', bytearray(b'a bytearray!'),
+                           memoryview(b'a memoryview!'))
         for m in good_data_types:
             # This should not raise an exception
             producer.send_messages(topic, partition, m)
@@ -40,3 +53,297 @@ class TestKafkaProducer(unittest.TestCase):
         topic = b"test-topic"
         producer.send_messages(topic, b'hi')
         assert client.send_produce_request.called
+
+    def test_sticky_partitioning(self):
+        from kafka.producer.simple import SimpleProducer
+
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0, 1, 2]
+
+        producer = SimpleProducer(client, random_start=False, sticky=True,
+                                  batch_send=True, batch_send_every_n=100,
+                                  batch_send_every_t=60)
+        topic = b"test-topic"
+        partitions = []
+        for _ in range(3):
+            producer.send_messages(topic, b'hi')
+            partitions.append(producer.sticky_partitions[topic][0])
+
+        # Moves on once the batch is sent, e.g. flushed
+        producer.flush(timeout=5)
+        producer.send_messages(topic, b'hi')
+        partitions.append(producer.sticky_partitions[topic][0])
+        producer.flush(timeout=5)
+        producer.send_messages(topic, b'hi')
+        partitions.append(producer.sticky_partitions[topic][0])
+        producer.stop()
+
+        self.assertEqual(partitions, [0, 0, 0, 1, 2])
+
+        with self.assertRaises(KafkaConfigurationError):
+            SimpleProducer(client, sticky=True)
+
+    def test_partition_count_change(self):
+        from kafka.producer.keyed import KeyedProducer
+
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0, 1]
+        client.topic_partitions = {b"test-topic": dict.fromkeys([0, 1])}
+
+        producer = KeyedProducer(client)
+        topic = b"test-topic"
+        producer.send_messages(topic, b'key', b'hi')
+        self.assertEqual(producer.partitioners[topic].partitions, [0, 1])
+
+        client.get_partition_ids_for_topic.return_value = [0, 1, 2]
+        client.topic_partitions[topic][2] = None
+        producer.send_messages(topic, b'key', b'hi')
+        self.assertEqual(producer.partitioners[topic].partitions, [0, 1, 2])
+
+    def test_partitioner_without_for_topic(self):
+        from kafka.producer.keyed import KeyedProducer
+
+        class LastPartitioner(object):
+            def __init__(self, partitions):
+                self.last = partitions[-1]
+
+            def partition(self, key, partitions=None):
+                return self.last
+
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0, 1, 2]
+        producer = KeyedProducer(client, partitioner=LastPartitioner)
+        producer.send_messages(b"test-topic", b'key', b'hi')
+        producer.send_messages(b"test-topic", b'key', b'hi')
+
+        (req,), _ = client.send_produce_request.call_args
+        self.assertEqual(req[0].partition, 2)
+
+    def test_max_message_set_bytes(self):
+        client = MagicMock()
+        producer = Producer(client, max_message_set_bytes=100)
+        producer.send_messages(b"test-topic", 0, *[b"x" * 20] * 5)
+
+        calls = client.send_produce_request.call_args_list
+        self.assertEqual([len(call[0][0][0].messages) for call in calls],
+                         [2, 2, 1])
+
+    def test_max_message_set_bytes_failure(self):
+        client = MagicMock()
+        upstream = client.copy.return_value
+        calls = []
+
+        def send(reqs, **kwargs):
+            calls.append([r.partition for r in reqs])
+            return [FailedPayloadsError(r) if len(calls) == 2 and r.partition == 0
+                    else ProduceResponse(r.topic, r.partition, 0, 0) for r in reqs]
+        upstream.send_produce_request.side_effect = send
+
+        producer = Producer(client, batch_send=True, batch_send_every_n=100,
+                            batch_send_every_t=60, max_message_set_bytes=100)
+        producer.send_messages(b"test-topic", 0, *[b"x" * 40] * 5)
+        producer.send_messages(b"test-topic", 1, *[b"y" * 40] * 5)
+        result = producer.flush(timeout=5)
+        producer.stop()
+
+        # Partition 0 stops at its failed message set, partition 1 goes on
+        self.assertEqual([sorted(c) for c in calls],
+                         [[0, 1], [0, 1], [1], [1], [1]])
+        self.assertEqual(result[:3], (5, 200, 5))
+
+    def test_chunk_size(self):
+        client = MagicMock()
+        producer = Producer(client, chunk_size=10)
+        producer.send_messages(b"test-topic", 0, b"x" * 25, b"small")
+
+        (req,), _ = client.send_produce_request.call_args
+        self.assertEqual(len(req[0].messages), 4)
+        self.assertEqual(req[0].messages[3].value, b"small")
+
+    @patch('kafka.producer.base.time')
+    @patch('kafka.util.time')
+    def test_rate_limit(self, util_time, base_time):
+        util_time.time.return_value = 100.0
+        producer = Producer(MagicMock(), max_bytes_per_sec=100,
+                            max_messages_per_sec=10, rate_limit_per_topic=True)
+
+        producer.send_messages(b"topic-a", 0, b"x" * 50, b"x" * 50)
+        self.assertFalse(base_time.sleep.called)
+
+        producer.send_messages(b"topic-a", 0, b"x" * 50)
+        base_time.sleep.assert_called_once_with(0.5)
+
+        # Other topics have their own buckets
+        base_time.sleep.reset_mock()
+        producer.send_messages(b"topic-b", 0, *[b"x"] * 12)
+        base_time.sleep.assert_called_once_with(0.2)
+
+    def test_priority_lanes(self):
+        client = MagicMock()
+        producer = Producer(client, batch_send=True, batch_send_every_n=100,
+                            batch_send_every_t=60, priorities={10: (1, 0)},
+                            topic_priorities={b"alerts": 10})
+        upstream = client.copy.return_value
+
+        producer.send_messages(b"bulk", 0, b"a", b"b")
+        producer.send_messages(b"alerts", 0, b"fire")
+        producer.send_messages(b"bulk", 0, b"urgent", priority=10)
+        for _ in range(100):
+            if upstream.send_produce_request.call_count >= 2:
+                break
+            time.sleep(0.01)
+
+        sent = [[(r.topic, len(r.messages)) for r in call[0][0]]
+                for call in upstream.send_produce_request.call_args_list]
+        self.assertEqual(sent, [[(b"alerts", 1)], [(b"bulk", 1)]])
+
+        producer.stop()
+        sent = [[(r.topic, len(r.messages)) for r in call[0][0]]
+                for call in upstream.send_produce_request.call_args_list]
+        self.assertEqual(sent[2:], [[(b"bulk", 2)]])
+
+        with self.assertRaises(ValueError):
+            producer.send_messages(b"bulk", 0, b"a", priority=5)
+
+    def test_flush(self):
+        client = MagicMock()
+        producer = Producer(client, batch_send=True, batch_send_every_n=100,
+                            batch_send_every_t=60, priorities={10: (100, 60)})
+        upstream = client.copy.return_value
+
+        producer.send_messages(b"topic", 0, b"a", b"bc")
+        producer.send_messages(b"topic", 1, b"def", priority=10)
+        result = producer.flush(timeout=5)
+        self.assertEqual(result[:3], (3, 6, 0))
+        self.assertIsInstance(result, FlushResult)
+        self.assertEqual(upstream.send_produce_request.call_count, 2)
+
+        # Nothing left to flush, and the producer keeps running
+        self.assertEqual(producer.flush(timeout=5)[:3], (0, 0, 0))
+        upstream.send_produce_request.side_effect = Exception("down")
+        producer.send_messages(b"topic", 0, b"g")
+        self.assertEqual(producer.flush(timeout=5)[:3], (0, 0, 1))
+        producer.stop()
+
+        self.assertEqual(producer.flush(), (0, 0, 0, 0.0))
+        self.assertEqual(Producer(client).flush(), (0, 0, 0, 0.0))
+
+    def test_flush_timeout(self):
+        client = MagicMock()
+        upstream = client.copy.return_value
+        upstream.send_produce_request.side_effect = lambda *a, **kw: time.sleep(0.2) or []
+        producer = Producer(client, batch_send=True, batch_send_every_n=100,
+                            batch_send_every_t=60)
+
+        producer.send_messages(b"topic", 0, b"a")
+        with self.assertRaises(KafkaTimeoutError):
+            producer.flush(timeout=0.01)
+        producer.stop()
+
+    def test_flush_stopped_sender(self):
+        client = MagicMock()
+        upstream = client.copy.return_value
+        upstream.send_produce_request.side_effect = lambda *a, **kw: time.sleep(0.3) or []
+        producer = Producer(client, batch_send=True, batch_send_every_n=1,
+                            batch_send_every_t=60)
+
+        producer.send_messages(b"topic", 0, b"a")
+        time.sleep(0.1)  # sending a
+        producer.send_messages(b"topic", 0, b"b")
+        results = Queue()
+        flusher = Thread(target=lambda: results.put(producer.flush()))
+        flusher.daemon = True
+        flusher.start()
+        time.sleep(0.1)
+
+        # The sender stops after sending a, b is left unsent
+        producer.stop(timeout=0.01)
+        flusher.join(5)
+        self.assertEqual(results.get_nowait()[:3], (1, 1, 1))
+
+        producer.thread.join(5)
+        producer.stopped = False
+        self.assertEqual(producer.flush(), (0, 0, 0, 0.0))
+
+    def test_serializers(self):
+        from kafka.producer.keyed import KeyedProducer
+
+        class BatchSerializer(object):
+            def __init__(self):
+                self.batches = []
+
+            def __call__(self, value):
+                raise AssertionError("serialize_batch should be used")
+
+            def serialize_batch(self, values):
+                self.batches.append(values)
+                return [str(v).encode('ascii') for v in values]
+
+        client = MagicMock()
+        client.get_partition_ids_for_topic.return_value = [0, 1]
+        serializer = BatchSerializer()
+        producer = KeyedProducer(client, key_serializer=lambda k: k.encode('utf-8'),
+                                 value_serializer=serializer)
+        producer.send_messages(b"topic", u"key", 1, 2.5)
+
+        self.assertEqual(serializer.batches, [[1, 2.5]])
+        (req,), _ = client.send_produce_request.call_args
+        self.assertEqual([(m.key, m.value) for m in req[0].messages],
+                         [(b"key", b"1"), (b"key", b"2.5")])
+
+    def test_serialize_in_sender(self):
+        client = MagicMock()
+        batches = []
+
+        def serialize(value):
+            batches.append(value)
+            return value.encode('utf-8')
+
+        producer = Producer(client, batch_send=True, batch_send_every_n=3,
+                            batch_send_every_t=60, value_serializer=serialize,
+                            serialize_in_sender=True)
+        producer.send_messages(b"topic", 0, u"a", u"b")
+        producer.send_messages(b"topic", 1, u"c")
+        producer.stop()
+
+        upstream = client.copy.return_value
+        (reqs,), _ = upstream.send_produce_request.call_args
+        self.assertEqual(sorted((r.partition, [m.value for m in r.messages])
+                                for r in reqs),
+                         [(0, [b"a", b"b"]), (1, [b"c"])])
+        self.assertEqual(sorted(batches), [u"a", u"b", u"c"])
+
+        with self.assertRaises(KafkaConfigurationError):
+            Producer(client, value_serializer=serialize,
+                     serialize_in_sender=True)
+
+
+class TestMultiProcessProducer(unittest.TestCase):
+    def test_mp_produce(self):
+        client = MagicMock()
+        client.send_produce_request.side_effect = lambda reqs, **kw: [
+            FailedPayloadsError(r) if r.partition == 1 else
+            ProduceResponse(r.topic, r.partition, 0, 0) for r in reqs]
+
+        queue, results = Queue(), Queue()
+        queue.put((b"topic", 0, [u"a", u"b"], None))
+        queue.put((b"topic", 1, [u"c"], b"key"))
+        queue.put((b"topic", 0, [u"d"], None))
+        queue.put(STOP_PRODUCER_PROCESS)
+
+        serialize = lambda value: value.encode('utf-8')
+        _mp_produce(client, queue, results, 0, 1, 1000, 10, 60,
+                    value_serializer=serialize)
+        client.reinit.assert_called_once_with()
+
+        (reqs,), _ = client.send_produce_request.call_args
+        self.assertEqual(sorted((r.partition, [(m.key, m.value) for m in r.messages])
+                                for r in reqs),
+                         [(0, [(None, b"a"), (None, b"b"), (None, b"d")]),
+                          (1, [(b"key", b"c")])])
+
+        # The failed partition is left out of the bytes sent
+        (count, size, failures) = results.get_nowait()
+        self.assertEqual((count, size), (4, 3))
+        self.assertEqual([f[:3] for f in failures], [(b"topic", 1, 1)])
+        self.assertIs(results.get_nowait(), STOP_PRODUCER_PROCESS)
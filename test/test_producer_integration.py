@@ -5,7 +5,7 @@ import uuid
 from six.moves import range
 
 from kafka import (
-    SimpleProducer, KeyedProducer,
+    SimpleProducer, KeyedProducer, MultiProcessProducer,
     create_message, create_gzip_message, create_snappy_message,
     RoundRobinPartitioner, HashedPartitioner
 )
@@ -397,6 +397,23 @@ class TestKafkaProducerIntegration(KafkaIntegrationTestCase):
 
         producer.stop()
 
+    @kafka_versions("all")
+    def test_multiprocess_producer(self):
+        partitions = self.client.get_partition_ids_for_topic(self.topic)
+        start_offsets = [self.current_offset(self.topic, p) for p in partitions]
+
+        producer = MultiProcessProducer(self.client, num_procs=2,
+                                        batch_send_every_t=0.1)
+        for p in partitions:
+            producer.send_messages(self.topic, p, self.msg("one"), self.msg("two"))
+        producer.stop()
+
+        self.assertEqual(producer.messages_sent, 2 * len(partitions))
+        self.assertEqual(producer.failures, [])
+        for p, start_offset in zip(partitions, start_offsets):
+            self.assert_fetch_offset(p, start_offset,
+                                     [self.msg("one"), self.msg("two")])
+
     ############################
     #   Producer ACK Tests     #
     ############################
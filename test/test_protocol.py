@@ -7,7 +7,7 @@ from . import unittest
 
 from kafka.codec import has_snappy, gzip_decode, snappy_decode
 from kafka.common import (
-    OffsetRequest, OffsetCommitRequest, OffsetFetchRequest,
+    ConsumerMetadataResponse, OffsetRequest, OffsetCommitRequest, OffsetFetchRequest,
     OffsetResponse, OffsetCommitResponse, OffsetFetchResponse,
     ProduceRequest, FetchRequest, Message, ChecksumError,
     ProduceResponse, FetchResponse, OffsetAndMessage,
@@ -18,7 +18,7 @@ from kafka.common import (
 from kafka.protocol import (
     ATTRIBUTE_CODEC_MASK, CODEC_NONE, CODEC_GZIP, CODEC_SNAPPY, KafkaProtocol,
     create_message, create_gzip_message, create_snappy_message,
-    create_message_set
+    create_message_set, create_message_sets, split_messages
 )
 
 class TestProtocol(unittest.TestCase):
@@ -173,6 +173,50 @@ class TestProtocol(unittest.TestCase):
 
         self.assertEqual(encoded, expect)
 
+    def test_split_messages(self):
+        messages = [(b"a" * 10, None), (b"b" * 10, b"k"), (b"c" * 100, None),
+                    (b"d", None)]
+        # 26 bytes of overhead per message
+        self.assertEqual(split_messages(messages, 80),
+                         [messages[:2], messages[2:3], messages[3:]])
+        self.assertEqual(split_messages(messages, 1000), [messages])
+
+    def test_create_message_sets(self):
+        messages = [(str(i).encode('ascii') * 40, None) for i in range(10)]
+        message_sets = create_message_sets(messages, max_bytes=200)
+        for message_set in message_sets:
+            self.assertLessEqual(
+                len(KafkaProtocol._encode_message_set(message_set)), 200)
+        self.assertEqual([m.value for ms in message_sets for m in ms],
+                         [m for m, _ in messages])
+
+        self.assertEqual(create_message_sets(messages),
+                         [create_message_set(messages)])
+
+    def test_create_message_sets_compressed(self):
+        # Random payloads do not compress, so some wrappers have to be split
+        # again after compression
+        messages = [(struct.pack('>Q', i * 0x9e3779b97f4a7c15 % (1 << 64)) * 4,
+                     None) for i in range(50)]
+        message_sets = create_message_sets(messages, CODEC_GZIP, max_bytes=400)
+        self.assertGreater(len(message_sets), 1)
+
+        payloads = []
+        for (wrapper,) in message_sets:
+            self.assertLessEqual(
+                len(KafkaProtocol._encode_message_set([wrapper])), 400)
+            payloads.extend(m.message.value for m in
+                            KafkaProtocol._decode_message_set_iter(
+                                gzip_decode(wrapper.value)))
+        self.assertEqual(payloads, [m for m, _ in messages])
+
+    def test_encode_message_buffers(self):
+        expect = KafkaProtocol._encode_message(create_message(b"test", b"key"))
+        for payload in (bytearray(b"test"), memoryview(b"xtestx")[1:5]):
+            encoded = KafkaProtocol._encode_message(
+                create_message(payload, b"key"))
+            self.assertEqual(encoded, expect)
+
     def test_decode_message(self):
         encoded = b"".join([
             struct.pack(">i", -1427009701), # CRC
@@ -749,6 +793,89 @@ class TestProtocol(unittest.TestCase):
             OffsetFetchResponse(topic = b'topic1', partition = 4, offset = 8, error = 0, metadata = b"meta"),
         ]))
 
+    def test_encode_offset_commit_request_v1(self):
+        expected = b"".join([
+            struct.pack('>i', 77),               # Total message length
+            struct.pack('>h', 8),                # Message type = offset commit
+            struct.pack('>h', 1),                # API version
+            struct.pack('>i', 42),               # Correlation ID
+            struct.pack('>h9s', 9, b"client_id"),# The client ID
+            struct.pack('>h8s', 8, b"group_id"), # The group to commit for
+            struct.pack('>i', -1),               # No group generation
+            struct.pack('>h', 0),                # No consumer id
+            struct.pack('>i', 1),                # Num topics
+            struct.pack(">h6s", 6, b"topic1"),   # Topic for the request
+            struct.pack(">i", 1),                # One partition
+            struct.pack(">i", 0),                # Partition 0
+            struct.pack(">q", 123),              # Offset 123
+            struct.pack(">q", -1),               # Broker timestamp
+            struct.pack(">h4s", 4, b"meta"),     # Metadata
+        ])
+
+        encoded = KafkaProtocol.encode_offset_commit_request(b"client_id", 42, b"group_id", [
+            OffsetCommitRequest(b"topic1", 0, 123, b"meta"),
+        ], version=1)
+
+        self.assertEqual(encoded, expected)
+
+    def test_encode_offset_commit_request_v2(self):
+        expected = b"".join([
+            struct.pack('>i', 77),               # Total message length
+            struct.pack('>h', 8),                # Message type = offset commit
+            struct.pack('>h', 2),                # API version
+            struct.pack('>i', 42),               # Correlation ID
+            struct.pack('>h9s', 9, b"client_id"),# The client ID
+            struct.pack('>h8s', 8, b"group_id"), # The group to commit for
+            struct.pack('>i', -1),               # No group generation
+            struct.pack('>h', 0),                # No consumer id
+            struct.pack('>q', -1),               # Default retention time
+            struct.pack('>i', 1),                # Num topics
+            struct.pack(">h6s", 6, b"topic1"),   # Topic for the request
+            struct.pack(">i", 1),                # One partition
+            struct.pack(">i", 0),                # Partition 0
+            struct.pack(">q", 123),              # Offset 123
+            struct.pack(">h4s", 4, b"meta"),     # Metadata
+        ])
+
+        encoded = KafkaProtocol.encode_offset_commit_request(b"client_id", 42, b"group_id", [
+            OffsetCommitRequest(b"topic1", 0, 123, b"meta"),
+        ], version=2)
+
+        self.assertEqual(encoded, expected)
+
+    def test_encode_offset_fetch_request_v1(self):
+        encoded = KafkaProtocol.encode_offset_fetch_request(b"client_id", 42, b"group_id", [
+            OffsetFetchRequest(b"topic1", 0),
+        ], version=1)
+
+        self.assertEqual(encoded[4:8], struct.pack('>hh', 9, 1))
+
+    def test_encode_consumer_metadata_request(self):
+        expected = b"".join([
+            struct.pack('>i', 29),               # Total message length
+            struct.pack('>h', 10),               # Message type = consumer metadata
+            struct.pack('>h', 0),                # API version
+            struct.pack('>i', 42),               # Correlation ID
+            struct.pack('>h9s', 9, b"client_id"),# The client ID
+            struct.pack('>h8s', 8, b"group_id"), # The group
+        ])
+
+        encoded = KafkaProtocol.encode_consumer_metadata_request(b"client_id", 42, b"group_id")
+
+        self.assertEqual(encoded, expected)
+
+    def test_decode_consumer_metadata_response(self):
+        encoded = b"".join([
+            struct.pack(">i", 42),            # Correlation ID
+            struct.pack(">h", 0),             # No error
+            struct.pack(">i", 3),             # Coordinator id
+            struct.pack(">h9s", 9, b"localhost"), # Coordinator host
+            struct.pack(">i", 9092),          # Coordinator port
+        ])
+
+        self.assertEqual(KafkaProtocol.decode_consumer_metadata_response(encoded),
+                         ConsumerMetadataResponse(0, 3, b"localhost", 9092))
+
     @contextmanager
     def mock_create_message_fns(self):
         import kafka.protocol
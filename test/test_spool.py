@@ -0,0 +1,176 @@
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock
+from . import unittest
+
+from kafka.common import (
+    EncodedMessageSet, FailedPayloadsError, ProduceRequest, ProduceResponse
+)
+from kafka.producer.base import Producer, _send_spooled
+from kafka.producer.spool import DiskSpool
+from kafka.protocol import KafkaProtocol, create_message
+
+
+def request(partition, *values):
+    return ProduceRequest(b"topic", partition,
+                          [create_message(v) for v in values])
+
+
+def values(req):
+    return [m.message.value for m in
+            KafkaProtocol._decode_message_set_iter(req.messages.buffer)]
+
+
+class TestDiskSpool(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def segment_files(self):
+        return sorted(f for f in os.listdir(self.path) if f.endswith('.log'))
+
+    def test_memory(self):
+        spool = DiskSpool(self.path)
+        spool.append([request(0, b"a", b"b"), request(1, b"c")])
+        self.assertEqual(self.segment_files(), [])
+
+        reqs = spool.peek(10)
+        self.assertEqual([r.partition for r in reqs], [0, 1])
+        self.assertIsInstance(reqs[0].messages, EncodedMessageSet)
+        self.assertEqual(reqs[0].messages.count, 2)
+        self.assertEqual(values(reqs[0]), [b"a", b"b"])
+
+        spool.ack(2)
+        self.assertTrue(spool.empty())
+        spool.close()
+
+    def test_spill_to_disk_in_order(self):
+        spool = DiskSpool(self.path, memory_bytes=40)
+        for i in range(5):
+            spool.append([request(i, str(i).encode('ascii') * 10)])
+        self.assertEqual(len(spool.memory), 1)
+        self.assertEqual(len(self.segment_files()), 1)
+
+        order = []
+        while not spool.empty():
+            reqs = spool.peek(2)
+            order.extend(values(r)[0][:1] for r in reqs)
+            spool.ack(len(reqs))
+        self.assertEqual(order, [b"0", b"1", b"2", b"3", b"4"])
+        spool.close()
+
+    def test_one_request_per_partition(self):
+        spool = DiskSpool(self.path, memory_bytes=0)
+        spool.append([request(0, b"a"), request(1, b"b"), request(0, b"c")])
+        self.assertEqual([values(r) for r in spool.peek(10)], [[b"a"], [b"b"]])
+        spool.close()
+
+    def test_resend_after_crash(self):
+        spool = DiskSpool(self.path, memory_bytes=0)
+        spool.append([request(0, b"a"), request(0, b"b"), request(0, b"c")])
+        spool.peek(1)
+        spool.ack(1)
+
+        # Not closed, as if the process died
+        recovered = DiskSpool(self.path, memory_bytes=0)
+        reqs = recovered.peek(1)
+        self.assertEqual(values(reqs[0]), [b"b"])
+        recovered.ack(1)
+        recovered.append([request(0, b"d")])
+
+        sent = []
+        while not recovered.empty():
+            reqs = recovered.peek(1)
+            sent.extend(values(reqs[0]))
+            recovered.ack(1)
+        self.assertEqual(sent, [b"c", b"d"])
+        recovered.close()
+        spool.close()
+
+    def test_save_memory_on_close(self):
+        spool = DiskSpool(self.path, memory_bytes=40)
+        for i in range(3):
+            spool.append([request(i, str(i).encode('ascii') * 10)])
+        self.assertEqual(len(spool.memory), 1)
+        spool.close()
+
+        # Requests held in memory are sent first, then the journal
+        reopened = DiskSpool(self.path, memory_bytes=40)
+        sent = []
+        while not reopened.empty():
+            reqs = reopened.peek(1)
+            sent.extend(values(reqs[0]))
+            reopened.ack(1)
+        self.assertEqual(sent, [b"0" * 10, b"1" * 10, b"2" * 10])
+        reopened.close()
+
+        # Acknowledged, so not sent again
+        restarted = DiskSpool(self.path)
+        self.assertTrue(restarted.empty())
+        restarted.close()
+
+    def test_segments(self):
+        spool = DiskSpool(self.path, memory_bytes=0, segment_bytes=100)
+        spool.append([request(i, b"x" * 20) for i in range(4)])
+        self.assertEqual(len(self.segment_files()), 4)
+
+        reqs = spool.peek(3)
+        self.assertEqual(len(reqs), 3)
+        spool.ack(3)
+        self.assertEqual(len(self.segment_files()), 1)
+        spool.close()
+
+        spool = DiskSpool(self.path, memory_bytes=0, segment_bytes=100)
+        self.assertEqual([r.partition for r in spool.peek(10)], [3])
+        spool.close()
+
+
+class TestSendSpooled(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.spool = DiskSpool(self.path)
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.path)
+
+    def test_send(self):
+        client = MagicMock()
+        client.send_produce_request.side_effect = lambda reqs, **kw: [
+            ProduceResponse(r.topic, r.partition, 0, 0) for r in reqs]
+        self.spool.append([request(0, b"a"), request(1, b"b")])
+
+        self.assertTrue(_send_spooled(client, self.spool, 10, 1, 1000))
+        self.assertTrue(self.spool.empty())
+
+    def test_keep_failed(self):
+        client = MagicMock()
+        self.spool.append([request(0, b"a"), request(1, b"b"), request(2, b"c")])
+
+        client.send_produce_request.side_effect = lambda reqs, **kw: [
+            ProduceResponse(reqs[0].topic, 0, 0, 0),
+            FailedPayloadsError(reqs[1]),
+            ProduceResponse(reqs[2].topic, 2, 0, 0)]
+        self.assertFalse(_send_spooled(client, self.spool, 10, 1, 1000))
+        self.assertEqual([r.partition for r in self.spool.peek(10)], [1, 2])
+
+        client.send_produce_request.side_effect = Exception("down")
+        self.assertFalse(_send_spooled(client, self.spool, 10, 1, 1000))
+        self.assertEqual([r.partition for r in self.spool.peek(10)], [1, 2])
+
+    def test_flush(self):
+        client = MagicMock()
+        upstream = client.copy.return_value
+        upstream.send_produce_request.side_effect = lambda reqs, **kw: [
+            ProduceResponse(r.topic, r.partition, 0, 0) for r in reqs]
+        producer = Producer(client, batch_send=True, batch_send_every_n=100,
+                            batch_send_every_t=60, spool=self.spool)
+
+        producer.send_messages(b"topic", 0, b"a", b"b")
+        self.assertEqual(producer.flush(timeout=5)[:3], (2, 2, 0))
+        self.assertTrue(self.spool.empty())
+        producer.stop()
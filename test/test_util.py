@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
+import array
+import mmap
 import struct
 
 import six
+from mock import patch
 from . import unittest
 
 import kafka.common
@@ -30,6 +33,17 @@ class UtilTest(unittest.TestCase):
             self.assertIn('str', str(te))
         self.assertIn('to be bytes', str(te))
 
+    def test_write_int_string__buffers(self):
+        data = b'some string'
+        mm = mmap.mmap(-1, len(data))
+        mm.write(data)
+        for buf in (bytearray(data), memoryview(data), mm,
+                    array.array('b', data)):
+            self.assertEqual(
+                kafka.util.write_int_string(buf),
+                b'\x00\x00\x00\x0bsome string'
+            )
+
     def test_write_int_string__empty(self):
         self.assertEqual(
             kafka.util.write_int_string(b''),
@@ -124,3 +138,21 @@ class UtilTest(unittest.TestCase):
                 3: t("b", 3),
             }
         })
+
+    @patch('kafka.util.time')
+    def test_token_bucket(self, time):
+        time.time.return_value = 100.0
+        bucket = kafka.util.TokenBucket(10, capacity=20)
+        self.assertEqual(bucket.reserve(15), 0)
+        self.assertEqual(bucket.reserve(10), 0.5)
+
+        # Refills at rate, up to capacity
+        time.time.return_value = 101.0
+        self.assertEqual(bucket.reserve(5), 0)
+        time.time.return_value = 1000.0
+        self.assertEqual(bucket.reserve(30), 1.0)
+
+    def test_token_bucket__invalid_rate(self):
+        with self.assertRaises(ValueError):
+            kafka.util.TokenBucket(0)
+
@@ -0,0 +1,68 @@
+import struct
+
+from . import unittest
+
+from kafka.codec import gzip_decode
+from kafka.common import EncodedMessageSet, ProduceRequest
+from kafka.protocol import (
+    ATTRIBUTE_CODEC_MASK, CODEC_GZIP, KafkaProtocol, create_message
+)
+from kafka.vectorized import has_numpy, create_message_set_from_array
+
+if has_numpy():
+    import numpy as np
+
+
+@unittest.skipUnless(has_numpy(), "numpy not available")
+class TestVectorized(unittest.TestCase):
+    def test_uint8_rows(self):
+        values = np.frombuffer(b"abcdefgh", dtype=np.uint8).reshape(4, 2)
+        message_set = create_message_set_from_array(values)
+        self.assertIsInstance(message_set, EncodedMessageSet)
+        self.assertEqual(message_set.count, 4)
+
+        expect = KafkaProtocol._encode_message_set(
+            [create_message(v) for v in (b"ab", b"cd", b"ef", b"gh")])
+        self.assertEqual(KafkaProtocol._encode_message_set(message_set), expect)
+
+    def test_structured_array_with_keys(self):
+        records = np.zeros(3, dtype=[('id', '>u2'), ('value', '>f4')])
+        records['id'] = [1, 2, 3]
+        records['value'] = [0.5, 1.5, 2.5]
+        keys = np.frombuffer(b"k1k2k3", dtype=np.uint8).reshape(3, 2)
+        message_set = create_message_set_from_array(records, keys)
+
+        expect = KafkaProtocol._encode_message_set([
+            create_message(struct.pack('>Hf', i, v), k)
+            for i, v, k in ((1, 0.5, b"k1"), (2, 1.5, b"k2"), (3, 2.5, b"k3"))
+        ])
+        self.assertEqual(KafkaProtocol._encode_message_set(message_set), expect)
+
+        decoded = list(KafkaProtocol._decode_message_set_iter(expect))
+        self.assertEqual([m.message.key for m in decoded], [b"k1", b"k2", b"k3"])
+
+    def test_produce_request(self):
+        values = np.frombuffer(b"abcd", dtype=np.uint8).reshape(2, 2)
+        encoded = KafkaProtocol.encode_produce_request(b"client", 1, [
+            ProduceRequest(b"topic", 0, create_message_set_from_array(values))
+        ])
+        expect = KafkaProtocol.encode_produce_request(b"client", 1, [
+            ProduceRequest(b"topic", 0, [create_message(b"ab"),
+                                         create_message(b"cd")])
+        ])
+        self.assertEqual(encoded, expect)
+
+    def test_gzip(self):
+        values = np.frombuffer(b"abcd", dtype=np.uint8).reshape(2, 2)
+        (message,) = create_message_set_from_array(values, codec=CODEC_GZIP)
+        self.assertEqual(message.attributes, ATTRIBUTE_CODEC_MASK & CODEC_GZIP)
+        self.assertEqual(gzip_decode(message.value),
+                         KafkaProtocol._encode_message_set(
+                             [create_message(b"ab"), create_message(b"cd")]))
+
+    def test_bad_arrays(self):
+        with self.assertRaises(TypeError):
+            create_message_set_from_array(np.zeros(4, dtype=np.float64))
+        with self.assertRaises(ValueError):
+            create_message_set_from_array(np.zeros((4, 2), dtype=np.uint8),
+                                          np.zeros((3, 2), dtype=np.uint8))